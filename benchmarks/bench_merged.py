@@ -0,0 +1,56 @@
+"""
+Compare the c `merged` and `deep_merged` with the python reference
+implementations.
+
+    python benchmarks/bench_merged.py
+"""
+import timeit
+
+from tri_struct import (
+    FastStruct,
+    PyStruct,
+    deep_merged,
+    merged,
+    py_deep_merged,
+    py_merged,
+)
+
+
+def best_of(func):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def config_tree(struct_type, width, depth):
+    if depth == 0:
+        return struct_type(('leaf_%d' % i, i) for i in range(width))
+    return struct_type(('node_%d' % i, config_tree(struct_type, width, depth - 1)) for i in range(width))
+
+
+def main():
+    for type_name, struct_type in [('PyStruct', PyStruct), ('FastStruct', FastStruct)]:
+        if struct_type is None:
+            continue
+        for size in (1, 10, 100):
+            defaults = struct_type(('default_%d' % i, i) for i in range(size))
+            config = struct_type(('config_%d' % i, i) for i in range(size))
+            overrides = dict(config_0=-1, extra=True)
+
+            for name, merge in [('python', py_merged), ('c', merged)]:
+                best = best_of(lambda: merge(defaults, config, overrides, last=1))
+                print('%-10s %4d keys  %-6s %8.3f us' % (type_name, size, name, best * 1e6))
+
+    # 30 levels of small overrides on top of a 10x10x10 tree
+    for type_name, struct_type in [('PyStruct', PyStruct), ('FastStruct', FastStruct)]:
+        if struct_type is None:
+            continue
+        base = config_tree(struct_type, 10, 2)
+        levels = [struct_type(node_1=struct_type(node_2=struct_type(leaf_3=i))) for i in range(30)]
+        for name, merge in [('python', py_deep_merged), ('c', deep_merged)]:
+            best = best_of(lambda: merge(base, *levels))
+            print('%-10s deep_merged 30 levels  %-6s %8.3f us' % (type_name, name, best * 1e6))
+
+
+if __name__ == '__main__':
+    main()
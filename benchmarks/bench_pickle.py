@@ -0,0 +1,41 @@
+"""
+Pickle size and speed of many same-shaped structs in a plain list and in a
+`StructList`.
+
+    python benchmarks/bench_pickle.py
+"""
+import pickle
+import timeit
+
+from tri_struct import (
+    FastFrozenStruct,
+    FastStruct,
+    PyFrozenStruct,
+    PyStruct,
+    StructList,
+)
+
+COUNT = 100000
+
+
+def best_of(func):
+    return min(timeit.repeat(func, number=1, repeat=5))
+
+
+def main():
+    flavours = [('PyStruct', PyStruct), ('FastStruct', FastStruct), ('PyFrozenStruct', PyFrozenStruct), ('FastFrozenStruct', FastFrozenStruct)]
+    for type_name, struct_type in flavours:
+        if struct_type is None:
+            continue
+        rows = [struct_type(id=i, name='row %d' % i, price=i * 1.5, active=True, parent=None) for i in range(COUNT)]
+        for name, container in [('list', list), ('StructList', StructList)]:
+            obj = container(rows)
+            data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            dumps = best_of(lambda: pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+            loads = best_of(lambda: pickle.loads(data))
+            print('%-18s %-10s %9d bytes  dumps %7.1f ms  loads %7.1f ms' % (
+                type_name, name, len(data), dumps * 1e3, loads * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Memory and speed of `Struct.schema` types compared to `Struct` and tuples
+for many records with the same keys.
+
+    python benchmarks/bench_schema.py
+"""
+import timeit
+import tracemalloc
+
+from tri_struct import Struct
+
+KEYS = ['key_%d' % i for i in range(12)]
+COUNT = 100000
+
+
+def best_of(func):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def bytes_per_record(make):
+    values = [list(range(i, i + len(KEYS))) for i in range(COUNT)]
+    tracemalloc.start()
+    records = [make(v) for v in values]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return size / COUNT
+
+
+def main():
+    Row = Struct.schema(*KEYS)
+    values = tuple(range(len(KEYS)))
+    candidates = [
+        ('tuple', tuple, values),
+        ('Struct', lambda v: Struct(zip(KEYS, v)), Struct(zip(KEYS, values))),
+        ('Struct.schema', lambda v: Row(*v), Row(*values)),
+    ]
+    for name, make, record in candidates:
+        print('%-14s %7.1f bytes/record' % (name, bytes_per_record(make)))
+    for name, make, record in candidates[1:]:
+        print('%-14s construct %8.3f us' % (name, best_of(lambda: make(values)) * 1e6))
+        print('%-14s getattr   %8.3f us' % (name, best_of(lambda: record.key_5) * 1e6))
+        print('%-14s getitem   %8.3f us' % (name, best_of(lambda: record['key_5']) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Benchmarks for every Struct flavour and the common operations on them.
+
+    python benchmarks/bench_struct.py
+    python benchmarks/bench_struct.py --keys 1,10,100 --output results.json
+    python benchmarks/bench_struct.py --compare old_results.json
+
+Only the standard library is needed. Results are written as JSON so runs
+from different releases can be compared with `--compare`.
+"""
+import argparse
+import copy
+import json
+import pickle
+import platform
+import sys
+import timeit
+
+import tri_struct
+from tri_struct import (
+    FastDefaultStruct,
+    FastFrozenStruct,
+    FastStruct,
+    PyDefaultStruct,
+    PyFrozenStruct,
+    PyStruct,
+    merged,
+)
+
+
+FLAVOURS = [
+    (name, cls)
+    for name, cls in [
+        ('PyStruct', PyStruct),
+        ('FastStruct', FastStruct),
+        ('PyFrozenStruct', PyFrozenStruct),
+        ('FastFrozenStruct', FastFrozenStruct),
+        ('PyDefaultStruct', PyDefaultStruct),
+        ('FastDefaultStruct', FastDefaultStruct),
+    ]
+    if cls is not None
+]
+
+
+def is_frozen(cls):
+    return cls.__hash__ is not None
+
+
+def is_default(cls):
+    return issubclass(cls, tuple(filter(None, [PyDefaultStruct, FastDefaultStruct])))
+
+
+def make(cls, *args, **kwargs):
+    if is_default(cls):
+        return cls(None, *args, **kwargs)
+    return cls(*args, **kwargs)
+
+
+def operations(cls, n):
+    """
+    Yield (operation name, callable) pairs for `cls` with `n` keys.
+    """
+    kwargs = {'key_%d' % i: i for i in range(n)}
+    pairs = list(kwargs.items())
+    s = make(cls, kwargs)
+    other = make(cls, key_0=-1, extra=1)
+
+    yield 'construct_kwargs', lambda: make(cls, **kwargs)
+    # literal keywords, which calls with up to 15 of them pass without a dict
+    keywords = ', '.join(['None'] * is_default(cls) + ['%s=%d' % pair for pair in pairs])
+    yield 'construct_keywords', eval('lambda: cls(%s)' % keywords, {'cls': cls})
+    yield 'construct_mapping', lambda: make(cls, kwargs)
+    yield 'construct_iterable', lambda: make(cls, pairs)
+    # 100 rows of values, like the result of a database query
+    keys = list(kwargs)
+    rows = [tuple(range(row, row + n)) for row in range(100)]
+    yield 'rows_zip_x100', lambda: [make(cls, zip(keys, row)) for row in rows]
+    yield 'from_rows_x100', lambda: cls.from_rows(keys, rows)
+    yield 'getattr_hit', lambda: s.key_0
+    yield 'getitem_hit', lambda: s['key_0']
+
+    if is_default(cls):
+        def missing():
+            s.vivified
+            dict.__delitem__(s, 'vivified')
+        yield '__missing__', missing
+    else:
+        yield 'getattr_miss', lambda: getattr(s, 'missing', None)
+        yield 'hasattr_miss', lambda: hasattr(s, 'missing')
+
+        class WithMissing(cls):
+            __slots__ = ()
+
+            def __missing__(self, key):
+                return None
+
+        with_missing = WithMissing(kwargs)
+        yield '__missing__', lambda: with_missing.missing
+
+    if is_frozen(cls):
+        hash(s)
+        yield 'hash_cached', lambda: hash(s)
+        yield 'construct_and_hash', lambda: hash(make(cls, kwargs))
+    else:
+        def set_and_del():
+            s.added = 1
+            del s.added
+        yield 'setattr_delattr', set_and_del
+
+    yield 'copy', lambda: copy.copy(s)
+    yield 'deepcopy', lambda: copy.deepcopy(s)
+    yield 'repr', lambda: repr(s)
+    yield 'pickle_roundtrip', lambda: pickle.loads(pickle.dumps(s, pickle.HIGHEST_PROTOCOL))
+    yield 'merged', lambda: merged(s, other)
+
+
+def measure(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(key_counts, repeat, selected):
+    results = []
+    for name, cls in FLAVOURS:
+        for n in key_counts:
+            for operation, func in operations(cls, n):
+                if selected and operation not in selected:
+                    continue
+                seconds = measure(func, repeat)
+                results.append(dict(flavour=name, operation=operation, keys=n, seconds=seconds))
+                print('%-18s %-20s %5d keys %10.3f us' % (name, operation, n, seconds * 1e6))
+                sys.stdout.flush()
+    return dict(
+        tri_struct=tri_struct.__version__,
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        machine=platform.machine(),
+        results=results,
+    )
+
+
+def compare(current, baseline):
+    def key(r):
+        return r['flavour'], r['operation'], r['keys']
+
+    old = {key(r): r['seconds'] for r in baseline['results']}
+    print()
+    print('compared to tri_struct %s on Python %s' % (baseline['tri_struct'], baseline['python']))
+    for r in current['results']:
+        if key(r) in old:
+            print('%-18s %-20s %5d keys %8.2fx' % (r['flavour'], r['operation'], r['keys'], old[key(r)] / r['seconds']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', default='1,10,100', help='comma separated key counts (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repeats, the best is kept (default: %(default)s)')
+    parser.add_argument('--operation', action='append', help='only run the named operation(s)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    key_counts = [int(n) for n in args.keys.split(',')]
+    current = run(key_counts, args.repeat, set(args.operation or []))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(current, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Attribute read throughput of the Struct flavours with 1 to N threads.
+
+    python benchmarks/bench_threads.py
+    python benchmarks/bench_threads.py --threads 1,2,4,8 --output results.json
+
+Every thread reads attributes from the same struct. On a free-threaded
+Python (3.13t and later) the reads of the c types scale with the number of
+cores, with the GIL the total stays about the same as for one thread.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import tri_struct
+from tri_struct import (
+    FastFrozenStruct,
+    FastStruct,
+    PyFrozenStruct,
+    PyStruct,
+)
+
+
+FLAVOURS = [
+    (name, cls)
+    for name, cls in [
+        ('PyStruct', PyStruct),
+        ('FastStruct', FastStruct),
+        ('PyFrozenStruct', PyFrozenStruct),
+        ('FastFrozenStruct', FastFrozenStruct),
+    ]
+    if cls is not None
+]
+
+
+def gil_enabled():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+def reader(s, reads, barrier):
+    def read():
+        barrier.wait()
+        for _ in range(reads // 10):
+            s.key_0
+            s.key_1
+            s.key_2
+            s.key_3
+            s.key_4
+            s.key_5
+            s.key_6
+            s.key_7
+            s.key_8
+            s.key_9
+    return read
+
+
+def measure(cls, thread_count, reads):
+    """
+    Reads per second with `thread_count` threads doing `reads` reads each.
+    """
+    s = cls({'key_%d' % i: i for i in range(10)})
+    barrier = threading.Barrier(thread_count + 1)
+    threads = [threading.Thread(target=reader(s, reads, barrier)) for _ in range(thread_count)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    return thread_count * reads / (time.perf_counter() - start)
+
+
+def run(thread_counts, reads, repeat):
+    results = []
+    for name, cls in FLAVOURS:
+        single = None
+        for thread_count in thread_counts:
+            per_second = max(measure(cls, thread_count, reads) for _ in range(repeat))
+            single = single or per_second
+            results.append(dict(flavour=name, threads=thread_count, reads_per_second=per_second))
+            print('%-18s %3d threads %10.2f M reads/s %6.2fx' % (name, thread_count, per_second / 1e6, per_second / single))
+            sys.stdout.flush()
+    return dict(
+        tri_struct=tri_struct.__version__,
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        machine=platform.machine(),
+        cpus=os.cpu_count(),
+        gil_enabled=gil_enabled(),
+        results=results,
+    )
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    default_threads = ','.join(str(n) for n in sorted({1, 2, 4, 8, cpus}) if n <= cpus)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', default=default_threads, help='comma separated thread counts (default: %(default)s)')
+    parser.add_argument('--reads', type=int, default=1000000, help='attribute reads per thread (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repeats, the best is kept (default: %(default)s)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    print('Python %s, %d cpus, GIL %s' % (platform.python_version(), cpus, 'enabled' if gil_enabled() else 'disabled'))
+    current = run([int(n) for n in args.threads.split(',')], args.reads, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,106 +1,297 @@
-from ._pystruct import Struct
-try:
-    from ._cstruct import _Struct as FastStruct  # noqa
-except ImportError:  # pragma: no cover
-    FastStruct = None
+import os
+import sys
+
+if os.environ.get('TRI_STRUCT_PURE', '') not in ('', '0'):  # pragma: no cover
+    # every `from ._cstruct import ...` now fails, as without the extension
+    sys.modules['tri_struct._cstruct'] = None
+
+from ._pystruct import Struct as PyStruct, FrozenStruct as PyFrozenStruct, DefaultStruct as PyDefaultStruct  # noqa
+from ._pystruct import Frozen, py_struct_hash, _cached_hash, _MISSING  # noqa
+from ._backend import Struct, FrozenStruct, DefaultStruct  # noqa
+from ._backend import FastStruct, FastFrozenStruct, FastDefaultStruct  # noqa
+from ._array import StructArray  # noqa
+from ._json import loads_json, iter_json_lines  # noqa
+from ._batch import StructList  # noqa
+from ._intern import InternTable, intern_table  # noqa
+from ._persistent import PersistentStruct  # noqa
+from ._path import path, project  # noqa
+from ._lazy import LazyStruct  # noqa
+from ._stats import AccessStats, access_stats  # noqa
 
 
 __version__ = '4.1.0'  # pragma: no mutate
-__all__ = ['Struct', 'FastStruct', 'FrozenStruct', 'merged', 'DefaultStruct', 'to_default_struct']  # pragma: no mutate
+__all__ = ['Struct', 'FastStruct', 'FrozenStruct', 'FastFrozenStruct', 'merged', 'deep_merged', 'DefaultStruct', 'FastDefaultStruct', 'to_struct', 'to_default_struct', 'to_frozen_struct', 'freeze', 'thaw', 'StructArray', 'loads_json', 'iter_json_lines', 'StructList', 'InternTable', 'intern_table', 'PersistentStruct', 'AccessStats', 'access_stats', 'path', 'project', 'LazyStruct', 'diff']  # pragma: no mutate
 
 
-class Frozen(object):
+def merged(*dicts, **kwargs):
     """
-    Mixin to create an immutable class.
+    Merge dictionaries. Later keys overwrite.
+
+    .. code-block:: python
+
+        merged(dict(a=1), dict(b=2), c=3, d=1)
+
     """
+    if not dicts:
+        return Struct()
+    result = dict()
+    for d in dicts:
+        result.update(d)
+    result.update(kwargs)
+    struct_type = type(dicts[0])
+    return struct_type(**result)
 
-    __slots__ = ()
 
-    def __hash__(self):
-        hash_key = '_hash'
-        try:
-            _hash = dict.__getattribute__(self, hash_key)
-        except AttributeError:
-            _hash = hash(tuple((k, self[k]) for k in sorted(self.keys())))
-            dict.__setattr__(self, hash_key, _hash)
-        return _hash
+def deep_merged(*dicts, **kwargs):
+    """
+    Merge dictionaries recursively. Later keys overwrite, unless both values
+    are dicts, which are merged in turn. Subtrees that are only found in one
+    of the arguments are shared with the result instead of copied.
 
-    def __setitem__(self, *_, **__):
-        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+    .. code-block:: python
 
-    def __setattr__(self, key, value):
-        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__,))
+        deep_merged(Struct(a=Struct(x=1, y=1)), dict(a=dict(y=2)), b=3)
+        # Struct(a=Struct(x=1, y=2), b=3)
 
-    def setdefault(self, *_, **__):
-        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+    """
+    if not dicts or not isinstance(dicts[0], dict):
+        return merged(*dicts, **kwargs)
+    result = merged(dicts[0])
+    owned = {id(result)}
+    for d in dicts[1:] + (kwargs,):
+        _deep_merge_into(result, d, owned)
+    return result
 
-    def update(self, *_, **__):
-        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
 
-    def clear(self, *_, **__):
-        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+def _deep_merge_into(target, source, owned):
+    for key, value in source.items():
+        existing = dict.get(target, key)
+        if isinstance(existing, dict) and isinstance(value, dict):
+            if id(existing) not in owned:
+                # copy on write: `existing` belongs to one of the inputs
+                existing = merged(existing)
+                owned.add(id(existing))
+                dict.__setitem__(target, key, existing)
+            _deep_merge_into(existing, value, owned)
+        else:
+            dict.__setitem__(target, key, value)
 
-    def __delitem__(self, *_, **__):
-        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
 
-    def __delattr__(self, *_, **__):
-        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__,))
+py_merged = merged
+py_deep_merged = deep_merged
+if FastStruct is not None:
+    from ._cstruct import merged, deep_merged  # noqa
 
-    def __reduce__(self):
-        return type(self), (), dict(self)
 
-    def __setstate__(self, state):
-        dict.update(self, state)
+def _py_convert(obj, struct_type, sequence_type, memo=None):
+    if isinstance(obj, struct_type) or not isinstance(obj, (dict, list)):
+        return obj
+    if memo is not None and id(obj) in memo:
+        return memo[id(obj)]
+    if isinstance(obj, dict):
+        result = struct_type()
+        if memo is not None:
+            memo[id(obj)] = result
+        for k, v in obj.items():
+            dict.__setitem__(result, k, _py_convert(v, struct_type, sequence_type, memo))
+    elif sequence_type is list:
+        result = []
+        if memo is not None:
+            memo[id(obj)] = result
+        result.extend(_py_convert(v, struct_type, sequence_type, memo) for v in obj)
+    else:
+        result = tuple(_py_convert(v, struct_type, sequence_type, memo) for v in obj)
+        if memo is not None:
+            memo[id(obj)] = result
+    return result
 
-    def __copy__(self):
-        return self
 
+if FastStruct is not None:
+    from ._cstruct import convert as _convert
+else:  # pragma: no cover
+    _convert = _py_convert
 
-class FrozenStruct(Frozen, Struct):
-    __slots__ = ('_hash', )
 
+def to_struct(obj, memo=None):
+    """
+    Convert nested dicts to `Struct`, and the dicts in nested lists.
+    Existing `Struct` instances are kept as they are.
 
-def merged(*dicts, **kwargs):
+    Pass a dict as `memo` to convert shared and cyclic containers only once.
     """
-    Merge dictionaries. Later keys overwrite.
+    return _convert(obj, Struct, list, memo)
 
-    .. code-block:: python
 
-        merged(dict(a=1), dict(b=2), c=3, d=1)
+def to_default_struct(obj, memo=None):
+    """
+    Convert nested dicts to `DefaultStruct`, and the dicts in nested lists.
+    Existing `DefaultStruct` instances are kept as they are.
 
+    Pass a dict as `memo` to convert shared and cyclic containers only once.
     """
-    if not dicts:
-        return Struct()
-    result = dict()
-    for d in dicts:
-        result.update(d)
-    result.update(kwargs)
-    struct_type = type(dicts[0])
-    return struct_type(**result)
+    return _convert(obj, DefaultStruct, list, memo)
 
 
-class DefaultStruct(Struct):
-    __slots__ = ('_default_factory',)
+def to_frozen_struct(obj, memo=None):
+    """
+    Convert nested dicts to `FrozenStruct`, and nested lists to tuples.
+    Existing `FrozenStruct` instances are kept as they are.
 
-    def __init__(self, default_factory=None, *args, **kwargs):
-        if default_factory is None:
-            default_factory = DefaultStruct
-        object.__setattr__(self, '_default_factory', default_factory)
-        super(DefaultStruct, self).__init__(*args, **kwargs)
+    Pass a dict as `memo` to convert shared containers only once.
+    """
+    return _convert(obj, FrozenStruct, tuple, memo)
 
-    def __missing__(self, key):
-        try:
-            return object.__getattribute__(self, key)
-        except AttributeError:
-            default_factory = object.__getattribute__(self, '_default_factory')
-            self[key] = new = default_factory()
-            return new
+
+def _py_freeze(obj, struct_type, memo):
+    if isinstance(obj, frozenset):
+        return obj
+    if isinstance(obj, set):
+        return frozenset(obj)
+    if not isinstance(obj, (dict, list)) and type(obj) is not tuple:
+        return obj
+    if isinstance(obj, struct_type) and _cached_hash(obj) is not None:
+        return obj
+    if id(obj) in memo:
+        if memo[id(obj)] is None:
+            raise ValueError('cannot freeze a cyclic structure')
+        return memo[id(obj)]
+    memo[id(obj)] = None
+    if isinstance(obj, dict):
+        items = [(k, _py_freeze(v, struct_type, memo)) for k, v in dict.items(obj)]
+        if isinstance(obj, struct_type) and all(v is obj[k] for k, v in items):
+            result = obj
+        else:
+            result = struct_type()
+            dict.update(result, items)
+        hash(result)
+    else:
+        result = tuple(_py_freeze(v, struct_type, memo) for v in obj)
+        if type(obj) is tuple and all(a is b for a, b in zip(result, obj)):
+            result = obj
+    memo[id(obj)] = result
+    return result
 
 
-def to_default_struct(d):
-    if isinstance(d, DefaultStruct):
-        return d
-    elif isinstance(d, dict):
-        return DefaultStruct(None, ((k, to_default_struct(v)) for k, v in d.items()))
+def _py_thaw(obj, struct_type, memo):
+    if isinstance(obj, (set, frozenset)):
+        return set(obj)
+    if not isinstance(obj, (dict, list)) and type(obj) is not tuple:
+        return obj
+    if id(obj) in memo:
+        return memo[id(obj)]
+    if isinstance(obj, dict):
+        result = memo[id(obj)] = struct_type()
+        for k, v in dict.items(obj):
+            dict.__setitem__(result, k, _py_thaw(v, struct_type, memo))
     else:
-        return d
+        result = memo[id(obj)] = []
+        result.extend(_py_thaw(v, struct_type, memo) for v in obj)
+    return result
+
+
+def py_freeze(obj, struct_type):
+    return _py_freeze(obj, struct_type, {})
+
+
+def py_thaw(obj, struct_type):
+    return _py_thaw(obj, struct_type, {})
+
+
+if FastStruct is not None:
+    from ._cstruct import freeze as _freeze, thaw as _thaw
+else:  # pragma: no cover
+    _freeze, _thaw = py_freeze, py_thaw
+
+
+def freeze(obj, struct_type=FrozenStruct):
+    """
+    Make nested data hashable: dicts become `FrozenStruct`, lists and
+    tuples become tuples and sets become frozensets.
+
+    .. code-block:: python
+
+        >>> key = freeze(Struct(a=[1, 2], b={3}))
+        >>> key
+        FrozenStruct(a=(1, 2), b=frozenset({3}))
+
+    Frozen structs, tuples and frozensets are kept as they are unless
+    something inside them has to change, and a frozen struct with a cached
+    hash isn't looked into at all. The hashes are computed on the way, so
+    hashing the result is O(1). Raises ValueError for cyclic data.
+    """
+    return _freeze(obj, struct_type)
+
+
+def thaw(obj, struct_type=Struct):
+    """
+    The reverse of `freeze`: a mutable copy where dicts, frozen or not,
+    become `Struct`, tuples become lists and frozensets become sets.
+    """
+    return _thaw(obj, struct_type)
+
+
+def _py_frozen_equal(a, b):
+    # True if equal, False if they have to be looked into
+    a_hash, b_hash = _cached_hash(a), _cached_hash(b)
+    if a_hash is None or b_hash is None or a_hash != b_hash:
+        return False
+    return a == b
+
+
+def _py_diff(a, b, keys, active, result):
+    added, removed, changed = result
+    active.add((id(a), id(b)))
+    found = 0
+    for key, a_value in list(dict.items(a)):
+        b_value = dict.get(b, key, _MISSING)
+        if b_value is _MISSING:
+            removed.append(keys + (key,))
+            continue
+        found += 1
+        if a_value is b_value:
+            continue
+        if isinstance(a_value, dict) and isinstance(b_value, dict):
+            if (id(a_value), id(b_value)) not in active and not _py_frozen_equal(a_value, b_value):
+                _py_diff(a_value, b_value, keys + (key,), active, result)
+        elif not a_value == b_value:
+            changed.append(keys + (key,))
+    # if all keys of `b` were found, none was added
+    if found != dict.__len__(b):
+        added.extend(keys + (key,) for key in list(dict.keys(b)) if not dict.__contains__(a, key))
+    active.discard((id(a), id(b)))
+
+
+def py_diff(a, b):
+    if not (isinstance(a, dict) and isinstance(b, dict)):
+        raise TypeError('diff expected two dicts')
+    result = [], [], []
+    if a is not b:
+        _py_diff(a, b, (), set(), result)
+    return result
+
+
+if FastStruct is not None:
+    from ._cstruct import diff as _diff
+else:  # pragma: no cover
+    _diff = py_diff
+
+
+def diff(a, b):
+    """
+    What changed between two trees of nested dicts: the paths, as tuples of
+    keys, that are only in `b`, only in `a`, or that have different values.
+
+    .. code-block:: python
+
+        >>> diff(Struct(a=Struct(x=1, y=2), b=1), Struct(a=Struct(x=1, y=3), c=1))
+        Struct(added=[('c',)], changed=[('a', 'y')], removed=[('b',)])
+
+    Nested dicts are compared key by key, any other values, lists included,
+    with `==`. Subtrees that are the same object in both trees are skipped,
+    and frozen structs with different cached hashes are looked into without
+    comparing them first, so trees that share their unchanged parts, like
+    the results of `freeze` or `FrozenStruct.intern`, are diffed in time
+    proportional to the change.
+    """
+    added, removed, changed = _diff(a, b)
+    return Struct(added=added, removed=removed, changed=changed)
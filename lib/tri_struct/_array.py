@@ -0,0 +1,221 @@
+"""
+Column-wise storage for many structs with the same keys, see `StructArray`.
+"""
+from array import array
+from collections.abc import Mapping
+from itertools import compress
+
+from ._backend import Struct
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+BACKENDS = ('array', 'list', 'numpy')
+
+
+def _array_typecode(values):
+    if all(type(v) is int for v in values):
+        return 'q'
+    if all(type(v) is float for v in values):
+        return 'd'
+    return None
+
+
+def _make_column(values, backend):
+    if backend == 'numpy':
+        return numpy.asarray(values)
+    values = list(values)
+    if backend == 'array' and values:
+        typecode = _array_typecode(values)
+        if typecode is not None:
+            try:
+                return array(typecode, values)
+            except OverflowError:
+                pass
+    return values
+
+
+class StructArray(object):
+    """
+    Many structs with the same keys, stored as one column per key. Columns of
+    ints or floats are kept in `array.array`, other columns in lists. With
+    `backend='numpy'` every column is a numpy array.
+
+    .. code-block:: python
+
+        >>> prices = StructArray.from_structs([Struct(name='a', price=1.5), Struct(name='b', price=3.0)])
+        >>> prices.price
+        array('d', [1.5, 3.0])
+        >>> prices[1]
+        Struct(name='b', price=3.0)
+        >>> prices.filter(lambda row: row.price > 2).name
+        ['b']
+
+    Indexing with an int gives a lazy row view that reads from, and writes
+    to, the columns. Slicing and `filter` give a new `StructArray`.
+    """
+
+    __slots__ = ('_columns', '_length', '_backend')
+
+    def __init__(self, columns=(), backend='array', **kwargs):
+        if backend not in BACKENDS:
+            raise ValueError('backend must be one of %s, not %r' % (', '.join(BACKENDS), backend))
+        if backend == 'numpy' and numpy is None:
+            raise ImportError('the numpy backend needs numpy installed')
+        columns = dict(columns, **kwargs)
+        columns = {key: _make_column(values, backend) for key, values in columns.items()}
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError('columns must all have the same length')
+        object.__setattr__(self, '_columns', columns)
+        object.__setattr__(self, '_length', lengths.pop() if lengths else 0)
+        object.__setattr__(self, '_backend', backend)
+
+    @classmethod
+    def from_structs(cls, structs, keys=None, backend='array'):
+        """
+        Build a `StructArray` from a sequence of structs or dicts. The keys are
+        taken from the first struct unless given, and every struct must have
+        all of them.
+        """
+        structs = list(structs)
+        if keys is None:
+            keys = list(structs[0]) if structs else []
+        return cls(((key, [s[key] for s in structs]) for key in keys), backend=backend)
+
+    def to_structs(self, struct_type=Struct):
+        """
+        The rows as a list of `struct_type` instances.
+        """
+        keys = list(self._columns)
+        columns = [values.tolist() if self._backend == 'numpy' else values for values in self._columns.values()]
+        return [struct_type(zip(keys, [values[index] for values in columns])) for index in range(self._length)]
+
+    def keys(self):
+        return list(self._columns)
+
+    def column(self, key):
+        return self._columns[key]
+
+    def filter(self, predicate_or_mask):
+        """
+        A new `StructArray` with the rows where `predicate_or_mask` holds. It is
+        either a function called with each row view, or a sequence of booleans
+        with one entry per row, like a numpy comparison of a column.
+        """
+        if callable(predicate_or_mask):
+            mask = [bool(predicate_or_mask(row)) for row in self]
+        else:
+            mask = predicate_or_mask
+            if len(mask) != self._length:
+                raise ValueError('mask must have one entry per row')
+        if self._backend == 'numpy':
+            mask = numpy.asarray(mask, dtype=bool)
+            return self._derive({key: values[mask] for key, values in self._columns.items()})
+        return self._derive({key: _make_column(compress(values, mask), self._backend) for key, values in self._columns.items()})
+
+    def _derive(self, columns):
+        result = object.__new__(type(self))
+        object.__setattr__(result, '_columns', columns)
+        object.__setattr__(result, '_length', len(next(iter(columns.values()))) if columns else 0)
+        object.__setattr__(result, '_backend', self._backend)
+        return result
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield StructArrayRow(self, index)
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self._columns[item]
+        if isinstance(item, slice):
+            return self._derive({key: values[item] for key, values in self._columns.items()})
+        index = item.__index__()
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('StructArray index out of range')
+        return StructArrayRow(self, index)
+
+    def __getattr__(self, item):
+        try:
+            return object.__getattribute__(self, '_columns')[item]
+        except KeyError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, item))
+
+    def __setattr__(self, key, value):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__,))
+
+    def __eq__(self, other):
+        if not isinstance(other, StructArray):
+            return NotImplemented
+        return self.to_structs() == other.to_structs()
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return type(self), (self._columns, self._backend)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(repr(row) for row in self))
+
+
+class StructArrayRow(Mapping):
+    """
+    A lazy view of one row of a `StructArray`. It reads and writes the
+    columns, and otherwise behaves like a `Struct` with a fixed set of keys.
+    """
+
+    __slots__ = ('_array', '_index')
+
+    def __init__(self, struct_array, index):
+        object.__setattr__(self, '_array', struct_array)
+        object.__setattr__(self, '_index', index)
+
+    def __getitem__(self, key):
+        return self._array._columns[key][self._index]
+
+    def __setitem__(self, key, value):
+        self._array._columns[key][self._index] = value
+
+    def __getattr__(self, item):
+        try:
+            return object.__getattribute__(self, '_array')._columns[item][self._index]
+        except KeyError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, item))
+
+    def __setattr__(self, key, value):
+        if key not in self._array._columns:
+            raise AttributeError("'%s' object has no column '%s'" % (type(self).__name__, key))
+        self[key] = value
+
+    def __iter__(self):
+        return iter(self._array._columns)
+
+    def __len__(self):
+        return len(self._array._columns)
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self.items()) == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(Struct(self.items()))
+
+    __str__ = __repr__
+
+    def to_struct(self, struct_type=Struct):
+        return struct_type(self.items())
+
+
+StructArray.__module__ = 'tri_struct'
+StructArrayRow.__module__ = 'tri_struct'
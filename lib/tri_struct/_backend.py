@@ -0,0 +1,25 @@
+"""
+The types behind `tri_struct.Struct`, `FrozenStruct` and `DefaultStruct`: the
+c ones when the extension is available, the python ones from `_pystruct`
+otherwise. Setting the `TRI_STRUCT_PURE` environment variable makes the
+extension unavailable, see `tri_struct/__init__.py`.
+"""
+from . import _pystruct
+
+try:
+    from ._cstruct import _Struct as FastStruct
+    from ._cstruct import _FrozenStruct as FastFrozenStruct
+    from ._cstruct import _DefaultStruct as FastDefaultStruct
+except ImportError:  # pragma: no cover
+    FastStruct = None
+    FastFrozenStruct = None
+    FastDefaultStruct = None
+
+
+if FastStruct is not None:
+    Struct, FrozenStruct, DefaultStruct = FastStruct, FastFrozenStruct, FastDefaultStruct
+else:  # pragma: no cover
+    Struct, FrozenStruct, DefaultStruct = _pystruct.Struct, _pystruct.FrozenStruct, _pystruct.DefaultStruct
+    # pickles refer to the python types by their public names
+    for _type in (Struct, FrozenStruct, DefaultStruct):
+        _type.__module__ = 'tri_struct'
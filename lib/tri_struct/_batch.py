@@ -0,0 +1,122 @@
+"""
+Compact pickling of many structs, see `StructList`.
+"""
+
+try:
+    from ._cstruct import pack_structs, unpack_structs, _FrozenStruct
+    # the c FrozenStruct has a `__new__` of its own, which makes empty
+    # instances just like `dict.__new__`
+    _plain_news = (dict.__new__, _FrozenStruct.__new__)
+except ImportError:  # pragma: no cover
+    pack_structs = unpack_structs = None
+    _plain_news = (dict.__new__,)
+
+
+_RAW_ITEM = 255
+
+
+def _is_plain_struct(item):
+    t = type(item)
+    return isinstance(item, dict) and t.__init__ is dict.__init__ and t.__new__ in _plain_news
+
+
+def py_pack_structs(items):
+    """
+    Python version of the c `pack_structs`.
+    """
+    items = list(items)
+    # the row of the first occurrence of every struct, which later
+    # occurrences and values refer to
+    rows = {}
+    for i, item in enumerate(items):
+        if _is_plain_struct(item):
+            rows.setdefault(id(item), i)
+
+    shapes = []
+    shape_index = {}
+    row_shapes = []
+    values = []
+    refs = []
+
+    def pack_value(value):
+        row = rows.get(id(value))
+        if row is not None:
+            refs.extend((len(values), row))
+            value = None
+        values.append(value)
+
+    for i, item in enumerate(items):
+        if rows.get(id(item)) == i:
+            shape = (type(item), tuple(item))
+            row_shapes.append(shape_index.setdefault(shape, len(shapes)))
+            if len(shape_index) > len(shapes):
+                shapes.append(shape)
+            for value in item.values():
+                pack_value(value)
+        else:
+            row_shapes.append(-1)
+            pack_value(item)
+    if len(shapes) < _RAW_ITEM:
+        row_shapes = bytes(_RAW_ITEM if shape < 0 else shape for shape in row_shapes)
+    return shapes, row_shapes, values, refs
+
+
+def py_unpack_structs(shapes, row_shapes, values, refs=()):
+    """
+    Python version of the c `unpack_structs`.
+    """
+    row_shapes = [
+        -1 if isinstance(row_shapes, bytes) and shape == _RAW_ITEM else shape
+        for shape in row_shapes
+    ]
+    # all structs first, values can refer to later rows
+    result = [None if shape == -1 else shapes[shape][0]() for shape in row_shapes]
+    values = list(values)
+    for pos, row in zip(refs[::2], refs[1::2]):
+        values[pos] = result[row]
+
+    values = iter(values)
+    for i, shape in enumerate(row_shapes):
+        if shape == -1:
+            result[i] = next(values)
+        else:
+            for key in shapes[shape][1]:
+                dict.__setitem__(result[i], key, next(values))
+    return result
+
+
+if pack_structs is None:  # pragma: no cover
+    pack_structs = py_pack_structs
+    unpack_structs = py_unpack_structs
+
+
+def _unpack_struct_list(shapes, row_shapes, values, refs=()):
+    return StructList(unpack_structs(shapes, row_shapes, values, refs))
+
+
+class StructList(list):
+    """
+    A list that pickles the structs in it compactly: the keys are written
+    once for every distinct shape (type and keys in order), and the values of
+    all structs as one flat list. Unpickling rebuilds the structs in c.
+
+    .. code-block:: python
+
+        rows = StructList(Struct(id=i, name=str(i)) for i in range(1000000))
+        data = pickle.dumps(rows)
+
+    Use it to send many same-shaped structs between processes, for example
+    with `multiprocessing`. Items that aren't plain structs are pickled as
+    usual. A struct that is in the list more than once, or that is a value
+    of a struct in it, is still one object after unpickling. Structs deeper
+    down, like in a list in a value, are pickled one by one, so there a
+    struct from the list comes back as a copy.
+    """
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        return _unpack_struct_list, pack_structs(self)
+
+
+StructList.__module__ = 'tri_struct'
@@ -1,56 +1,338 @@
 #include "Python.h"
-#include "_typespec.h"
+#include "structmember.h"
 #include "_utils.h"
 
 
 typedef PyDictObject StructObject;
 
+typedef struct {
+    PyDictObject dict;
+    Py_hash_t hash;
+    PyObject *repr;
+    PyObject *weakreflist;
+} FrozenStructObject;
 
+typedef struct {
+    PyDictObject dict;
+    PyObject *default_factory;
+} DefaultStructObject;
+
+
+static PyObject *empty_tuple = NULL;
+static PyTypeObject *FrozenStructType = NULL;
+static PyTypeObject *DefaultStructType = NULL;
+
+
+static PyObject *str___missing__ = NULL;
+
+
+/* `name` looked up on `type` and its bases, without calling descriptors,
+   as a new reference, or NULL if there is none. Never raises.
+
+   This is what `_PyType_Lookup` does, with public calls only: the dicts
+   along the mro are searched in order, without the interpreter's method
+   cache. The mro is taken under the lock of the type, as it can be
+   replaced while it is read on the free-threaded build.
+ */
 static PyObject *
-Struct_getattr(PyObject *self, PyObject *name)
+type_lookup(PyTypeObject *type, PyObject *name)
 {
-    PyObject *value;
+    PyObject *result = NULL, *mro, *dict;
+    Py_ssize_t i;
+    int res = 0;
 
-    value = PyDict_GetItemWithError(self, name);
-    if (value) {
-        Py_INCREF(value);
+    Py_BEGIN_CRITICAL_SECTION(type);
+    mro = type->tp_mro;
+    Py_XINCREF(mro);
+    Py_END_CRITICAL_SECTION();
+    if (mro == NULL)
+        return NULL;
+    for (i = 0; res == 0 && i < PyTuple_GET_SIZE(mro); i++) {
+        dict = PyType_GetDict((PyTypeObject *)PyTuple_GET_ITEM(mro, i));
+        res = PyDict_GetItemRef(dict, name, &result);
+        Py_DECREF(dict);
+    }
+    Py_DECREF(mro);
+    if (res < 0)
+        PyErr_Clear();
+    return result;
+}
+
+
+/* Whether `name` is an attribute of `type`, the answer of `type_lookup`
+   cached like the interpreter caches its method lookups: by the version
+   tag of the type and the interned name. The interpreter clears the tag
+   of a type, and of its subclasses, whenever one of them changes. Without
+   the gil the entries could be torn, so that build always looks it up.
+ */
+#define ATTRIBUTE_CACHE_SIZE 1024
+
+typedef struct {
+    unsigned int version;
+    PyObject *name;
+    int found;
+} AttributeCacheEntry;
+
+#ifndef Py_GIL_DISABLED
+static AttributeCacheEntry attribute_cache[ATTRIBUTE_CACHE_SIZE];
+#endif
+
+
+static unsigned int
+version_tag(PyTypeObject *type)
+{
+#if PY_VERSION_HEX >= 0x030C0000
+    if (!PyType_HasFeature(type, Py_TPFLAGS_VALID_VERSION_TAG))
+        PyUnstable_Type_AssignVersionTag(type);
+#endif
+    if (!PyType_HasFeature(type, Py_TPFLAGS_VALID_VERSION_TAG))
+        return 0;
+    return type->tp_version_tag;
+}
+
+
+static int
+type_has_attribute(PyTypeObject *type, PyObject *name)
+{
+    PyObject *attribute;
+#ifndef Py_GIL_DISABLED
+    AttributeCacheEntry *entry = NULL;
+    unsigned int version = 0;
+
+    if (PyUnicode_CheckExact(name) && PyUnicode_CHECK_INTERNED(name))
+        version = version_tag(type);
+    if (version != 0) {
+        entry = &attribute_cache[(version ^ ((size_t)name >> 3))
+                                 & (ATTRIBUTE_CACHE_SIZE - 1)];
+        if (entry->version == version && entry->name == name)
+            return entry->found;
+    }
+#endif
+
+    attribute = type_lookup(type, name);
+    Py_XDECREF(attribute);
+
+#ifndef Py_GIL_DISABLED
+    /* unless the type changed during the lookup */
+    if (entry != NULL && version_tag(type) == version) {
+        Py_INCREF(name);
+        Py_XSETREF(entry->name, name);
+        entry->version = version;
+        entry->found = attribute != NULL;
+    }
+#endif
+    return attribute != NULL;
+}
+
+
+/* The `__missing__` of `type` as a new reference, or NULL if there is
+   none. Never raises.
+ */
+static PyObject *
+lookup_missing(PyTypeObject *type)
+{
+    /* the direct dict subclass can't have one */
+    if (type->tp_base == &PyDict_Type
+            || !type_has_attribute(type, str___missing__))
+        return NULL;
+    return type_lookup(type, str___missing__);
+}
+
+
+/* Steals `missing` */
+static PyObject *
+call_missing(PyObject *missing, PyObject *self, PyObject *name)
+{
+    descrgetfunc get;
+    PyObject *bound, *res;
+
+    get = Py_TYPE(missing)->tp_descr_get;
+    if (get == NULL) {
+        res = PyObject_CallFunctionObjArgs(missing, name, NULL);
     }
+#ifdef Py_TPFLAGS_METHOD_DESCRIPTOR
+    else if (PyType_HasFeature(Py_TYPE(missing), Py_TPFLAGS_METHOD_DESCRIPTOR)) {
+        /* plain functions and methods, no need to bind */
+        res = PyObject_CallFunctionObjArgs(missing, self, name, NULL);
+    }
+#endif
     else {
-        if (PyErr_Occurred())
+        bound = get(missing, self, (PyObject *)Py_TYPE(self));
+        if (bound == NULL) {
+            Py_DECREF(missing);
             return NULL;
+        }
+        res = PyObject_CallFunctionObjArgs(bound, name, NULL);
+        Py_DECREF(bound);
+    }
+    Py_DECREF(missing);
+    return res;
+}
 
-        value = PyObject_GenericGetAttr(self, name);
-        if (value == NULL) {
-            /* Look up __missing__ method if we're not the direct dict subclass */
-            if (!(Py_TYPE(self)->tp_base == &PyDict_Type)) {
-                PyObject *missing, *res;
-                PyObject *err_type, *err_value, *err_tb;
 
-                PyErr_Fetch(&err_type, &err_value, &err_tb);
+/* Access statistics, see `tri_struct.access_stats`. Off unless enabled,
+   which costs a single test of `access_stats_mode` per attribute read.
+ */
+enum {
+    ACCESS_STATS_OFF = 0,
+    ACCESS_STATS_TYPES = 1,
+    ACCESS_STATS_KEYS = 2,
+};
 
-#if PY_MAJOR_VERSION >= 3
-                _Py_IDENTIFIER(__missing__);
-                missing = _PyObject_LookupSpecial(self, &PyId___missing__);
-#else
-                static PyObject *missing_str = NULL;
-                missing = _PyObject_LookupSpecial(self,
-                                                  "__missing__",
-                                                  &missing_str);
-#endif
-                if (missing != NULL) {
-                    res = PyObject_CallFunctionObjArgs(missing,
-                                                       name, NULL);
-                    Py_DECREF(missing);
-                    return res;
-                }
-                else if (PyErr_Occurred())
-                    return NULL;
+static int access_stats_mode = ACCESS_STATS_OFF;
+static PyObject *access_counts = NULL;
+static PyObject *str_hits = NULL;
+static PyObject *str_misses = NULL;
+static PyObject *str_missing = NULL;
+static PyObject *str_shadowed = NULL;
 
-                PyErr_Restore(err_type, err_value, err_tb);
-            }
+#define COUNT_ACCESS(self, event, name) \
+    do { \
+        if (access_stats_mode != ACCESS_STATS_OFF) \
+            count_access(self, event, name); \
+    } while (0)
+
+
+static int
+increment_count(PyObject *counts, PyObject *key)
+{
+    PyObject *count;
+    int res;
+
+    Py_BEGIN_CRITICAL_SECTION(counts);
+    res = PyDict_GetItemRef(counts, key, &count);
+    if (res >= 0) {
+        Py_XSETREF(count, PyLong_FromSsize_t(
+            res > 0 ? PyLong_AsSsize_t(count) + 1 : 1));
+        res = count == NULL ? -1 : PyDict_SetItem(counts, key, count);
+        Py_XDECREF(count);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+
+/* Count `event` for the type of `self`, and for `name` too when counting
+   per key. Must be called without an exception set, and never raises.
+ */
+static void
+count_access(PyObject *self, PyObject *event, PyObject *name)
+{
+    PyObject *counts, *key;
+    int mode = access_stats_mode;
+
+    counts = access_counts;
+    if (mode == ACCESS_STATS_OFF || counts == NULL)
+        return;
+    key = PyTuple_Pack(2, (PyObject *)Py_TYPE(self), event);
+    if (key == NULL || increment_count(counts, key) < 0)
+        goto done;
+    if (mode == ACCESS_STATS_KEYS) {
+        Py_SETREF(key, PyTuple_Pack(3, (PyObject *)Py_TYPE(self), event, name));
+        if (key == NULL || increment_count(counts, key) < 0)
+            goto done;
+    }
+    if (event == str_hits && PyUnicode_Check(name)) {
+        /* a key with the name of a method or another class attribute */
+        if (type_has_attribute(Py_TYPE(self), name))
+            count_access(self, str_shadowed, name);
+    }
+
+done:
+    Py_XDECREF(key);
+    PyErr_Clear();
+}
+
+
+PyDoc_STRVAR(set_access_stats_doc,
+"set_access_stats(counts, per_key)\n"
+"\n"
+"Count attribute reads in `counts`, or stop counting if it is None.\n"
+"Used by `tri_struct.access_stats`.\n"
+);
+
+
+static PyObject *
+set_access_stats(PyObject *module, PyObject *args)
+{
+    PyObject *counts;
+    int per_key = 0;
+
+    if (!PyArg_ParseTuple(args, "O|p:set_access_stats", &counts, &per_key))
+        return NULL;
+    if (counts == Py_None) {
+        access_stats_mode = ACCESS_STATS_OFF;
+        Py_RETURN_NONE;
+    }
+    if (!PyDict_CheckExact(counts)) {
+        PyErr_SetString(PyExc_TypeError, "counts must be a dict or None");
+        return NULL;
+    }
+    /* the old dict is kept, other threads may still be counting in it */
+    if (counts != access_counts) {
+        Py_INCREF(counts);
+        access_counts = counts;
+    }
+    access_stats_mode = per_key ? ACCESS_STATS_KEYS : ACCESS_STATS_TYPES;
+    Py_RETURN_NONE;
+}
+
+
+/* Can we tell that `name` is not an attribute of `self` without going
+   through the generic lookup (and the AttributeError it would raise)?
+   True when there is no instance `__dict__` and nothing on the type.
+ */
+static int
+is_plain_attribute_miss(PyObject *self, PyObject *name)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    if (!PyUnicode_Check(name) || type->tp_dictoffset != 0)
+        return 0;
+    return !type_has_attribute(type, name);
+}
+
+
+static PyObject *
+Struct_getattr(PyObject *self, PyObject *name)
+{
+    PyObject *value, *missing;
+    int res;
+
+    res = PyDict_GetItemRef(self, name, &value);
+    if (res != 0) {
+        if (res > 0)
+            COUNT_ACCESS(self, str_hits, name);
+        return value;
+    }
+
+    COUNT_ACCESS(self, str_misses, name);
+    if (is_plain_attribute_miss(self, name)) {
+        missing = lookup_missing(Py_TYPE(self));
+        if (missing != NULL) {
+            COUNT_ACCESS(self, str_missing, name);
+            return call_missing(missing, self, name);
         }
+        set_attribute_error(self, name);
+        return NULL;
     }
 
+    value = PyObject_GenericGetAttr(self, name);
+    if (value == NULL && PyErr_ExceptionMatches(PyExc_AttributeError)) {
+        PyObject *err_type, *err_value, *err_tb;
+
+        /* the type lookup must not run with an exception set */
+        PyErr_Fetch(&err_type, &err_value, &err_tb);
+        missing = lookup_missing(Py_TYPE(self));
+        if (missing != NULL) {
+            Py_XDECREF(err_type);
+            Py_XDECREF(err_value);
+            Py_XDECREF(err_tb);
+            COUNT_ACCESS(self, str_missing, name);
+            return call_missing(missing, self, name);
+        }
+        PyErr_Restore(err_type, err_value, err_tb);
+    }
     return value;
 }
 
@@ -90,119 +372,299 @@ Struct_copy(PyObject *self)
 }
 
 
+static PyObject *str___name__ = NULL;
+static PyObject *str_empty = NULL;
+static PyObject *str_open = NULL;
+static PyObject *str_close = NULL;
+static PyObject *str_equals = NULL;
+static PyObject *str_separator = NULL;
+
+
+static int FrozenStruct_has_cached_repr(PyObject *);
+
+
+/* Values whose repr can't change, so a FrozenStruct holding only these
+   can keep its repr
+ */
+static int
+has_stable_repr(PyObject *value)
+{
+    return PyUnicode_CheckExact(value) || PyLong_CheckExact(value)
+        || PyFloat_CheckExact(value) || PyBool_Check(value)
+        || value == Py_None || PyBytes_CheckExact(value)
+        || PyComplex_CheckExact(value) || FrozenStruct_has_cached_repr(value);
+}
+
+
+/* basically `dict_repr`, but with keyword notation and sorted keys.
+   All the pieces are collected in one list and joined at the end, so the
+   result is allocated and written once.
+
+   `keys_of` returns a new list of the keys and `lookup` works like
+   `PyDict_GetItemRef`, so the same code serves dict based and schema
+   based structs.
+ */
 static PyObject *
-Struct_repr(PyObject *self)
+sorted_repr(PyObject *self, PyObject *(*keys_of)(PyObject *),
+            int (*lookup)(PyObject *, PyObject *, PyObject **), int *stable)
 {
-    Py_ssize_t i;
-    PyObject *inner_repr = NULL;
-    PyObject *equals = NULL;
-    PyObject *pieces = NULL, *result = NULL;
-    PyObject *items = NULL, *s;
-    PyTypeObject *type = Py_TYPE(self);
+    Py_ssize_t i, n, j = 0;
+    PyObject *type_name = NULL, *keys = NULL, *pieces = NULL;
+    PyObject *result = NULL;
+    int status;
+
+    *stable = 1;
 
-    i = Py_ReprEnter(self);
-    if (i < 0) {
+    type_name = PyObject_GetAttr((PyObject *)Py_TYPE(self), str___name__);
+    if (type_name == NULL)
+        return NULL;
+
+    status = Py_ReprEnter(self);
+    if (status < 0) {
+        Py_DECREF(type_name);
         return NULL;
     }
+    if (status > 0) {
+        *stable = 0;
+        result = PyUnicode_FromFormat("%U(...)", type_name);
+        Py_DECREF(type_name);
+        return result;
+    }
 
-    if (i != 0) {
-        if (i < 0) return NULL;
+    /* sorting just the keys is much cheaper than sorting (key, value)
+       tuples, and hits list.sort's fast paths for str keys */
+    keys = keys_of(self);
+    if (keys == NULL)
+        goto done;
+    if (PyList_Sort(keys) < 0)
+        goto done;
 
-        inner_repr = str_from_string("...");
-        if (inner_repr == NULL)
-            return NULL;
+    n = PyList_GET_SIZE(keys);
+    pieces = PyList_New(n > 0 ? 4 * n + 2 : 3);
+    if (pieces == NULL)
+        goto done;
 
-        return format_with_type(type, inner_repr);
-    }
-    else if (((PyDictObject *)self)->ma_used == 0) {
-        result = format_with_type(type, NULL);
-    }
-    else {
-        /* basically `dict_repr` but with keyword notation */
-        pieces = PyList_New(0);
-        if (pieces == NULL)
-            goto done;
+#define ADD_PIECE(piece) PyList_SET_ITEM(pieces, j++, (piece))
 
-        equals = str_from_string("=");
-        if (equals == NULL)
-            goto done;
+    Py_INCREF(type_name);
+    ADD_PIECE(type_name);
+    Py_INCREF(str_open);
+    ADD_PIECE(str_open);
 
-        items = PyDict_Items(self);
-        if (items == NULL)
-            goto done;
-        if (PyList_Sort(items) < 0)
+    for (i = 0; i < n; i++) {
+        PyObject *key, *value, *piece;
+
+        key = PyList_GET_ITEM(keys, i);
+        if (lookup(self, key, &value) <= 0) {
+            if (!PyErr_Occurred())
+                /* removed by the repr of an earlier value, or by another
+                   thread */
+                PyErr_SetString(PyExc_RuntimeError,
+                                "dictionary changed size during repr");
             goto done;
+        }
 
-        for (i = 0; i < PyList_GET_SIZE(items); i++) {
-            PyObject *temp, *key, *value, *value_repr;
-            int status;
+        if (i > 0) {
+            Py_INCREF(str_separator);
+            ADD_PIECE(str_separator);
+        }
 
-            temp = PyList_GET_ITEM(items, i);
-            key = PyTuple_GetItem(temp, 0);
-            if (key == NULL)
-                goto done;
-            value = PyTuple_GetItem(temp, 1);
-            if (value == NULL)
+        if (PyUnicode_CheckExact(key)) {
+            Py_INCREF(key);
+            piece = key;
+        }
+        else {
+            *stable &= PyLong_CheckExact(key);
+            piece = PyObject_Str(key);
+            if (piece == NULL)
                 goto done;
+        }
+        ADD_PIECE(piece);
+
+        Py_INCREF(str_equals);
+        ADD_PIECE(str_equals);
 
-            /* Prevent repr from deleting value during key format. */
-            Py_INCREF(value);
-            s = PyObject_Str(key);
-            str_concat(&s, equals);
-            value_repr = PyObject_Repr(value);
+        piece = PyObject_Repr(value);
+        if (piece == NULL) {
             Py_DECREF(value);
-            if(value_repr == NULL) {
-                Py_DECREF(s);
-                goto done;
-            }
-            str_concat_and_del(&s, value_repr);
-            if (s == NULL)
-                goto done;
-            status = PyList_Append(pieces, s);
-            Py_DECREF(s);  /* append created a new ref */
-            if (status < 0)
-                goto done;
+            goto done;
         }
+        ADD_PIECE(piece);
+        if (*stable)
+            *stable = has_stable_repr(value);
+        Py_DECREF(value);
+    }
 
-        /* Paste them all together with ", " between. */
-        s = str_from_string(", ");
-        if (s == NULL)
-            goto done;
-        inner_repr = str_join(s, pieces);
-        Py_DECREF(s);
+    Py_INCREF(str_close);
+    ADD_PIECE(str_close);
 
-        if (inner_repr == NULL)
-            goto done;
+#undef ADD_PIECE
 
-        result = format_with_type(type, inner_repr);
-    }
+    /* unused trailing slots, if any, are dropped */
+    if (PyList_SetSlice(pieces, j, PyList_GET_SIZE(pieces), NULL) < 0)
+        goto done;
+
+    result = PyUnicode_Join(str_empty, pieces);
 
 done:
-    Py_XDECREF(inner_repr);
-    Py_XDECREF(items);
+    Py_XDECREF(type_name);
+    Py_XDECREF(keys);
     Py_XDECREF(pieces);
-    Py_XDECREF(equals);
     Py_ReprLeave(self);
     return result;
 }
 
 
-#if PY_MAJOR_VERSION < 3
-static int
-Struct_print(PyObject *self, FILE *fp, int flags)
+static PyObject *
+Struct_repr_impl(PyObject *self, int *stable)
 {
-    PyObject *repr = Py_TYPE(self)->tp_repr(self);
-    if (repr == NULL)
-        return -1;
+    return sorted_repr(self, PyDict_Keys, PyDict_GetItemRef, stable);
+}
 
-    fprintf(fp, "%s", PyString_AS_STRING(repr));
-    return 0;
+
+static PyObject *
+Struct_repr(PyObject *self)
+{
+    int stable;
+
+    return Struct_repr_impl(self, &stable);
 }
-#endif
+
+
+static PyObject *DefaultStruct_getattr(PyObject *, PyObject *);
+static PyObject *DefaultStruct_vivify(PyObject *, PyObject *);
+
+
+PyDoc_STRVAR(Struct_get_attr_doc,
+"get_attr(name, default=None)\n"
+"\n"
+"Like `getattr(self, name, default)`, but without raising and catching\n"
+"an AttributeError on a miss.\n"
+);
+
+
+static PyObject *
+Struct_get_attr(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    PyObject *name, *value, *missing;
+    PyObject *dflt = Py_None;
+    getattrofunc getattro;
+    int res;
+
+    if (nargs < 1 || nargs > 2) {
+        PyErr_Format(PyExc_TypeError,
+                     "get_attr expected 1 or 2 arguments, got %zd", nargs);
+        return NULL;
+    }
+    name = args[0];
+    if (nargs == 2)
+        dflt = args[1];
+
+    res = PyDict_GetItemRef(self, name, &value);
+    if (res != 0) {
+        if (res > 0)
+            COUNT_ACCESS(self, str_hits, name);
+        return value;
+    }
+
+    getattro = Py_TYPE(self)->tp_getattro;
+    if ((getattro == Struct_getattr || getattro == DefaultStruct_getattr)
+            && is_plain_attribute_miss(self, name)) {
+        COUNT_ACCESS(self, str_misses, name);
+        if (getattro == DefaultStruct_getattr && Py_TYPE(self) == DefaultStructType) {
+            COUNT_ACCESS(self, str_missing, name);
+            return DefaultStruct_vivify(self, name);
+        }
+        missing = lookup_missing(Py_TYPE(self));
+        if (missing == NULL) {
+            Py_INCREF(dflt);
+            return dflt;
+        }
+        COUNT_ACCESS(self, str_missing, name);
+        value = call_missing(missing, self, name);
+    }
+    else {
+        value = PyObject_GetAttr(self, name);
+    }
+    if (value == NULL && PyErr_ExceptionMatches(PyExc_AttributeError)) {
+        PyErr_Clear();
+        Py_INCREF(dflt);
+        return dflt;
+    }
+    return value;
+}
+
+
+PyDoc_STRVAR(Struct_schema_doc,
+"schema(*keys, name='Struct') -> new compact Struct type\n"
+"\n"
+"A type for many structs with the same keys. The key table is shared by\n"
+"all instances and the values are kept in an array, so an instance takes\n"
+"about as much memory as a tuple. Keys outside the schema can still be\n"
+"set, they are kept in an overflow dict.\n"
+"\n"
+">>> Row = Struct.schema('id', 'name')\n"
+">>> Row(1, name='foo')\n"
+"Struct(id=1, name='foo')\n"
+);
+
+
+static PyObject *
+Struct_schema(PyObject *cls, PyObject *args, PyObject *kwargs)
+{
+    PyObject *module, *schema_type, *result;
+
+    module = PyImport_ImportModule("tri_struct._schema");
+    if (module == NULL)
+        return NULL;
+    schema_type = PyObject_GetAttrString(module, "schema_type");
+    Py_DECREF(module);
+    if (schema_type == NULL)
+        return NULL;
+    result = PyObject_Call(schema_type, args, kwargs);
+    Py_DECREF(schema_type);
+    return result;
+}
+
+
+/* defined with the other bulk tree operations further down */
+static PyObject *Struct_deepcopy(PyObject *self, PyObject *memo);
+
+/* defined with the row iterator further down */
+static PyObject *Struct_from_rows(PyObject *cls, PyObject *args, PyObject *kwargs);
+
+PyDoc_STRVAR(Struct_from_rows_doc,
+"from_rows(keys, rows, lazy=False) -> list of structs\n"
+"\n"
+"A struct of this type for every row of values in `rows`, with the keys\n"
+"from `keys` in order. Like `[cls(zip(keys, row)) for row in rows]`, but\n"
+"the keys are interned once and no pairs are built.\n"
+"A row with more or fewer values than there are keys raises ValueError.\n"
+"With `lazy`, an iterator that builds the structs one at a time is\n"
+"returned instead, for result sets that don't fit in memory.\n"
+"\n"
+">>> Struct.from_rows(('id', 'name'), [(1, 'a'), (2, 'b')])\n"
+"[Struct(id=1, name='a'), Struct(id=2, name='b')]\n"
+);
+
+PyDoc_STRVAR(Struct_deepcopy_doc,
+"__deepcopy__(memo) -> deep copy\n"
+"\n"
+"Nested structs, dicts and lists are copied in c, without recursion.\n"
+"Frozen structs and immutable scalars are shared, other values are passed\n"
+"to copy.deepcopy. Shared and cyclic references are kept through `memo`.\n"
+);
 
 
 static PyMethodDef Struct_methods[] = {
     {"copy", (PyCFunction)Struct_copy, METH_NOARGS},
+    {"__deepcopy__", (PyCFunction)Struct_deepcopy, METH_O, Struct_deepcopy_doc},
+    {"schema", (PyCFunction)(void(*)(void))Struct_schema,
+        METH_VARARGS | METH_KEYWORDS | METH_CLASS, Struct_schema_doc},
+    {"from_rows", (PyCFunction)(void(*)(void))Struct_from_rows,
+        METH_VARARGS | METH_KEYWORDS | METH_CLASS, Struct_from_rows_doc},
+    {"get_attr", (PyCFunction)(void(*)(void))Struct_get_attr, METH_FASTCALL,
+        Struct_get_attr_doc},
     {NULL, NULL},
 };
 
@@ -228,18 +690,13 @@ PyDoc_STRVAR(Struct_doc,
 
 static PyType_Slot
 StructType_slots[] = {
-    {Py_tp_doc, Struct_doc},
+    {Py_tp_doc, (void *)Struct_doc},
     {Py_tp_base, NULL},
-    {Py_tp_new, NULL},
     {Py_tp_dealloc, NULL},
     {Py_tp_hash, NULL},
     {Py_tp_traverse, NULL},
     {Py_tp_clear, NULL},
     {Py_tp_richcompare, NULL},
-#if PY_MAJOR_VERSION < 3
-    {Py_tp_compare, NULL},
-    {Py_tp_print, Struct_print},
-#endif
     {Py_tp_repr, Struct_repr},
     {Py_tp_str, Struct_repr},
     {Py_tp_getattro, Struct_getattr},
@@ -251,7 +708,7 @@ StructType_slots[] = {
 
 static PyType_Spec
 StructType_spec = {
-    .name = "tri_struct.FastStruct",
+    .name = "tri_struct.Struct",
     .basicsize = sizeof(StructObject),
     .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC
         | Py_TPFLAGS_DICT_SUBCLASS | Py_TPFLAGS_HAVE_VERSION_TAG,
@@ -259,70 +716,4478 @@ StructType_spec = {
 };
 
 
-static int
-basestruct_exec(PyObject *m)
+/*
+    FrozenStruct: an immutable Struct that caches its hash in the object
+ */
+
+static PyObject *
+FrozenStruct_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 {
-    PyObject *o;
+    PyObject *self;
 
-    /* some members must be initialized at runtime,
-       because they're not compile-time constants
-     */
-    StructType_slots[1].pfunc = &PyDict_Type;
-    StructType_slots[2].pfunc = PyDict_Type.tp_new;
-    StructType_slots[3].pfunc = PyDict_Type.tp_dealloc;
-    StructType_slots[4].pfunc = PyDict_Type.tp_hash;
-    StructType_slots[5].pfunc = PyDict_Type.tp_traverse;
-    StructType_slots[6].pfunc = PyDict_Type.tp_clear;
-    StructType_slots[7].pfunc = PyDict_Type.tp_richcompare;
-#if PY_MAJOR_VERSION < 3
-    StructType_slots[8].pfunc = PyDict_Type.tp_compare;
-#endif
+    self = PyDict_Type.tp_new(type, args, kwds);
+    if (self != NULL) {
+        ((FrozenStructObject *)self)->hash = -1;
+        ((FrozenStructObject *)self)->repr = NULL;
+        ((FrozenStructObject *)self)->weakreflist = NULL;
+    }
+    return self;
+}
 
-    o = PyType_FromSpec(&StructType_spec);
-    if (o == NULL)
-        goto fail;
-    /* emulate more closely "real" heap types */
-    ((PyTypeObject *)o)->tp_name = "Struct";
-    PyModule_AddObject(m, "_Struct", o);
 
-    return 0;
-fail:
-    Py_XDECREF(m);
-    return -1;
+static void
+FrozenStruct_dealloc(PyObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    PyObject_GC_UnTrack(self);
+    if (((FrozenStructObject *)self)->weakreflist != NULL)
+        PyObject_ClearWeakRefs(self);
+    Py_CLEAR(((FrozenStructObject *)self)->repr);
+    PyDict_Type.tp_dealloc(self);
+    Py_DECREF(type);
 }
 
 
-#if PY_MAJOR_VERSION >= 3
-static PyModuleDef_Slot basestruct_slots[] = {
-    {Py_mod_exec, basestruct_exec},
-    {0, NULL},
-};
+static int
+FrozenStruct_has_cached_repr(PyObject *obj)
+{
+    return PyObject_TypeCheck(obj, FrozenStructType)
+        && ((FrozenStructObject *)obj)->repr != NULL;
+}
 
 
-static struct PyModuleDef moduledef = {
-    PyModuleDef_HEAD_INIT,
-    .m_name = "_cstruct",
-    .m_doc = "",
-    .m_slots = basestruct_slots,
-};
+/* The repr is cached like the hash, as long as it is made up of values
+   whose repr can't change.
+ */
+static PyObject *
+FrozenStruct_repr(PyObject *self)
+{
+    PyObject *repr;
+    int stable;
 
+    Py_BEGIN_CRITICAL_SECTION(self);
+    repr = ((FrozenStructObject *)self)->repr;
+    Py_XINCREF(repr);
+    Py_END_CRITICAL_SECTION();
+    if (repr != NULL)
+        return repr;
 
-PyMODINIT_FUNC
-PyInit__cstruct(void)
+    repr = Struct_repr_impl(self, &stable);
+    if (repr != NULL && stable) {
+        /* another thread may have cached one in the meantime */
+        Py_BEGIN_CRITICAL_SECTION(self);
+        if (((FrozenStructObject *)self)->repr == NULL) {
+            Py_INCREF(repr);
+            ((FrozenStructObject *)self)->repr = repr;
+        }
+        Py_END_CRITICAL_SECTION();
+    }
+    return repr;
+}
+
+
+/* The constants of tuple hashing, see `tuplehash` */
+#if SIZEOF_PY_UHASH_T > 4
+#define XXPRIME_1 ((Py_uhash_t)11400714785074694791ULL)
+#define XXPRIME_2 ((Py_uhash_t)14029467366897019727ULL)
+#define XXPRIME_5 ((Py_uhash_t)2870177450012600261ULL)
+#define XXROTATE(x) ((x << 31) | (x >> 33))
+#else
+#define XXPRIME_1 ((Py_uhash_t)2654435761UL)
+#define XXPRIME_2 ((Py_uhash_t)2246822519UL)
+#define XXPRIME_5 ((Py_uhash_t)374761393UL)
+#define XXROTATE(x) ((x << 13) | (x >> 19))
+#endif
+
+
+/* `hash((key, value))`, without making the tuple */
+static Py_hash_t
+pair_hash(PyObject *key, PyObject *value)
+{
+    Py_uhash_t acc = XXPRIME_5;
+    Py_hash_t lane;
+
+    lane = PyObject_Hash(key);
+    if (lane == -1)
+        return -1;
+    acc += (Py_uhash_t)lane * XXPRIME_2;
+    acc = XXROTATE(acc);
+    acc *= XXPRIME_1;
+
+    lane = PyObject_Hash(value);
+    if (lane == -1)
+        return -1;
+    acc += (Py_uhash_t)lane * XXPRIME_2;
+    acc = XXROTATE(acc);
+    acc *= XXPRIME_1;
+
+    acc += 2 ^ (XXPRIME_5 ^ 3527539UL);
+    if (acc == (Py_uhash_t)-1)
+        return 1546275796;
+    return (Py_hash_t)acc;
+}
+
+
+static Py_uhash_t
+shuffle_bits(Py_uhash_t h)
+{
+    return ((h ^ 89869747UL) ^ (h << 16)) * 3644798167UL;
+}
+
+
+/* `hash(frozenset(d.items()))` in a single pass over the dict and without
+   any allocations. The pair hashes are combined with xor, so the result
+   doesn't depend on the order of the keys and nothing has to be sorted.
+ */
+static Py_hash_t
+struct_hash(PyObject *d)
+{
+    Py_uhash_t hash = 0;
+    Py_hash_t h;
+    Py_ssize_t pos = 0;
+    PyObject *key, *value;
+
+    while (dict_next_ref(d, &pos, &key, &value)) {
+        h = pair_hash(key, value);
+        Py_DECREF(key);
+        Py_DECREF(value);
+        if (h == -1)
+            return -1;
+        hash ^= shuffle_bits((Py_uhash_t)h);
+    }
+
+    hash ^= ((Py_uhash_t)PyDict_GET_SIZE(d) + 1) * 1927868237UL;
+    hash ^= (hash >> 11) ^ (hash >> 25);
+    hash = hash * 69069U + 907133923UL;
+    if (hash == (Py_uhash_t)-1)
+        hash = 590923713UL;
+    return (Py_hash_t)hash;
+}
+
+
+static Py_hash_t
+FrozenStruct_hash(PyObject *self)
+{
+    Py_hash_t hash;
+
+    hash = FT_ATOMIC_LOAD_SSIZE_RELAXED(((FrozenStructObject *)self)->hash);
+    if (hash != -1)
+        return hash;
+
+    /* threads racing here all store the same value */
+    hash = struct_hash(self);
+    if (hash != -1)
+        FT_ATOMIC_STORE_SSIZE_RELAXED(((FrozenStructObject *)self)->hash, hash);
+    return hash;
+}
+
+
+/* Equal structs have equal hashes, so two frozen structs whose hashes are
+   both known and differ can't be equal
+ */
+static PyObject *
+FrozenStruct_richcompare(PyObject *self, PyObject *other, int op)
+{
+    Py_hash_t hash, other_hash;
+
+    if ((op == Py_EQ || op == Py_NE) && PyObject_TypeCheck(other, FrozenStructType)) {
+        if (self == other)
+            return PyBool_FromLong(op == Py_EQ);
+        hash = FT_ATOMIC_LOAD_SSIZE_RELAXED(((FrozenStructObject *)self)->hash);
+        other_hash = FT_ATOMIC_LOAD_SSIZE_RELAXED(((FrozenStructObject *)other)->hash);
+        if (hash != -1 && other_hash != -1 && hash != other_hash)
+            return PyBool_FromLong(op == Py_NE);
+    }
+    return PyDict_Type.tp_richcompare(self, other, op);
+}
+
+
+static int
+FrozenStruct_setattr(PyObject *self, PyObject *name, PyObject *value)
+{
+    set_read_only_error(self);
+    return -1;
+}
+
+
+static int
+FrozenStruct_ass_subscript(PyObject *self, PyObject *key, PyObject *value)
+{
+    set_read_only_error(self);
+    return -1;
+}
+
+
+static PyObject *
+FrozenStruct_read_only(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    set_read_only_error(self);
+    return NULL;
+}
+
+
+static PyObject *
+FrozenStruct_inplace_or(PyObject *self, PyObject *other)
+{
+    set_read_only_error(self);
+    return NULL;
+}
+
+
+/* `(type, (dict,))`: the pickler would recurse into the struct itself, so
+   the contents are handed over as a plain dict, cloned in one go. The
+   struct is then rebuilt with a single constructor call. `__setstate__`
+   stays for pickles made by older versions.
+ */
+static PyObject *
+FrozenStruct_reduce(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *contents;
+
+    contents = PyDict_Copy(self);
+    if (contents == NULL)
+        return NULL;
+    return Py_BuildValue("(O(N))", (PyObject *)Py_TYPE(self), contents);
+}
+
+
+static PyObject *
+FrozenStruct_setstate(PyObject *self, PyObject *state)
+{
+    if (PyDict_Merge(self, state, 1) < 0)
+        return NULL;
+    Py_RETURN_NONE;
+}
+
+
+static PyObject *
+FrozenStruct_copy(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    Py_INCREF(self);
+    return self;
+}
+
+
+PyDoc_STRVAR(FrozenStruct_intern_doc,
+"intern(s) -> the canonical instance equal to s\n"
+"\n"
+"See `tri_struct.intern_table`. `s` is converted to this type first if it\n"
+"is some other mapping.\n"
+);
+
+
+static PyObject *
+FrozenStruct_intern(PyObject *cls, PyObject *s)
+{
+    PyObject *module, *table, *result;
+
+    module = PyImport_ImportModule("tri_struct._intern");
+    if (module == NULL)
+        return NULL;
+    table = PyObject_GetAttrString(module, "intern_table");
+    Py_DECREF(module);
+    if (table == NULL)
+        return NULL;
+    result = PyObject_CallMethod(table, "intern", "OO", s, cls);
+    Py_DECREF(table);
+    return result;
+}
+
+
+static PyObject *str__hash = NULL;
+
+
+/* The cached hash, like the `_hash` slot of the python FrozenStruct:
+   only there once the struct has been hashed.
+ */
+static PyObject *
+FrozenStruct_get_hash(PyObject *self, void *Py_UNUSED(closure))
+{
+    Py_hash_t hash;
+
+    hash = FT_ATOMIC_LOAD_SSIZE_RELAXED(((FrozenStructObject *)self)->hash);
+    if (hash == -1) {
+        PyErr_SetObject(PyExc_AttributeError, str__hash);
+        return NULL;
+    }
+    return PyLong_FromSsize_t(hash);
+}
+
+
+static PyGetSetDef FrozenStruct_getset[] = {
+    {"_hash", FrozenStruct_get_hash, NULL, NULL, NULL},
+    {NULL},
+};
+
+
+static PyMemberDef FrozenStruct_members[] = {
+    {"__weaklistoffset__", T_PYSSIZET,
+        offsetof(FrozenStructObject, weakreflist), READONLY},
+    {NULL},
+};
+
+
+static PyMethodDef FrozenStruct_methods[] = {
+    {"setdefault", (PyCFunction)(void(*)(void))FrozenStruct_read_only,
+        METH_VARARGS | METH_KEYWORDS},
+    {"update", (PyCFunction)(void(*)(void))FrozenStruct_read_only,
+        METH_VARARGS | METH_KEYWORDS},
+    {"clear", (PyCFunction)(void(*)(void))FrozenStruct_read_only,
+        METH_VARARGS | METH_KEYWORDS},
+    {"pop", (PyCFunction)(void(*)(void))FrozenStruct_read_only,
+        METH_VARARGS | METH_KEYWORDS},
+    {"popitem", (PyCFunction)(void(*)(void))FrozenStruct_read_only,
+        METH_VARARGS | METH_KEYWORDS},
+    {"__reduce__", (PyCFunction)FrozenStruct_reduce, METH_NOARGS},
+    {"__setstate__", (PyCFunction)FrozenStruct_setstate, METH_O},
+    {"__copy__", (PyCFunction)FrozenStruct_copy, METH_NOARGS},
+    {"__deepcopy__", (PyCFunction)FrozenStruct_copy, METH_O},
+    {"intern", (PyCFunction)FrozenStruct_intern, METH_O | METH_CLASS,
+        FrozenStruct_intern_doc},
+    {NULL, NULL},
+};
+
+
+PyDoc_STRVAR(FrozenStruct_doc,
+"FrozenStruct(**kwargs) -> new immutable Struct\n"
+"\n"
+"Like Struct, but attributes and items are read-only and instances are\n"
+"hashable. The hash is computed on first use and cached in the object.\n"
+);
+
+
+static PyType_Slot
+FrozenStructType_slots[] = {
+    {Py_tp_doc, (void *)FrozenStruct_doc},
+    {Py_tp_new, FrozenStruct_new},
+    {Py_tp_hash, FrozenStruct_hash},
+    {Py_tp_richcompare, FrozenStruct_richcompare},
+    {Py_tp_traverse, NULL},
+    {Py_tp_clear, NULL},
+    {Py_tp_dealloc, FrozenStruct_dealloc},
+    {Py_tp_repr, FrozenStruct_repr},
+    {Py_tp_str, FrozenStruct_repr},
+    {Py_tp_setattro, FrozenStruct_setattr},
+    {Py_mp_ass_subscript, FrozenStruct_ass_subscript},
+    {Py_nb_inplace_or, FrozenStruct_inplace_or},
+    {Py_tp_methods, FrozenStruct_methods},
+    {Py_tp_members, FrozenStruct_members},
+    {Py_tp_getset, FrozenStruct_getset},
+    {0, NULL}
+};
+
+
+static PyType_Spec
+FrozenStructType_spec = {
+    .name = "tri_struct.FrozenStruct",
+    .basicsize = sizeof(FrozenStructObject),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC
+        | Py_TPFLAGS_DICT_SUBCLASS | Py_TPFLAGS_HAVE_VERSION_TAG,
+    .slots = FrozenStructType_slots
+};
+
+
+/*
+    DefaultStruct: a Struct that creates missing attributes and items
+    by calling `default_factory`, in the spirit of `defaultdict`
+ */
+
+static PyObject *
+DefaultStruct_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    return PyDict_Type.tp_new(type, args, kwds);
+}
+
+
+static int
+DefaultStruct_init(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    PyObject *factory = NULL, *rest = NULL, *rest_kwds = NULL;
+    int res = -1;
+
+    if (PyTuple_GET_SIZE(args) > 0) {
+        factory = PyTuple_GET_ITEM(args, 0);
+        rest = PyTuple_GetSlice(args, 1, PyTuple_GET_SIZE(args));
+        if (rest == NULL)
+            return -1;
+    }
+    else {
+        Py_INCREF(args);
+        rest = args;
+    }
+
+    if (kwds != NULL && PyDict_GET_SIZE(kwds) > 0) {
+        PyObject *kw_factory;
+
+        kw_factory = PyDict_GetItemString(kwds, "default_factory");
+        if (kw_factory != NULL) {
+            if (factory != NULL) {
+                PyErr_SetString(PyExc_TypeError,
+                                "DefaultStruct() got multiple values for "
+                                "argument 'default_factory'");
+                goto done;
+            }
+            factory = kw_factory;
+            rest_kwds = PyDict_Copy(kwds);
+            if (rest_kwds == NULL ||
+                PyDict_DelItemString(rest_kwds, "default_factory") < 0)
+                goto done;
+        }
+    }
+
+    if (factory == NULL || factory == Py_None)
+        factory = (PyObject *)DefaultStructType;
+    else if (!PyCallable_Check(factory)) {
+        PyErr_SetString(PyExc_TypeError,
+                        "default_factory must be callable or None");
+        goto done;
+    }
+    Py_INCREF(factory);
+    Py_BEGIN_CRITICAL_SECTION(self);
+    Py_XSETREF(((DefaultStructObject *)self)->default_factory, factory);
+    Py_END_CRITICAL_SECTION();
+
+    res = PyDict_Type.tp_init(self, rest, rest_kwds != NULL ? rest_kwds : kwds);
+
+done:
+    Py_XDECREF(rest);
+    Py_XDECREF(rest_kwds);
+    return res;
+}
+
+
+static int
+DefaultStruct_traverse(PyObject *self, visitproc visit, void *arg)
+{
+    Py_VISIT(((DefaultStructObject *)self)->default_factory);
+    return PyDict_Type.tp_traverse(self, visit, arg);
+}
+
+
+static int
+DefaultStruct_tp_clear(PyObject *self)
+{
+    Py_CLEAR(((DefaultStructObject *)self)->default_factory);
+    return PyDict_Type.tp_clear(self);
+}
+
+
+static void
+DefaultStruct_dealloc(PyObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    PyObject_GC_UnTrack(self);
+    Py_CLEAR(((DefaultStructObject *)self)->default_factory);
+    PyDict_Type.tp_dealloc(self);
+    Py_DECREF(type);
+}
+
+
+/* The `default_factory` of `self` as a new reference, which can be NULL */
+static PyObject *
+get_default_factory(PyObject *self)
+{
+    PyObject *factory;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    factory = ((DefaultStructObject *)self)->default_factory;
+    Py_XINCREF(factory);
+    Py_END_CRITICAL_SECTION();
+    return factory;
+}
+
+
+/* Create, store and return the default value for `key`. If another
+   thread stored one first, that one is returned.
+ */
+static PyObject *
+DefaultStruct_vivify(PyObject *self, PyObject *key)
+{
+    PyObject *factory, *value, *result;
+
+    factory = get_default_factory(self);
+    if (factory == NULL || factory == (PyObject *)DefaultStructType) {
+        /* the common case of nested DefaultStructs, without a call */
+        value = DefaultStruct_new(DefaultStructType, empty_tuple, NULL);
+        if (value != NULL) {
+            Py_INCREF(DefaultStructType);
+            ((DefaultStructObject *)value)->default_factory =
+                (PyObject *)DefaultStructType;
+        }
+    }
+    else
+        value = PyObject_CallObject(factory, NULL);
+    Py_XDECREF(factory);
+
+    if (value == NULL)
+        return NULL;
+    PyDict_SetDefaultRef(self, key, value, &result);
+    Py_DECREF(value);
+    return result;
+}
+
+
+static PyObject *
+DefaultStruct_getattr(PyObject *self, PyObject *name)
+{
+    PyObject *value;
+    int res;
+
+    /* subclasses may define their own `__missing__` */
+    if (Py_TYPE(self) != DefaultStructType)
+        return Struct_getattr(self, name);
+
+    res = PyDict_GetItemRef(self, name, &value);
+    if (res != 0) {
+        if (res > 0)
+            COUNT_ACCESS(self, str_hits, name);
+        return value;
+    }
+
+    COUNT_ACCESS(self, str_misses, name);
+    if (!is_plain_attribute_miss(self, name)) {
+        value = PyObject_GenericGetAttr(self, name);
+        if (value != NULL || !PyErr_ExceptionMatches(PyExc_AttributeError))
+            return value;
+        PyErr_Clear();
+    }
+
+    COUNT_ACCESS(self, str_missing, name);
+    return DefaultStruct_vivify(self, name);
+}
+
+
+static PyObject *
+DefaultStruct_missing(PyObject *self, PyObject *key)
+{
+    return DefaultStruct_vivify(self, key);
+}
+
+
+static PyObject *
+DefaultStruct_copy(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *copy;
+
+    copy = DefaultStruct_new(Py_TYPE(self), empty_tuple, NULL);
+    if (copy == NULL)
+        return NULL;
+    ((DefaultStructObject *)copy)->default_factory = get_default_factory(self);
+    if (PyDict_Merge(copy, self, 1) < 0) {
+        Py_DECREF(copy);
+        return NULL;
+    }
+    return copy;
+}
+
+
+static PyObject *
+DefaultStruct_reduce(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *factory, *items, *iter;
+
+    items = PyDict_Items(self);
+    if (items == NULL)
+        return NULL;
+    iter = PyObject_GetIter(items);
+    Py_DECREF(items);
+    if (iter == NULL)
+        return NULL;
+
+    factory = get_default_factory(self);
+    if (factory == NULL) {
+        Py_INCREF(Py_None);
+        factory = Py_None;
+    }
+    return Py_BuildValue("O(N)OON", (PyObject *)Py_TYPE(self), factory,
+                         Py_None, Py_None, iter);
+}
+
+
+static PyMethodDef DefaultStruct_methods[] = {
+    {"__missing__", (PyCFunction)DefaultStruct_missing, METH_O},
+    {"copy", (PyCFunction)DefaultStruct_copy, METH_NOARGS},
+    {"__copy__", (PyCFunction)DefaultStruct_copy, METH_NOARGS},
+    {"__reduce__", (PyCFunction)DefaultStruct_reduce, METH_NOARGS},
+    {NULL, NULL},
+};
+
+
+static PyMemberDef DefaultStruct_members[] = {
+    {"_default_factory", T_OBJECT,
+        offsetof(DefaultStructObject, default_factory), READONLY},
+    {NULL},
+};
+
+
+PyDoc_STRVAR(DefaultStruct_doc,
+"DefaultStruct(default_factory=None, *args, **kwargs) -> new DefaultStruct\n"
+"\n"
+"Like Struct, but missing attributes and items are created by calling\n"
+"`default_factory` and stored. The default is to create a nested\n"
+"DefaultStruct, so `s.a.b.c = 1` builds the intermediate levels.\n"
+);
+
+
+static PyType_Slot
+DefaultStructType_slots[] = {
+    {Py_tp_doc, (void *)DefaultStruct_doc},
+    {Py_tp_new, DefaultStruct_new},
+    {Py_tp_init, DefaultStruct_init},
+    {Py_tp_traverse, DefaultStruct_traverse},
+    {Py_tp_clear, DefaultStruct_tp_clear},
+    {Py_tp_dealloc, DefaultStruct_dealloc},
+    {Py_tp_getattro, DefaultStruct_getattr},
+    {Py_tp_methods, DefaultStruct_methods},
+    {Py_tp_members, DefaultStruct_members},
+    {0, NULL}
+};
+
+
+static PyType_Spec
+DefaultStructType_spec = {
+    .name = "tri_struct.DefaultStruct",
+    .basicsize = sizeof(DefaultStructObject),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC
+        | Py_TPFLAGS_DICT_SUBCLASS | Py_TPFLAGS_HAVE_VERSION_TAG,
+    .slots = DefaultStructType_slots
+};
+
+
+/*
+    SchemaStruct: a Struct with a fixed set of keys, declared once per
+    type. The values live in an array in the object and the key table is
+    shared by all instances, so an instance costs about as much as a
+    tuple. Keys outside the schema go to an overflow dict.
+ */
+
+typedef struct {
+    PyObject_VAR_HEAD
+    PyObject *index;      /* shared dict, key -> position in `values` */
+    PyObject *overflow;   /* dict of keys outside the schema, or NULL */
+    PyObject *values[1];  /* NULL for keys that are not set */
+} SchemaStructObject;
+
+
+static PyTypeObject *SchemaStructType = NULL;
+static PyObject *str__schema = NULL;
+
+
+#define SchemaStruct_Check(op) PyObject_TypeCheck(op, SchemaStructType)
+#define SCHEMA_INDEX(op) (((SchemaStructObject *)(op))->index)
+#define SCHEMA_OVERFLOW(op) (((SchemaStructObject *)(op))->overflow)
+#define SCHEMA_VALUES(op) (((SchemaStructObject *)(op))->values)
+
+
+/* The index dict is a class attribute, so don't trust it further than
+   the size of the values array allocated from it
+ */
+static Py_ssize_t
+schema_check_position(PyObject *self, PyObject *position)
+{
+    Py_ssize_t i;
+
+    i = PyLong_AsSsize_t(position);
+    if (i == -1 && PyErr_Occurred())
+        return -2;
+    if (i < 0 || i >= Py_SIZE(self)) {
+        PyErr_SetString(PyExc_RuntimeError, "schema changed after use");
+        return -2;
+    }
+    return i;
+}
+
+
+/* Position of `key` in the values of `self`, -1 if it is not in the
+   schema and -2 with an exception set on errors
+ */
+static Py_ssize_t
+schema_position(PyObject *self, PyObject *key)
+{
+    PyObject *position;
+    Py_ssize_t i;
+    int res;
+
+    res = PyDict_GetItemRef(SCHEMA_INDEX(self), key, &position);
+    if (res <= 0)
+        return res < 0 ? -2 : -1;
+    i = schema_check_position(self, position);
+    Py_DECREF(position);
+    return i;
+}
+
+
+/* The values array and the overflow dict pointer of a schema struct are
+   only used with the struct locked, which makes a difference in the
+   free-threaded build. The overflow dict is never replaced once made, so
+   it can be used after unlocking while holding a reference.
+ */
+static PyObject *
+schema_overflow(PyObject *self, int create)
+{
+    PyObject *overflow;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    if (SCHEMA_OVERFLOW(self) == NULL && create)
+        SCHEMA_OVERFLOW(self) = PyDict_New();
+    overflow = SCHEMA_OVERFLOW(self);
+    Py_XINCREF(overflow);
+    Py_END_CRITICAL_SECTION();
+    return overflow;
+}
+
+
+/* The value of `key`, like `PyDict_GetItemRef` */
+static int
+SchemaStruct_lookup(PyObject *self, PyObject *key, PyObject **value)
+{
+    Py_ssize_t i;
+    PyObject *overflow;
+    int res;
+
+    *value = NULL;
+    i = schema_position(self, key);
+    if (i == -2)
+        return -1;
+    if (i >= 0) {
+        Py_BEGIN_CRITICAL_SECTION(self);
+        *value = SCHEMA_VALUES(self)[i];
+        Py_XINCREF(*value);
+        Py_END_CRITICAL_SECTION();
+        return *value != NULL;
+    }
+    overflow = schema_overflow(self, 0);
+    if (overflow == NULL)
+        return 0;
+    res = PyDict_GetItemRef(overflow, key, value);
+    Py_DECREF(overflow);
+    return res;
+}
+
+
+/* Set or, with a NULL `value`, delete `key`. Returns 1 if a deleted key
+   was not there, so callers can raise the right error.
+ */
+static int
+SchemaStruct_store(PyObject *self, PyObject *key, PyObject *value)
+{
+    Py_ssize_t i;
+    PyObject *old, *overflow;
+    int res;
+
+    i = schema_position(self, key);
+    if (i == -2)
+        return -1;
+    if (i >= 0) {
+        Py_XINCREF(value);
+        Py_BEGIN_CRITICAL_SECTION(self);
+        old = SCHEMA_VALUES(self)[i];
+        SCHEMA_VALUES(self)[i] = value;
+        Py_END_CRITICAL_SECTION();
+        if (value == NULL && old == NULL)
+            return 1;
+        Py_XDECREF(old);
+        return 0;
+    }
+
+    overflow = schema_overflow(self, value != NULL);
+    if (overflow == NULL)
+        return value == NULL ? 1 : -1;
+    if (value != NULL) {
+        res = PyDict_SetItem(overflow, key, value);
+    }
+    else {
+        res = PyDict_DelItem(overflow, key);
+        if (res < 0 && PyErr_ExceptionMatches(PyExc_KeyError)) {
+            PyErr_Clear();
+            res = 1;
+        }
+    }
+    Py_DECREF(overflow);
+    return res;
+}
+
+
+static PyObject *
+SchemaStruct_alloc(PyTypeObject *type)
+{
+    PyObject *index, *self;
+
+    index = type_lookup(type, str__schema);
+    if (index == NULL || !PyDict_Check(index)) {
+        Py_XDECREF(index);
+        PyErr_Format(PyExc_TypeError,
+                     "%s has no schema, use Struct.schema() to create "
+                     "schema types", type->tp_name);
+        return NULL;
+    }
+
+    self = type->tp_alloc(type, PyDict_GET_SIZE(index));
+    if (self == NULL) {
+        Py_DECREF(index);
+        return NULL;
+    }
+    SCHEMA_INDEX(self) = index;
+    return self;
+}
+
+
+static PyObject *
+SchemaStruct_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    Py_ssize_t i, n, nargs, pos = 0;
+    PyObject *self, *key, *value;
+
+    self = SchemaStruct_alloc(type);
+    if (self == NULL)
+        return NULL;
+
+    n = Py_SIZE(self);
+    nargs = PyTuple_GET_SIZE(args);
+    if (nargs > n) {
+        PyErr_Format(PyExc_TypeError,
+                     "%s() takes at most %zd positional arguments (%zd given)",
+                     type->tp_name, n, nargs);
+        goto fail;
+    }
+    for (i = 0; i < nargs; i++) {
+        value = PyTuple_GET_ITEM(args, i);
+        Py_INCREF(value);
+        SCHEMA_VALUES(self)[i] = value;
+    }
+
+    if (kwds == NULL)
+        return self;
+    while (PyDict_Next(kwds, &pos, &key, &value)) {
+        i = schema_position(self, key);
+        if (i == -2)
+            goto fail;
+        if (i >= 0 && i < nargs) {
+            PyErr_Format(PyExc_TypeError,
+                         "%s() got multiple values for argument '%S'",
+                         type->tp_name, key);
+            goto fail;
+        }
+        if (SchemaStruct_store(self, key, value) < 0)
+            goto fail;
+    }
+    return self;
+
+fail:
+    Py_DECREF(self);
+    return NULL;
+}
+
+
+static int
+SchemaStruct_traverse(PyObject *self, visitproc visit, void *arg)
+{
+    Py_ssize_t i;
+
+    for (i = 0; i < Py_SIZE(self); i++)
+        Py_VISIT(SCHEMA_VALUES(self)[i]);
+    Py_VISIT(SCHEMA_OVERFLOW(self));
+    Py_VISIT(SCHEMA_INDEX(self));
+    Py_VISIT(Py_TYPE(self));
+    return 0;
+}
+
+
+static int
+SchemaStruct_tp_clear(PyObject *self)
+{
+    Py_ssize_t i;
+
+    for (i = 0; i < Py_SIZE(self); i++)
+        Py_CLEAR(SCHEMA_VALUES(self)[i]);
+    Py_CLEAR(SCHEMA_OVERFLOW(self));
+    Py_CLEAR(SCHEMA_INDEX(self));
+    return 0;
+}
+
+
+static void
+SchemaStruct_dealloc(PyObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    PyObject_GC_UnTrack(self);
+    Py_TRASHCAN_BEGIN(self, SchemaStruct_dealloc)
+    SchemaStruct_tp_clear(self);
+    type->tp_free(self);
+    Py_DECREF(type);
+    Py_TRASHCAN_END
+}
+
+
+static PyObject *
+SchemaStruct_getattr(PyObject *self, PyObject *name)
+{
+    PyObject *value;
+    int res;
+
+    res = SchemaStruct_lookup(self, name, &value);
+    if (res != 0) {
+        if (res > 0)
+            COUNT_ACCESS(self, str_hits, name);
+        return value;
+    }
+
+    COUNT_ACCESS(self, str_misses, name);
+    if (is_plain_attribute_miss(self, name)) {
+        set_attribute_error(self, name);
+        return NULL;
+    }
+    return PyObject_GenericGetAttr(self, name);
+}
+
+
+static int
+SchemaStruct_setattr(PyObject *self, PyObject *name, PyObject *value)
+{
+    int res;
+
+    res = SchemaStruct_store(self, name, value);
+    if (res > 0) {
+        set_attribute_error(self, name);
+        return -1;
+    }
+    return res;
+}
+
+
+static PyObject *
+SchemaStruct_subscript(PyObject *self, PyObject *key)
+{
+    PyObject *value;
+
+    if (SchemaStruct_lookup(self, key, &value) == 0)
+        set_key_error(key);
+    return value;
+}
+
+
+static int
+SchemaStruct_ass_subscript(PyObject *self, PyObject *key, PyObject *value)
+{
+    int res;
+
+    res = SchemaStruct_store(self, key, value);
+    if (res > 0) {
+        set_key_error(key);
+        return -1;
+    }
+    return res;
+}
+
+
+static Py_ssize_t
+schema_length_locked(PyObject *self)
+{
+    Py_ssize_t i, n = 0;
+
+    for (i = 0; i < Py_SIZE(self); i++)
+        n += SCHEMA_VALUES(self)[i] != NULL;
+    if (SCHEMA_OVERFLOW(self) != NULL)
+        n += PyDict_GET_SIZE(SCHEMA_OVERFLOW(self));
+    return n;
+}
+
+
+static Py_ssize_t
+SchemaStruct_length(PyObject *self)
+{
+    Py_ssize_t n;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    n = schema_length_locked(self);
+    Py_END_CRITICAL_SECTION();
+    return n;
+}
+
+
+static int
+SchemaStruct_contains(PyObject *self, PyObject *key)
+{
+    PyObject *value;
+    int res;
+
+    res = SchemaStruct_lookup(self, key, &value);
+    Py_XDECREF(value);
+    return res;
+}
+
+
+enum { SCHEMA_KEYS, SCHEMA_VALUES_, SCHEMA_ITEMS };
+
+
+static PyObject *
+schema_list_item(PyObject *key, PyObject *value, int what)
+{
+    if (what == SCHEMA_ITEMS)
+        return PyTuple_Pack(2, key, value);
+    if (what == SCHEMA_KEYS) {
+        Py_INCREF(key);
+        return key;
+    }
+    Py_INCREF(value);
+    return value;
+}
+
+
+/* Fill `result` from `*j` on with the keys, values or items of `d`, as
+   far as there is room
+ */
+static int
+schema_list_dict(PyObject *result, Py_ssize_t *j, PyObject *d, int what)
+{
+    Py_ssize_t pos = 0;
+    PyObject *key, *value, *item;
+
+    while (*j < PyList_GET_SIZE(result) && PyDict_Next(d, &pos, &key, &value)) {
+        if ((item = schema_list_item(key, value, what)) == NULL)
+            return -1;
+        PyList_SET_ITEM(result, (*j)++, item);
+    }
+    return 0;
+}
+
+
+static PyObject *
+schema_list_locked(PyObject *self, int what)
+{
+    Py_ssize_t i, j = 0, pos = 0;
+    PyObject *result, *key, *value, *item;
+    int res = 0;
+
+    result = PyList_New(schema_length_locked(self));
+    if (result == NULL)
+        return NULL;
+
+    while (PyDict_Next(SCHEMA_INDEX(self), &pos, &key, &item)) {
+        i = schema_check_position(self, item);
+        if (i < 0) {
+            Py_DECREF(result);
+            return NULL;
+        }
+        value = SCHEMA_VALUES(self)[i];
+        if (value == NULL)
+            continue;
+        if (j == PyList_GET_SIZE(result))
+            break;
+        if ((item = schema_list_item(key, value, what)) == NULL) {
+            Py_DECREF(result);
+            return NULL;
+        }
+        PyList_SET_ITEM(result, j++, item);
+    }
+
+    if (SCHEMA_OVERFLOW(self) != NULL) {
+        Py_BEGIN_CRITICAL_SECTION(SCHEMA_OVERFLOW(self));
+        res = schema_list_dict(result, &j, SCHEMA_OVERFLOW(self), what);
+        Py_END_CRITICAL_SECTION();
+    }
+    /* the overflow dict can shrink while it is being locked */
+    if (res < 0 || PyList_SetSlice(result, j, PyList_GET_SIZE(result), NULL) < 0) {
+        Py_DECREF(result);
+        return NULL;
+    }
+    return result;
+}
+
+
+/* A list of the keys, values or items, in schema order followed by the
+   overflow keys
+ */
+static PyObject *
+SchemaStruct_list(PyObject *self, int what)
+{
+    PyObject *result;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    result = schema_list_locked(self, what);
+    Py_END_CRITICAL_SECTION();
+    return result;
+}
+
+
+static PyObject *
+SchemaStruct_keys_list(PyObject *self)
+{
+    return SchemaStruct_list(self, SCHEMA_KEYS);
+}
+
+
+static PyObject *
+SchemaStruct_keys(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    return SchemaStruct_list(self, SCHEMA_KEYS);
+}
+
+
+static PyObject *
+SchemaStruct_values(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    return SchemaStruct_list(self, SCHEMA_VALUES_);
+}
+
+
+static PyObject *
+SchemaStruct_items(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    return SchemaStruct_list(self, SCHEMA_ITEMS);
+}
+
+
+static PyObject *
+SchemaStruct_iter(PyObject *self)
+{
+    PyObject *keys, *iter;
+
+    keys = SchemaStruct_list(self, SCHEMA_KEYS);
+    if (keys == NULL)
+        return NULL;
+    iter = PyObject_GetIter(keys);
+    Py_DECREF(keys);
+    return iter;
+}
+
+
+static PyObject *
+SchemaStruct_get(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    PyObject *value;
+
+    if (nargs < 1 || nargs > 2) {
+        PyErr_Format(PyExc_TypeError,
+                     "get expected 1 or 2 arguments, got %zd", nargs);
+        return NULL;
+    }
+    if (SchemaStruct_lookup(self, args[0], &value) != 0)
+        return value;
+    value = nargs == 2 ? args[1] : Py_None;
+    Py_INCREF(value);
+    return value;
+}
+
+
+static PyObject *
+SchemaStruct_get_attr(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    PyObject *value, *dflt;
+
+    if (nargs < 1 || nargs > 2) {
+        PyErr_Format(PyExc_TypeError,
+                     "get_attr expected 1 or 2 arguments, got %zd", nargs);
+        return NULL;
+    }
+    dflt = nargs == 2 ? args[1] : Py_None;
+
+    if (SchemaStruct_lookup(self, args[0], &value) != 0)
+        return value;
+    if (!is_plain_attribute_miss(self, args[0])) {
+        value = PyObject_GetAttr(self, args[0]);
+        if (value != NULL || !PyErr_ExceptionMatches(PyExc_AttributeError))
+            return value;
+        PyErr_Clear();
+    }
+    Py_INCREF(dflt);
+    return dflt;
+}
+
+
+static PyObject *
+SchemaStruct_copy(PyObject *self, PyObject *Py_UNUSED(ignored))
+{
+    Py_ssize_t i;
+    PyObject *copy, *value, *overflow;
+
+    copy = SchemaStruct_alloc(Py_TYPE(self));
+    if (copy == NULL)
+        return NULL;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    for (i = 0; i < Py_SIZE(self); i++) {
+        value = SCHEMA_VALUES(self)[i];
+        Py_XINCREF(value);
+        SCHEMA_VALUES(copy)[i] = value;
+    }
+    Py_END_CRITICAL_SECTION();
+    overflow = schema_overflow(self, 0);
+    if (overflow != NULL) {
+        SCHEMA_OVERFLOW(copy) = PyDict_Copy(overflow);
+        Py_DECREF(overflow);
+        if (SCHEMA_OVERFLOW(copy) == NULL) {
+            Py_DECREF(copy);
+            return NULL;
+        }
+    }
+    return copy;
+}
+
+
+/* Compare `value` to the value of `key` in `other`, a dict or a
+   SchemaStruct: 1 if equal, 0 if not or missing, -1 on errors
+ */
+static int
+schema_compare_item(PyObject *key, PyObject *value, PyObject *other)
+{
+    PyObject *other_value;
+    int res;
+
+    res = PyDict_Check(other) ? PyDict_GetItemRef(other, key, &other_value)
+                              : SchemaStruct_lookup(other, key, &other_value);
+    if (res <= 0)
+        return res;
+    Py_INCREF(value);
+    res = PyObject_RichCompareBool(value, other_value, Py_EQ);
+    Py_DECREF(value);
+    Py_DECREF(other_value);
+    return res;
+}
+
+
+/* Two instances of the same schema without overflow: compare the values
+   array directly
+ */
+static int
+schema_equal_values(PyObject *self, PyObject *other)
+{
+    Py_ssize_t i;
+    PyObject *value, *other_value;
+    int res;
+
+    for (i = 0; i < Py_SIZE(self); i++) {
+        Py_BEGIN_CRITICAL_SECTION2(self, other);
+        value = SCHEMA_VALUES(self)[i];
+        other_value = SCHEMA_VALUES(other)[i];
+        Py_XINCREF(value);
+        Py_XINCREF(other_value);
+        Py_END_CRITICAL_SECTION2();
+        if (value == NULL || other_value == NULL) {
+            Py_XDECREF(value);
+            Py_XDECREF(other_value);
+            if (value != other_value)
+                return 0;
+            continue;
+        }
+        res = PyObject_RichCompareBool(value, other_value, Py_EQ);
+        Py_DECREF(value);
+        Py_DECREF(other_value);
+        if (res <= 0)
+            return res;
+    }
+    return 1;
+}
+
+
+/* 1 if equal, 0 if not, -1 on errors */
+static int
+SchemaStruct_equal(PyObject *self, PyObject *other)
+{
+    Py_ssize_t other_length;
+    PyObject *items, *item;
+    Py_ssize_t i;
+    int res = 1;
+
+    if (SchemaStruct_Check(other) && SCHEMA_INDEX(other) == SCHEMA_INDEX(self)
+            && SCHEMA_OVERFLOW(self) == NULL && SCHEMA_OVERFLOW(other) == NULL)
+        return schema_equal_values(self, other);
+
+    other_length = PyDict_Check(other) ? PyDict_GET_SIZE(other)
+                                       : SchemaStruct_length(other);
+    if (SchemaStruct_length(self) != other_length)
+        return 0;
+
+    /* the lengths match, so it's enough to find all our items in `other`.
+       Work on a snapshot, since `__eq__` of the values can run any code. */
+    items = SchemaStruct_list(self, SCHEMA_ITEMS);
+    if (items == NULL)
+        return -1;
+    for (i = 0; res > 0 && i < PyList_GET_SIZE(items); i++) {
+        item = PyList_GET_ITEM(items, i);
+        res = schema_compare_item(PyTuple_GET_ITEM(item, 0),
+                                  PyTuple_GET_ITEM(item, 1), other);
+    }
+    Py_DECREF(items);
+    return res;
+}
+
+
+static PyObject *
+SchemaStruct_richcompare(PyObject *self, PyObject *other, int op)
+{
+    int res;
+
+    if ((op != Py_EQ && op != Py_NE)
+            || !(PyDict_Check(other) || SchemaStruct_Check(other)))
+        Py_RETURN_NOTIMPLEMENTED;
+
+    res = SchemaStruct_equal(self, other);
+    if (res < 0)
+        return NULL;
+    if (res == (op == Py_EQ))
+        Py_RETURN_TRUE;
+    Py_RETURN_FALSE;
+}
+
+
+static PyObject *
+SchemaStruct_repr(PyObject *self)
+{
+    int stable;
+
+    return sorted_repr(self, SchemaStruct_keys_list, SchemaStruct_lookup,
+                       &stable);
+}
+
+
+static PyMethodDef SchemaStruct_methods[] = {
+    {"keys", (PyCFunction)SchemaStruct_keys, METH_NOARGS},
+    {"values", (PyCFunction)SchemaStruct_values, METH_NOARGS},
+    {"items", (PyCFunction)SchemaStruct_items, METH_NOARGS},
+    {"get", (PyCFunction)(void(*)(void))SchemaStruct_get, METH_FASTCALL},
+    {"get_attr", (PyCFunction)(void(*)(void))SchemaStruct_get_attr,
+        METH_FASTCALL, Struct_get_attr_doc},
+    {"copy", (PyCFunction)SchemaStruct_copy, METH_NOARGS},
+    {"__copy__", (PyCFunction)SchemaStruct_copy, METH_NOARGS},
+    {NULL, NULL},
+};
+
+
+PyDoc_STRVAR(SchemaStruct_doc,
+"Base of the types made by `Struct.schema(*keys)`. The values of the\n"
+"schema keys are kept in an array in the object, other keys in an\n"
+"overflow dict.\n"
+);
+
+
+static PyType_Slot
+SchemaStructType_slots[] = {
+    {Py_tp_doc, (void *)SchemaStruct_doc},
+    {Py_tp_new, SchemaStruct_new},
+    {Py_tp_traverse, SchemaStruct_traverse},
+    {Py_tp_clear, SchemaStruct_tp_clear},
+    {Py_tp_dealloc, SchemaStruct_dealloc},
+    {Py_tp_repr, SchemaStruct_repr},
+    {Py_tp_str, SchemaStruct_repr},
+    {Py_tp_getattro, SchemaStruct_getattr},
+    {Py_tp_setattro, SchemaStruct_setattr},
+    {Py_tp_richcompare, SchemaStruct_richcompare},
+    {Py_tp_hash, PyObject_HashNotImplemented},
+    {Py_tp_iter, SchemaStruct_iter},
+    {Py_tp_methods, SchemaStruct_methods},
+    {Py_mp_subscript, SchemaStruct_subscript},
+    {Py_mp_ass_subscript, SchemaStruct_ass_subscript},
+    {Py_mp_length, SchemaStruct_length},
+    {Py_sq_contains, SchemaStruct_contains},
+    {0, NULL}
+};
+
+
+static PyType_Spec
+SchemaStructType_spec = {
+    .name = "tri_struct._SchemaStruct",
+    .basicsize = offsetof(SchemaStructObject, values),
+    .itemsize = sizeof(PyObject *),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC
+        | Py_TPFLAGS_HAVE_VERSION_TAG,
+    .slots = SchemaStructType_slots
+};
+
+
+/*
+    module level helpers
+ */
+
+/* Can instances of `type` be created empty and filled in directly,
+   without going through a Python level `__new__` or `__init__`?
+ */
+static int
+is_plain_struct_type(PyTypeObject *type)
+{
+    return PyType_IsSubtype(type, &PyDict_Type)
+        && type->tp_init == PyDict_Type.tp_init
+        && (type->tp_new == PyDict_Type.tp_new
+            || type->tp_new == FrozenStruct_new);
+}
+
+
+static PyObject *
+new_plain_struct(PyTypeObject *type)
+{
+    return type->tp_new(type, empty_tuple, NULL);
+}
+
+
+/* `dict.update` semantics: mappings are merged, anything else is
+   treated as an iterable of key/value pairs.
+ */
+static int
+update_from_arg(PyObject *target, PyObject *arg)
+{
+    PyObject *keys;
+
+    if (PyDict_Check(arg))
+        return PyDict_Merge(target, arg, 1);
+
+    keys = PyObject_GetAttrString(arg, "keys");
+    if (keys != NULL) {
+        Py_DECREF(keys);
+        return PyDict_Merge(target, arg, 1);
+    }
+    if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+        return -1;
+    PyErr_Clear();
+    return PyDict_MergeFromSeq2(target, arg, 1);
+}
+
+
+/* `type(arg, **kwargs)` for the c types that use the dict initializer.
+   The keyword arguments are stored straight from the call instead of
+   being collected in a kwargs dict and merged by `dict.__init__`.
+   Subclasses don't inherit `tp_vectorcall`, so their `__init__` still
+   runs.
+ */
+static PyObject *
+Struct_vectorcall(PyObject *type, PyObject *const *args, size_t nargsf,
+                  PyObject *kwnames)
+{
+    Py_ssize_t i, nargs = PyVectorcall_NARGS(nargsf);
+    Py_ssize_t nkw = kwnames == NULL ? 0 : PyTuple_GET_SIZE(kwnames);
+    PyObject *self;
+
+    if (nargs > 1) {
+        PyErr_Format(PyExc_TypeError,
+                     "%.100s expected at most 1 argument, got %zd",
+                     ((PyTypeObject *)type)->tp_name, nargs);
+        return NULL;
+    }
+    self = new_plain_struct((PyTypeObject *)type);
+    if (self == NULL)
+        return NULL;
+    if (nargs == 1 && update_from_arg(self, args[0]) < 0)
+        goto fail;
+
+    for (i = 0; i < nkw; i++) {
+        if (PyDict_SetItem(self, PyTuple_GET_ITEM(kwnames, i),
+                           args[nargs + i]) < 0)
+            goto fail;
+    }
+    return self;
+
+fail:
+    Py_DECREF(self);
+    return NULL;
+}
+
+
+PyDoc_STRVAR(merged_doc,
+"merged(*dicts, **kwargs) -> new Struct\n"
+"\n"
+"Merge dictionaries. Later keys overwrite. The result has the type of\n"
+"the first argument.\n"
+);
+
+
+static PyObject *
+merged(PyObject *module, PyObject *args, PyObject *kwargs)
+{
+    Py_ssize_t i, n;
+    PyTypeObject *type;
+    PyObject *result, *target;
+
+    n = PyTuple_GET_SIZE(args);
+    if (n == 0) {
+        PyObject *tri_struct, *struct_type;
+
+        tri_struct = PyImport_ImportModule("tri_struct");
+        if (tri_struct == NULL)
+            return NULL;
+        struct_type = PyObject_GetAttrString(tri_struct, "Struct");
+        Py_DECREF(tri_struct);
+        if (struct_type == NULL)
+            return NULL;
+        result = PyObject_CallObject(struct_type, NULL);
+        Py_DECREF(struct_type);
+        return result;
+    }
+
+    type = Py_TYPE(PyTuple_GET_ITEM(args, 0));
+    if (is_plain_struct_type(type)) {
+        /* merge straight into the result */
+        result = new_plain_struct(type);
+        target = result;
+    }
+    else {
+        /* fall back to `type(**merged_dict)` for custom constructors */
+        result = NULL;
+        target = PyDict_New();
+    }
+    if (target == NULL)
+        return NULL;
+
+    for (i = 0; i < n; i++) {
+        if (update_from_arg(target, PyTuple_GET_ITEM(args, i)) < 0)
+            goto fail;
+    }
+    if (kwargs != NULL && PyDict_Merge(target, kwargs, 1) < 0)
+        goto fail;
+
+    if (result == NULL) {
+        result = PyObject_Call((PyObject *)type, empty_tuple, target);
+        Py_DECREF(target);
+    }
+    return result;
+
+fail:
+    Py_DECREF(target);
+    return NULL;
+}
+
+
+/* A new instance of the same type as `src`, with the same contents */
+static PyObject *
+shallow_copy(PyObject *src)
+{
+    PyTypeObject *type = Py_TYPE(src);
+    PyObject *result, *kwargs;
+
+    if (is_plain_struct_type(type)) {
+        result = new_plain_struct(type);
+        if (result != NULL && PyDict_Merge(result, src, 1) < 0)
+            Py_CLEAR(result);
+        return result;
+    }
+
+    kwargs = PyDict_New();
+    if (kwargs == NULL)
+        return NULL;
+    if (PyDict_Merge(kwargs, src, 1) < 0) {
+        Py_DECREF(kwargs);
+        return NULL;
+    }
+    result = PyObject_Call((PyObject *)type, empty_tuple, kwargs);
+    Py_DECREF(kwargs);
+    return result;
+}
+
+
+/* Is `obj` one of the nodes created by the current deep merge? Those can
+   be updated in place, everything else is shared with the inputs.
+ */
+static int
+is_owned(PyObject *owned, PyObject *obj)
+{
+    PyObject *id;
+    int res;
+
+    id = PyLong_FromVoidPtr(obj);
+    if (id == NULL)
+        return -1;
+    res = PySet_Contains(owned, id);
+    Py_DECREF(id);
+    return res;
+}
+
+
+static int
+add_owned(PyObject *owned, PyObject *obj)
+{
+    PyObject *id;
+    int res;
+
+    id = PyLong_FromVoidPtr(obj);
+    if (id == NULL)
+        return -1;
+    res = PySet_Add(owned, id);
+    Py_DECREF(id);
+    return res;
+}
+
+
+static int deep_merge_into(PyObject *, PyObject *, PyObject *);
+
+
+static int
+deep_merge_item(PyObject *target, PyObject *key, PyObject *value,
+                PyObject *owned)
+{
+    PyObject *existing, *copy;
+    int res;
+
+    if (PyDict_GetItemRef(target, key, &existing) < 0)
+        return -1;
+
+    if (existing == NULL || !PyDict_Check(existing) || !PyDict_Check(value)) {
+        Py_XDECREF(existing);
+        return PyDict_SetItem(target, key, value);
+    }
+
+    res = is_owned(owned, existing);
+    if (res <= 0) {
+        /* copy on write: `existing` belongs to one of the inputs */
+        copy = res < 0 ? NULL : shallow_copy(existing);
+        Py_DECREF(existing);
+        if (copy == NULL)
+            return -1;
+        if (add_owned(owned, copy) < 0 || PyDict_SetItem(target, key, copy) < 0) {
+            Py_DECREF(copy);
+            return -1;
+        }
+        existing = copy;
+    }
+
+    if (Py_EnterRecursiveCall(" in deep_merged")) {
+        Py_DECREF(existing);
+        return -1;
+    }
+    res = deep_merge_into(existing, value, owned);
+    Py_LeaveRecursiveCall();
+    Py_DECREF(existing);
+    return res;
+}
+
+
+static int
+deep_merge_into(PyObject *target, PyObject *source, PyObject *owned)
+{
+    Py_ssize_t pos = 0, i;
+    PyObject *key, *value, *items;
+    int res;
+
+    if (PyDict_Check(source)) {
+        while (dict_next_ref(source, &pos, &key, &value)) {
+            res = deep_merge_item(target, key, value, owned);
+            Py_DECREF(key);
+            Py_DECREF(value);
+            if (res < 0)
+                return -1;
+        }
+        return 0;
+    }
+
+    items = PyMapping_Items(source);
+    if (items == NULL)
+        return -1;
+    for (i = 0; i < PyList_GET_SIZE(items); i++) {
+        PyObject *item = PyList_GET_ITEM(items, i);
+
+        if (!PyTuple_Check(item) || PyTuple_GET_SIZE(item) != 2) {
+            PyErr_SetString(PyExc_TypeError,
+                            "items() must return (key, value) pairs");
+            Py_DECREF(items);
+            return -1;
+        }
+        if (deep_merge_item(target, PyTuple_GET_ITEM(item, 0),
+                            PyTuple_GET_ITEM(item, 1), owned) < 0) {
+            Py_DECREF(items);
+            return -1;
+        }
+    }
+    Py_DECREF(items);
+    return 0;
+}
+
+
+PyDoc_STRVAR(deep_merged_doc,
+"deep_merged(*dicts, **kwargs) -> new Struct\n"
+"\n"
+"Merge dictionaries recursively. Later keys overwrite, unless both values\n"
+"are dicts, which are merged in turn. Subtrees that are only found in one\n"
+"of the arguments are shared with the result instead of copied.\n"
+);
+
+
+static PyObject *
+deep_merged(PyObject *module, PyObject *args, PyObject *kwargs)
+{
+    Py_ssize_t i, n;
+    PyObject *result, *owned;
+
+    n = PyTuple_GET_SIZE(args);
+    if (n == 0)
+        return merged(module, args, kwargs);
+
+    if (!PyDict_Check(PyTuple_GET_ITEM(args, 0)))
+        return merged(module, args, kwargs);
+
+    result = shallow_copy(PyTuple_GET_ITEM(args, 0));
+    if (result == NULL)
+        return NULL;
+
+    owned = PySet_New(NULL);
+    if (owned == NULL || add_owned(owned, result) < 0)
+        goto fail;
+
+    for (i = 1; i < n; i++) {
+        if (deep_merge_into(result, PyTuple_GET_ITEM(args, i), owned) < 0)
+            goto fail;
+    }
+    if (kwargs != NULL && deep_merge_into(result, kwargs, owned) < 0)
+        goto fail;
+
+    Py_DECREF(owned);
+    return result;
+
+fail:
+    Py_XDECREF(owned);
+    Py_DECREF(result);
+    return NULL;
+}
+
+
+/*
+    bulk conversion of nested dicts and lists, without recursion
+ */
+
+static PyObject *
+new_empty_struct(PyTypeObject *type)
+{
+    PyObject *result;
+
+    if (is_plain_struct_type(type))
+        return new_plain_struct(type);
+    if (type == DefaultStructType) {
+        result = DefaultStruct_new(type, empty_tuple, NULL);
+        if (result != NULL) {
+            Py_INCREF(type);
+            ((DefaultStructObject *)result)->default_factory = (PyObject *)type;
+        }
+        return result;
+    }
+    return PyObject_CallObject((PyObject *)type, NULL);
+}
+
+
+typedef struct {
+    PyTypeObject *struct_type;
+    PyTypeObject *sequence_type;    /* &PyList_Type or &PyTuple_Type */
+    PyObject *memo;                 /* dict or NULL */
+} Converter;
+
+
+/* A node that has been created, but whose children are still being
+   converted. It is attached to its parent when done.
+ */
+typedef struct {
+    PyObject *src;
+    PyObject *dst;
+    Py_ssize_t pos;
+    PyObject *parent_key;           /* where to attach a dict child */
+    Py_ssize_t parent_index;        /* where to attach a sequence child */
+} ConvertFrame;
+
+
+typedef struct {
+    ConvertFrame *frames;
+    Py_ssize_t size;
+    Py_ssize_t allocated;
+} ConvertStack;
+
+
+static int
+convert_stack_push(ConvertStack *stack, PyObject *src, PyObject *dst)
+{
+    ConvertFrame *frame;
+
+    if (stack->size == stack->allocated) {
+        Py_ssize_t allocated = stack->allocated ? stack->allocated * 2 : 16;
+        ConvertFrame *frames;
+
+        frames = PyMem_Realloc(stack->frames, allocated * sizeof(ConvertFrame));
+        if (frames == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        stack->frames = frames;
+        stack->allocated = allocated;
+    }
+    frame = &stack->frames[stack->size++];
+    Py_INCREF(src);
+    frame->src = src;
+    frame->dst = dst;   /* steals */
+    frame->pos = 0;
+    frame->parent_key = NULL;
+    frame->parent_index = -1;
+    return 0;
+}
+
+
+static void
+convert_frame_clear(ConvertFrame *frame)
+{
+    Py_CLEAR(frame->src);
+    Py_CLEAR(frame->dst);
+    Py_CLEAR(frame->parent_key);
+}
+
+
+static int
+memo_get(PyObject *memo, PyObject *src, PyObject **result)
+{
+    PyObject *id;
+    int res;
+
+    *result = NULL;
+    if (memo == NULL)
+        return 0;
+    id = PyLong_FromVoidPtr(src);
+    if (id == NULL)
+        return -1;
+    res = PyDict_GetItemRef(memo, id, result);
+    Py_DECREF(id);
+    return res;
+}
+
+
+static int
+memo_set(PyObject *memo, PyObject *src, PyObject *dst)
+{
+    PyObject *id;
+    int res;
+
+    if (memo == NULL)
+        return 0;
+    id = PyLong_FromVoidPtr(src);
+    if (id == NULL)
+        return -1;
+    res = PyDict_SetItem(memo, id, dst);
+    Py_DECREF(id);
+    return res;
+}
+
+
+/* Convert a single value. Leaves and already converted nodes are
+   returned in `*result`; containers get an empty `dst` pushed on the
+   stack, to be filled in by `convert`, and `*result` is left NULL.
+ */
+static int
+convert_visit(Converter *conv, ConvertStack *stack, PyObject *src,
+              PyObject **result)
+{
+    PyObject *dst;
+    int res;
+
+    *result = NULL;
+    if (PyObject_TypeCheck(src, conv->struct_type)
+            || !(PyDict_Check(src) || PyList_Check(src))) {
+        Py_INCREF(src);
+        *result = src;
+        return 0;
+    }
+
+    res = memo_get(conv->memo, src, result);
+    if (res != 0)
+        return res < 0 ? -1 : 0;
+
+    if (PyDict_Check(src)) {
+        dst = new_empty_struct(conv->struct_type);
+    }
+    else {
+        Py_ssize_t i, n = PyList_GET_SIZE(src);
+
+        dst = conv->sequence_type == &PyTuple_Type ? PyTuple_New(n) : PyList_New(n);
+        if (dst != NULL) {
+            for (i = 0; i < n; i++) {
+                Py_INCREF(Py_None);
+                if (PyTuple_Check(dst))
+                    PyTuple_SET_ITEM(dst, i, Py_None);
+                else
+                    PyList_SET_ITEM(dst, i, Py_None);
+            }
+        }
+    }
+    if (dst == NULL)
+        return -1;
+    if (memo_set(conv->memo, src, dst) < 0) {
+        Py_DECREF(dst);
+        return -1;
+    }
+    return convert_stack_push(stack, src, dst);
+}
+
+
+static int
+convert_attach(ConvertFrame *parent, PyObject *key, Py_ssize_t index,
+               PyObject *value)
+{
+    /* steals `value` */
+    int res = 0;
+
+    if (key != NULL) {
+        res = PyDict_SetItem(parent->dst, key, value);
+        Py_DECREF(value);
+    }
+    else if (PyTuple_Check(parent->dst)) {
+        PyObject *old = PyTuple_GET_ITEM(parent->dst, index);
+        PyTuple_SET_ITEM(parent->dst, index, value);
+        Py_DECREF(old);
+    }
+    else {
+        PyObject *old = PyList_GET_ITEM(parent->dst, index);
+        PyList_SET_ITEM(parent->dst, index, value);
+        Py_DECREF(old);
+    }
+    return res;
+}
+
+
+static PyObject *
+convert(Converter *conv, PyObject *obj)
+{
+    ConvertStack stack = {NULL, 0, 0};
+    PyObject *result = NULL, *value;
+
+    if (convert_visit(conv, &stack, obj, &result) < 0)
+        goto fail;
+    if (result != NULL)
+        return result;
+
+    while (stack.size > 0) {
+        ConvertFrame *frame = &stack.frames[stack.size - 1];
+        PyObject *key = NULL, *child;
+        Py_ssize_t index = -1;
+
+        if (PyDict_Check(frame->src)) {
+            if (!dict_next_ref(frame->src, &frame->pos, &key, &child))
+                goto done;
+        }
+        else {
+            if (frame->pos >= Py_SIZE(frame->dst))
+                goto done;
+            index = frame->pos++;
+            child = PyList_GetItemRef(frame->src, index);
+            if (child == NULL) {
+                /* the list got shorter */
+                PyErr_Clear();
+                goto done;
+            }
+        }
+
+        if (convert_visit(conv, &stack, child, &value) < 0) {
+            Py_XDECREF(key);
+            Py_DECREF(child);
+            goto fail;
+        }
+        Py_DECREF(child);
+        if (value == NULL) {
+            /* a new container: attach it when its children are done */
+            frame = &stack.frames[stack.size - 1];
+            frame->parent_key = key;
+            frame->parent_index = index;
+            continue;
+        }
+        frame = &stack.frames[stack.size - 1];
+        if (convert_attach(frame, key, index, value) < 0) {
+            Py_XDECREF(key);
+            goto fail;
+        }
+        Py_XDECREF(key);
+        continue;
+
+    done:
+        /* pop the finished node and attach it to its parent */
+        stack.size--;
+        value = frame->dst;
+        frame->dst = NULL;
+        if (stack.size == 0) {
+            result = value;
+        }
+        else if (convert_attach(&stack.frames[stack.size - 1],
+                                frame->parent_key, frame->parent_index,
+                                value) < 0) {
+            convert_frame_clear(frame);
+            goto fail;
+        }
+        convert_frame_clear(frame);
+    }
+
+    PyMem_Free(stack.frames);
+    return result;
+
+fail:
+    while (stack.size > 0)
+        convert_frame_clear(&stack.frames[--stack.size]);
+    PyMem_Free(stack.frames);
+    return NULL;
+}
+
+
+PyDoc_STRVAR(convert_doc,
+"convert(obj, struct_type, sequence_type, memo=None)\n"
+"\n"
+"Convert nested dicts to `struct_type` and lists to `sequence_type`\n"
+"(list or tuple). Instances of `struct_type` are kept as they are. Pass\n"
+"a dict as `memo` to convert shared and cyclic containers only once.\n"
+);
+
+
+static PyObject *
+convert_function(PyObject *module, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"obj", "struct_type", "sequence_type", "memo", NULL};
+    PyObject *obj, *struct_type, *sequence_type, *memo = Py_None;
+    Converter conv;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OOO|O:convert", kwlist,
+                                     &obj, &struct_type, &sequence_type, &memo))
+        return NULL;
+
+    if (!PyType_Check(struct_type)
+            || !PyType_IsSubtype((PyTypeObject *)struct_type, &PyDict_Type)) {
+        PyErr_SetString(PyExc_TypeError, "struct_type must be a dict subclass");
+        return NULL;
+    }
+    if (sequence_type != (PyObject *)&PyList_Type
+            && sequence_type != (PyObject *)&PyTuple_Type) {
+        PyErr_SetString(PyExc_TypeError, "sequence_type must be list or tuple");
+        return NULL;
+    }
+    if (memo != Py_None && !PyDict_Check(memo)) {
+        PyErr_SetString(PyExc_TypeError, "memo must be a dict or None");
+        return NULL;
+    }
+
+    conv.struct_type = (PyTypeObject *)struct_type;
+    conv.sequence_type = (PyTypeObject *)sequence_type;
+    conv.memo = memo == Py_None ? NULL : memo;
+    return convert(&conv, obj);
+}
+
+
+/*
+    freeze and thaw: like convert, but sequences, sets and the target
+    frozen struct type are handled too, and freezing keeps the parts of the
+    input that are already frozen
+ */
+
+typedef struct {
+    PyTypeObject *struct_type;
+    int freezing;
+    PyObject *memo;         /* id -> result; None while freezing it */
+} Freezer;
+
+
+/* whether `obj`, an instance of the frozen target type, has its hash
+   cached, which means all of its values are hashable already
+ */
+static int
+has_cached_hash(PyObject *obj)
+{
+    PyObject *hash;
+
+    if (PyObject_TypeCheck(obj, FrozenStructType))
+        return FT_ATOMIC_LOAD_SSIZE_RELAXED(((FrozenStructObject *)obj)->hash) != -1;
+    /* the `_hash` slot of the python FrozenStruct, without going through
+       `__getattr__`
+     */
+    hash = PyObject_GenericGetAttr(obj, str__hash);
+    if (hash == NULL) {
+        if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+            return -1;
+        PyErr_Clear();
+        return 0;
+    }
+    Py_DECREF(hash);
+    return 1;
+}
+
+
+static PyObject *
+new_none_filled(PyTypeObject *type, Py_ssize_t n)
+{
+    PyObject *result = type == &PyTuple_Type ? PyTuple_New(n) : PyList_New(n);
+    Py_ssize_t i;
+
+    if (result == NULL)
+        return NULL;
+    for (i = 0; i < n; i++) {
+        Py_INCREF(Py_None);
+        if (type == &PyTuple_Type)
+            PyTuple_SET_ITEM(result, i, Py_None);
+        else
+            PyList_SET_ITEM(result, i, Py_None);
+    }
+    return result;
+}
+
+
+/* Visit a single value, like convert_visit. A container whose `dst` is
+   pushed as NULL is reused if none of its children change.
+ */
+static int
+freeze_visit(Freezer *fz, ConvertStack *stack, PyObject *src,
+             PyObject **result)
+{
+    PyObject *dst = NULL;
+    int res;
+
+    *result = NULL;
+    if (PyAnySet_Check(src)) {
+        if (!fz->freezing)
+            *result = PySet_New(src);
+        else if (PyFrozenSet_Check(src)) {
+            Py_INCREF(src);
+            *result = src;
+        }
+        else
+            *result = PyFrozenSet_New(src);
+        return *result == NULL ? -1 : 0;
+    }
+    if (!(PyDict_Check(src) || PyList_Check(src) || PyTuple_CheckExact(src))) {
+        Py_INCREF(src);
+        *result = src;
+        return 0;
+    }
+    if (fz->freezing && PyObject_TypeCheck(src, fz->struct_type)) {
+        res = has_cached_hash(src);
+        if (res != 0) {
+            if (res > 0) {
+                Py_INCREF(src);
+                *result = src;
+            }
+            return res < 0 ? -1 : 0;
+        }
+    }
+
+    res = memo_get(fz->memo, src, result);
+    if (res < 0)
+        return -1;
+    if (res > 0) {
+        if (*result != Py_None)
+            return 0;
+        Py_CLEAR(*result);
+        PyErr_SetString(PyExc_ValueError, "cannot freeze a cyclic structure");
+        return -1;
+    }
+
+    if (PyDict_Check(src)) {
+        if (!(fz->freezing && PyObject_TypeCheck(src, fz->struct_type))) {
+            dst = new_empty_struct(fz->struct_type);
+            if (dst == NULL)
+                return -1;
+        }
+    }
+    else if (!fz->freezing) {
+        dst = new_none_filled(&PyList_Type, Py_SIZE(src));
+        if (dst == NULL)
+            return -1;
+    }
+    else if (PyList_Check(src)) {
+        dst = new_none_filled(&PyTuple_Type, PyList_GET_SIZE(src));
+        if (dst == NULL)
+            return -1;
+    }
+
+    /* a thawed container can be put in place right away, which also
+       takes care of cycles
+     */
+    if (memo_set(fz->memo, src, fz->freezing ? Py_None : dst) < 0) {
+        Py_XDECREF(dst);
+        return -1;
+    }
+    return convert_stack_push(stack, src, dst);
+}
+
+
+/* Put `value` in place of `child`, the item at `key` or `index` of the
+   source of `frame`. Steals `value`.
+ */
+static int
+freeze_attach(Freezer *fz, ConvertFrame *frame, PyObject *key,
+              Py_ssize_t index, PyObject *child, PyObject *value)
+{
+    if (frame->dst == NULL) {
+        if (value == child) {
+            Py_DECREF(value);
+            return 0;
+        }
+        /* the first changed child: copy the source after all */
+        if (key != NULL) {
+            frame->dst = new_empty_struct(fz->struct_type);
+            if (frame->dst != NULL && PyDict_Merge(frame->dst, frame->src, 1) < 0)
+                Py_CLEAR(frame->dst);
+        }
+        else {
+            Py_ssize_t i, n = PyTuple_GET_SIZE(frame->src);
+
+            frame->dst = PyTuple_New(n);
+            if (frame->dst != NULL) {
+                for (i = 0; i < n; i++) {
+                    PyObject *item = PyTuple_GET_ITEM(frame->src, i);
+                    Py_INCREF(item);
+                    PyTuple_SET_ITEM(frame->dst, i, item);
+                }
+            }
+        }
+        if (frame->dst == NULL) {
+            Py_DECREF(value);
+            return -1;
+        }
+    }
+    return convert_attach(frame, key, index, value);
+}
+
+
+static PyObject *
+freeze(Freezer *fz, PyObject *obj)
+{
+    ConvertStack stack = {NULL, 0, 0};
+    PyObject *result = NULL, *value;
+
+    if (freeze_visit(fz, &stack, obj, &result) < 0)
+        goto fail;
+    if (result != NULL)
+        return result;
+
+    while (stack.size > 0) {
+        ConvertFrame *frame = &stack.frames[stack.size - 1];
+        PyObject *key = NULL, *child;
+        Py_ssize_t index = -1;
+        int res;
+
+        if (PyDict_Check(frame->src)) {
+            if (!dict_next_ref(frame->src, &frame->pos, &key, &child))
+                goto done;
+        }
+        else if (PyTuple_Check(frame->src)) {
+            if (frame->pos >= PyTuple_GET_SIZE(frame->src)
+                    || (frame->dst != NULL && frame->pos >= Py_SIZE(frame->dst)))
+                goto done;
+            index = frame->pos++;
+            child = PyTuple_GET_ITEM(frame->src, index);
+            Py_INCREF(child);
+        }
+        else {
+            if (frame->pos >= Py_SIZE(frame->dst))
+                goto done;
+            index = frame->pos++;
+            child = PyList_GetItemRef(frame->src, index);
+            if (child == NULL) {
+                /* the list got shorter */
+                PyErr_Clear();
+                goto done;
+            }
+        }
+
+        if (freeze_visit(fz, &stack, child, &value) < 0) {
+            Py_XDECREF(key);
+            Py_DECREF(child);
+            goto fail;
+        }
+        if (value == NULL) {
+            /* a new container: attach it when its children are done */
+            Py_DECREF(child);
+            frame = &stack.frames[stack.size - 1];
+            frame->parent_key = key;
+            frame->parent_index = index;
+            continue;
+        }
+        frame = &stack.frames[stack.size - 1];
+        res = freeze_attach(fz, frame, key, index, child, value);
+        Py_XDECREF(key);
+        Py_DECREF(child);
+        if (res < 0)
+            goto fail;
+        continue;
+
+    done:
+        /* pop the finished node and attach it to its parent */
+        stack.size--;
+        if (frame->dst != NULL) {
+            value = frame->dst;
+            frame->dst = NULL;
+        }
+        else {
+            Py_INCREF(frame->src);
+            value = frame->src;
+        }
+        if (fz->freezing) {
+            /* hash bottom up, so that hashing the result is cheap */
+            if ((PyDict_Check(value) && PyObject_Hash(value) == -1)
+                    || memo_set(fz->memo, frame->src, value) < 0) {
+                Py_DECREF(value);
+                convert_frame_clear(frame);
+                goto fail;
+            }
+        }
+        if (stack.size == 0) {
+            result = value;
+        }
+        else if (freeze_attach(fz, &stack.frames[stack.size - 1],
+                               frame->parent_key, frame->parent_index,
+                               frame->src, value) < 0) {
+            convert_frame_clear(frame);
+            goto fail;
+        }
+        convert_frame_clear(frame);
+    }
+
+    PyMem_Free(stack.frames);
+    return result;
+
+fail:
+    while (stack.size > 0)
+        convert_frame_clear(&stack.frames[--stack.size]);
+    PyMem_Free(stack.frames);
+    return NULL;
+}
+
+
+static PyObject *
+freeze_or_thaw(PyObject *args, const char *format, int freezing)
+{
+    PyObject *obj, *struct_type, *result;
+    Freezer fz;
+
+    if (!PyArg_ParseTuple(args, format, &obj, &struct_type))
+        return NULL;
+    if (!PyType_Check(struct_type)
+            || !PyType_IsSubtype((PyTypeObject *)struct_type, &PyDict_Type)) {
+        PyErr_SetString(PyExc_TypeError, "struct_type must be a dict subclass");
+        return NULL;
+    }
+
+    fz.struct_type = (PyTypeObject *)struct_type;
+    fz.freezing = freezing;
+    fz.memo = PyDict_New();
+    if (fz.memo == NULL)
+        return NULL;
+    result = freeze(&fz, obj);
+    Py_DECREF(fz.memo);
+    return result;
+}
+
+
+PyDoc_STRVAR(freeze_doc,
+"freeze(obj, struct_type)\n"
+"\n"
+"Convert nested dicts to `struct_type`, a frozen struct type, lists to\n"
+"tuples and sets to frozensets. Frozen structs, tuples and frozensets that\n"
+"need no change are kept as they are, and every frozen struct in the\n"
+"result has its hash computed.\n"
+);
+
+
+static PyObject *
+freeze_function(PyObject *module, PyObject *args)
+{
+    return freeze_or_thaw(args, "OO:freeze", 1);
+}
+
+
+PyDoc_STRVAR(thaw_doc,
+"thaw(obj, struct_type)\n"
+"\n"
+"Copy nested dicts to `struct_type`, lists and tuples to lists and sets\n"
+"and frozensets to sets.\n"
+);
+
+
+static PyObject *
+thaw_function(PyObject *module, PyObject *args)
+{
+    return freeze_or_thaw(args, "OO:thaw", 0);
+}
+
+
+/*
+    diff: the key paths where two trees of dicts differ, without recursion.
+    Pairs of identical subtrees are skipped, and frozen subtrees with
+    different cached hashes are known to differ without comparing them
+ */
+
+typedef struct {
+    PyObject *a;
+    PyObject *b;
+    PyObject *key;          /* of this pair in the parent pair */
+    Py_ssize_t pos;
+    Py_ssize_t found;       /* keys of `a` that are in `b` too */
+    int adding;             /* done with `a`, looking for keys only in `b` */
+} DiffFrame;
+
+
+typedef struct {
+    DiffFrame *frames;
+    Py_ssize_t size;
+    Py_ssize_t allocated;
+    PyObject *added;
+    PyObject *removed;
+    PyObject *changed;
+} Differ;
+
+
+static int
+diff_push(Differ *df, PyObject *a, PyObject *b, PyObject *key)
+{
+    DiffFrame *frame;
+    Py_ssize_t i;
+
+    /* a pair that is being compared already, in cyclic data */
+    for (i = 0; i < df->size; i++) {
+        if (df->frames[i].a == a && df->frames[i].b == b)
+            return 0;
+    }
+    if (df->size == df->allocated) {
+        Py_ssize_t allocated = df->allocated ? df->allocated * 2 : 16;
+        DiffFrame *frames;
+
+        frames = PyMem_Realloc(df->frames, allocated * sizeof(DiffFrame));
+        if (frames == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        df->frames = frames;
+        df->allocated = allocated;
+    }
+    frame = &df->frames[df->size++];
+    Py_INCREF(a);
+    frame->a = a;
+    Py_INCREF(b);
+    frame->b = b;
+    Py_XINCREF(key);
+    frame->key = key;
+    frame->pos = 0;
+    frame->found = 0;
+    frame->adding = 0;
+    return 0;
+}
+
+
+static void
+diff_pop(Differ *df)
+{
+    DiffFrame *frame = &df->frames[--df->size];
+
+    Py_DECREF(frame->a);
+    Py_DECREF(frame->b);
+    Py_XDECREF(frame->key);
+}
+
+
+/* Append the path of `key` in the top pair to `paths` */
+static int
+diff_record(Differ *df, PyObject *paths, PyObject *key)
+{
+    PyObject *path = PyTuple_New(df->size);
+    Py_ssize_t i;
+    int res;
+
+    if (path == NULL)
+        return -1;
+    /* the first frame is the pair of roots, without a key */
+    for (i = 1; i < df->size; i++) {
+        Py_INCREF(df->frames[i].key);
+        PyTuple_SET_ITEM(path, i - 1, df->frames[i].key);
+    }
+    Py_INCREF(key);
+    PyTuple_SET_ITEM(path, df->size - 1, key);
+    res = PyList_Append(paths, path);
+    Py_DECREF(path);
+    return res;
+}
+
+
+/* The cached hash of a frozen struct in `*hash`. Returns 1 if there is
+   one, 0 if not and -1 on error.
+ */
+static int
+get_cached_hash(PyObject *obj, Py_hash_t *hash)
+{
+    PyObject *value;
+
+    if (PyObject_TypeCheck(obj, FrozenStructType)) {
+        *hash = FT_ATOMIC_LOAD_SSIZE_RELAXED(((FrozenStructObject *)obj)->hash);
+        return *hash != -1;
+    }
+    if (Py_TYPE(obj)->tp_hash == PyObject_HashNotImplemented)
+        return 0;
+    /* the `_hash` slot of the python FrozenStruct */
+    value = PyObject_GenericGetAttr(obj, str__hash);
+    if (value == NULL) {
+        if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+            return -1;
+        PyErr_Clear();
+        return 0;
+    }
+    *hash = PyLong_Check(value) ? PyLong_AsSsize_t(value) : -1;
+    Py_DECREF(value);
+    if (*hash == -1 && PyErr_Occurred())
+        return -1;
+    return *hash != -1;
+}
+
+
+/* Compare two values at the same key. Returns 0 if they are equal, 1 if
+   they differ, 2 if they are dicts to look into and -1 on error.
+ */
+static int
+diff_values(PyObject *a, PyObject *b)
+{
+    Py_hash_t a_hash, b_hash;
+    int res;
+
+    if (a == b)
+        return 0;
+    if (!(PyDict_Check(a) && PyDict_Check(b))) {
+        res = PyObject_RichCompareBool(a, b, Py_EQ);
+        return res < 0 ? -1 : !res;
+    }
+    res = get_cached_hash(a, &a_hash);
+    if (res > 0)
+        res = get_cached_hash(b, &b_hash);
+    if (res <= 0)
+        return res < 0 ? -1 : 2;
+    if (a_hash != b_hash)
+        return 2;
+    /* most likely equal, which the c comparison confirms faster */
+    res = PyObject_RichCompareBool(a, b, Py_EQ);
+    return res < 0 ? -1 : (res ? 0 : 2);
+}
+
+
+static int
+diff_step(Differ *df)
+{
+    DiffFrame *frame = &df->frames[df->size - 1];
+    PyObject *key, *a_value, *b_value;
+    int res;
+
+    if (frame->adding) {
+        if (!dict_next_ref(frame->b, &frame->pos, &key, &b_value)) {
+            diff_pop(df);
+            return 0;
+        }
+        res = PyDict_Contains(frame->a, key);
+        if (res == 0)
+            res = diff_record(df, df->added, key);
+        Py_DECREF(key);
+        Py_DECREF(b_value);
+        return res;
+    }
+
+    if (!dict_next_ref(frame->a, &frame->pos, &key, &a_value)) {
+        /* if all keys of `b` were found, none was added */
+        if (frame->found == PyDict_GET_SIZE(frame->b))
+            diff_pop(df);
+        else {
+            frame->adding = 1;
+            frame->pos = 0;
+        }
+        return 0;
+    }
+    res = PyDict_GetItemRef(frame->b, key, &b_value);
+    if (res == 0)
+        res = diff_record(df, df->removed, key);
+    else if (res > 0) {
+        frame->found++;
+        res = diff_values(a_value, b_value);
+        if (res == 1)
+            res = diff_record(df, df->changed, key);
+        else if (res == 2)
+            res = diff_push(df, a_value, b_value, key);
+        Py_DECREF(b_value);
+    }
+    Py_DECREF(key);
+    Py_DECREF(a_value);
+    return res;
+}
+
+
+PyDoc_STRVAR(diff_doc,
+"diff(a, b) -> (added, removed, changed)\n"
+"\n"
+"The paths, as tuples of keys, of the keys only in `b`, only in `a`, and\n"
+"with different values in nested dicts `a` and `b`.\n"
+);
+
+
+static PyObject *
+diff_function(PyObject *module, PyObject *args)
+{
+    PyObject *a, *b, *result = NULL;
+    Differ df = {NULL, 0, 0, NULL, NULL, NULL};
+
+    if (!PyArg_ParseTuple(args, "O!O!:diff", &PyDict_Type, &a,
+                          &PyDict_Type, &b))
+        return NULL;
+    df.added = PyList_New(0);
+    df.removed = PyList_New(0);
+    df.changed = PyList_New(0);
+    if (df.added == NULL || df.removed == NULL || df.changed == NULL)
+        goto done;
+    if (a != b && diff_push(&df, a, b, NULL) < 0)
+        goto done;
+    while (df.size > 0) {
+        if (diff_step(&df) < 0)
+            goto done;
+    }
+    result = PyTuple_Pack(3, df.added, df.removed, df.changed);
+
+done:
+    while (df.size > 0)
+        diff_pop(&df);
+    PyMem_Free(df.frames);
+    Py_XDECREF(df.added);
+    Py_XDECREF(df.removed);
+    Py_XDECREF(df.changed);
+    return result;
+}
+
+
+/*
+    deepcopy: copy.deepcopy for trees of structs, dicts and lists, without
+    recursion and without going through `__reduce_ex__` for every node
+ */
+
+static PyObject *str___deepcopy__ = NULL;
+static PyObject *str___setstate__ = NULL;
+/* the `__deepcopy__` descriptors of Struct and FrozenStruct */
+static PyObject *Struct_deepcopy_descr = NULL;
+static PyObject *FrozenStruct_deepcopy_descr = NULL;
+
+
+typedef struct {
+    PyObject *memo;
+    PyObject *deepcopy;     /* copy.deepcopy, imported when first needed */
+} Copier;
+
+
+/* objects that copy.deepcopy returns as they are */
+static int
+is_atomic(PyObject *obj)
+{
+    return obj == Py_None || obj == Py_Ellipsis || obj == Py_NotImplemented
+        || PyUnicode_CheckExact(obj) || PyLong_CheckExact(obj)
+        || PyBool_Check(obj) || PyFloat_CheckExact(obj)
+        || PyBytes_CheckExact(obj) || PyComplex_CheckExact(obj)
+        || PyType_Check(obj) || PyFunction_Check(obj);
+}
+
+
+/* Can instances of `type` be copied by filling in an empty instance? Only
+   if nothing but our own `__deepcopy__` is involved and there is no state
+   outside the dict.
+ */
+static int
+is_copyable_struct_type(PyTypeObject *type, PyObject *descr)
+{
+    if (descr != Struct_deepcopy_descr || type->tp_dictoffset != 0)
+        return 0;
+    if (PyType_IsSubtype(type, DefaultStructType))
+        return type->tp_basicsize == DefaultStructType->tp_basicsize
+            && type->tp_init == DefaultStructType->tp_init
+            && type->tp_new == DefaultStructType->tp_new;
+    return is_plain_struct_type(type)
+        && type->tp_basicsize == PyDict_Type.tp_basicsize;
+}
+
+
+static PyObject *
+new_struct_like(PyObject *src)
+{
+    PyTypeObject *type = Py_TYPE(src);
+    PyObject *result;
+
+    if (!PyType_IsSubtype(type, DefaultStructType))
+        return new_plain_struct(type);
+    result = DefaultStruct_new(type, empty_tuple, NULL);
+    if (result != NULL)
+        ((DefaultStructObject *)result)->default_factory = get_default_factory(src);
+    return result;
+}
+
+
+static PyObject *
+copier_fallback(Copier *copier, PyObject *obj)
+{
+    if (copier->deepcopy == NULL) {
+        PyObject *module = PyImport_ImportModule("copy");
+
+        if (module == NULL)
+            return NULL;
+        copier->deepcopy = PyObject_GetAttrString(module, "deepcopy");
+        Py_DECREF(module);
+        if (copier->deepcopy == NULL)
+            return NULL;
+    }
+    return PyObject_CallFunctionObjArgs(copier->deepcopy, obj, copier->memo, NULL);
+}
+
+
+/* Copy a single value, like convert_visit: leaves, frozen structs and
+   nodes in the memo are returned in `*result`, dicts, lists and structs
+   get an empty copy pushed on the stack. Everything else is left to
+   copy.deepcopy.
+ */
+static int
+deepcopy_visit(Copier *copier, ConvertStack *stack, PyObject *src,
+               PyObject **result)
+{
+    PyTypeObject *type = Py_TYPE(src);
+    PyObject *dst, *descr;
+    int res;
+
+    *result = NULL;
+    if (is_atomic(src)) {
+        Py_INCREF(src);
+        *result = src;
+        return 0;
+    }
+
+    res = memo_get(copier->memo, src, result);
+    if (res != 0)
+        return res < 0 ? -1 : 0;
+
+    if (PyDict_CheckExact(src)) {
+        dst = PyDict_New();
+    }
+    else if (PyList_CheckExact(src)) {
+        dst = new_none_filled(&PyList_Type, PyList_GET_SIZE(src));
+    }
+    else {
+        descr = PyDict_Check(src) ? type_lookup(type, str___deepcopy__) : NULL;
+        /* only compared by identity with the descriptors of our types */
+        Py_XDECREF(descr);
+        if (descr != NULL && descr == FrozenStruct_deepcopy_descr) {
+            Py_INCREF(src);
+            *result = src;
+            return 0;
+        }
+        if (descr == NULL || !is_copyable_struct_type(type, descr)) {
+            *result = copier_fallback(copier, src);
+            return *result == NULL ? -1 : 0;
+        }
+        dst = new_struct_like(src);
+    }
+    if (dst == NULL)
+        return -1;
+    if (memo_set(copier->memo, src, dst) < 0) {
+        Py_DECREF(dst);
+        return -1;
+    }
+    return convert_stack_push(stack, src, dst);
+}
+
+
+static PyObject *
+deepcopy(Copier *copier, PyObject *obj)
+{
+    ConvertStack stack = {NULL, 0, 0};
+    PyObject *result = NULL, *value;
+
+    if (deepcopy_visit(copier, &stack, obj, &result) < 0)
+        goto fail;
+    if (result != NULL)
+        return result;
+
+    while (stack.size > 0) {
+        ConvertFrame *frame = &stack.frames[stack.size - 1];
+        PyObject *key = NULL, *child;
+        Py_ssize_t index = -1;
+
+        if (PyDict_Check(frame->src)) {
+            if (!dict_next_ref(frame->src, &frame->pos, &key, &child))
+                goto done;
+            if (!is_atomic(key)) {
+                Py_SETREF(key, copier_fallback(copier, key));
+                if (key == NULL) {
+                    Py_DECREF(child);
+                    goto fail;
+                }
+            }
+        }
+        else {
+            if (frame->pos >= PyList_GET_SIZE(frame->dst))
+                goto done;
+            index = frame->pos++;
+            child = PyList_GetItemRef(frame->src, index);
+            if (child == NULL) {
+                /* the list got shorter */
+                PyErr_Clear();
+                goto done;
+            }
+        }
+
+        if (deepcopy_visit(copier, &stack, child, &value) < 0) {
+            Py_XDECREF(key);
+            Py_DECREF(child);
+            goto fail;
+        }
+        Py_DECREF(child);
+        if (value == NULL) {
+            /* a new container: attach it when its children are done */
+            frame = &stack.frames[stack.size - 1];
+            frame->parent_key = key;
+            frame->parent_index = index;
+            continue;
+        }
+        frame = &stack.frames[stack.size - 1];
+        if (convert_attach(frame, key, index, value) < 0) {
+            Py_XDECREF(key);
+            goto fail;
+        }
+        Py_XDECREF(key);
+        continue;
+
+    done:
+        /* pop the finished node and attach it to its parent */
+        stack.size--;
+        value = frame->dst;
+        frame->dst = NULL;
+        if (stack.size == 0) {
+            result = value;
+        }
+        else if (convert_attach(&stack.frames[stack.size - 1],
+                                frame->parent_key, frame->parent_index,
+                                value) < 0) {
+            convert_frame_clear(frame);
+            goto fail;
+        }
+        convert_frame_clear(frame);
+    }
+
+    PyMem_Free(stack.frames);
+    return result;
+
+fail:
+    while (stack.size > 0)
+        convert_frame_clear(&stack.frames[--stack.size]);
+    PyMem_Free(stack.frames);
+    return NULL;
+}
+
+
+/* Set the state of `y`, a new object from `__reduce_ex__`, like the copy
+   module does
+ */
+static int
+reconstruct_state(PyObject *y, PyObject *state)
+{
+    PyObject *setstate, *slotstate = NULL, *dict, *res, *items, *item;
+    Py_ssize_t i;
+    int found;
+
+    found = PyObject_GetOptionalAttr(y, str___setstate__, &setstate);
+    if (found != 0) {
+        if (found < 0)
+            return -1;
+        res = PyObject_CallOneArg(setstate, state);
+        Py_DECREF(setstate);
+        Py_XDECREF(res);
+        return res == NULL ? -1 : 0;
+    }
+    if (PyTuple_Check(state) && PyTuple_GET_SIZE(state) == 2) {
+        slotstate = PyTuple_GET_ITEM(state, 1);
+        state = PyTuple_GET_ITEM(state, 0);
+    }
+    if (state != Py_None) {
+        dict = PyObject_GetAttrString(y, "__dict__");
+        if (dict == NULL)
+            return -1;
+        res = PyObject_CallMethod(dict, "update", "O", state);
+        Py_DECREF(dict);
+        if (res == NULL)
+            return -1;
+        Py_DECREF(res);
+    }
+    if (slotstate != NULL && slotstate != Py_None) {
+        items = PyMapping_Items(slotstate);
+        if (items == NULL)
+            return -1;
+        for (i = 0; i < PyList_GET_SIZE(items); i++) {
+            item = PyList_GET_ITEM(items, i);
+            if (!PyTuple_Check(item) || PyTuple_GET_SIZE(item) != 2
+                    || PyObject_SetAttr(y, PyTuple_GET_ITEM(item, 0),
+                                        PyTuple_GET_ITEM(item, 1)) < 0) {
+                if (!PyErr_Occurred())
+                    PyErr_SetString(PyExc_TypeError, "items must be pairs");
+                Py_DECREF(items);
+                return -1;
+            }
+        }
+        Py_DECREF(items);
+    }
+    return 0;
+}
+
+
+/* copy.deepcopy(self, memo) the way it would go without `__deepcopy__`,
+   for subclasses with state outside the dict: rebuilt from the result of
+   `__reduce_ex__(4)`, with its parts copied by copy.deepcopy
+ */
+static PyObject *
+reconstruct(Copier *copier, PyObject *self)
+{
+    PyObject *rv, *args, *y = NULL, *iter = NULL, *item, *value, *res;
+    PyObject *parts[5] = {NULL, NULL, Py_None, Py_None, Py_None};
+    Py_ssize_t i, n;
+
+    rv = PyObject_CallMethod(self, "__reduce_ex__", "i", 4);
+    if (rv == NULL)
+        return NULL;
+    if (PyUnicode_Check(rv)) {
+        /* a global, copied as itself */
+        Py_DECREF(rv);
+        Py_INCREF(self);
+        return self;
+    }
+    n = PyTuple_Check(rv) ? PyTuple_GET_SIZE(rv) : 0;
+    if (n < 2 || n > 5) {
+        PyErr_SetString(PyExc_TypeError,
+                        "__reduce_ex__ must return a tuple of 2 to 5 items");
+        Py_DECREF(rv);
+        return NULL;
+    }
+    for (i = 0; i < n; i++)
+        parts[i] = PyTuple_GET_ITEM(rv, i);
+
+    args = parts[1];
+    Py_INCREF(args);
+    i = PyObject_IsTrue(args);
+    if (i != 0)
+        Py_SETREF(args, i < 0 ? NULL : copier_fallback(copier, args));
+    if (args == NULL)
+        goto fail;
+    y = PyObject_CallObject(parts[0], args);
+    Py_DECREF(args);
+    if (y == NULL || memo_set(copier->memo, self, y) < 0)
+        goto fail;
+
+    if (parts[2] != Py_None) {
+        value = copier_fallback(copier, parts[2]);
+        if (value == NULL)
+            goto fail;
+        i = reconstruct_state(y, value);
+        Py_DECREF(value);
+        if (i < 0)
+            goto fail;
+    }
+    if (parts[3] != Py_None) {
+        iter = PyObject_GetIter(parts[3]);
+        if (iter == NULL)
+            goto fail;
+        while ((item = PyIter_Next(iter)) != NULL) {
+            value = copier_fallback(copier, item);
+            Py_DECREF(item);
+            if (value == NULL)
+                goto fail;
+            res = PyObject_CallMethod(y, "append", "O", value);
+            Py_DECREF(value);
+            if (res == NULL)
+                goto fail;
+            Py_DECREF(res);
+        }
+        Py_CLEAR(iter);
+    }
+    if (parts[4] != Py_None) {
+        iter = PyObject_GetIter(parts[4]);
+        if (iter == NULL)
+            goto fail;
+        while ((item = PyIter_Next(iter)) != NULL) {
+            value = copier_fallback(copier, item);
+            Py_DECREF(item);
+            if (value == NULL)
+                goto fail;
+            if (!PyTuple_Check(value) || PyTuple_GET_SIZE(value) != 2) {
+                PyErr_SetString(PyExc_TypeError, "dict items must be pairs");
+                Py_DECREF(value);
+                goto fail;
+            }
+            i = PyObject_SetItem(y, PyTuple_GET_ITEM(value, 0),
+                                 PyTuple_GET_ITEM(value, 1));
+            Py_DECREF(value);
+            if (i < 0)
+                goto fail;
+        }
+        Py_CLEAR(iter);
+    }
+    if (PyErr_Occurred())
+        goto fail;
+    Py_DECREF(rv);
+    return y;
+
+fail:
+    Py_XDECREF(iter);
+    Py_XDECREF(y);
+    Py_DECREF(rv);
+    return NULL;
+}
+
+
+static PyObject *
+Struct_deepcopy(PyObject *self, PyObject *memo)
+{
+    Copier copier;
+    PyObject *result;
+
+    if (memo == Py_None)
+        memo = PyDict_New();
+    else if (PyDict_Check(memo))
+        Py_INCREF(memo);
+    else {
+        PyErr_SetString(PyExc_TypeError, "memo must be a dict or None");
+        return NULL;
+    }
+    if (memo == NULL)
+        return NULL;
+
+    copier.memo = memo;
+    copier.deepcopy = NULL;
+    if (is_copyable_struct_type(Py_TYPE(self), Struct_deepcopy_descr))
+        result = deepcopy(&copier, self);
+    else
+        result = reconstruct(&copier, self);
+    Py_XDECREF(copier.deepcopy);
+    Py_DECREF(memo);
+    return result;
+}
+
+
+/*
+    JSON decoding straight into structs: an `object_hook` for the json
+    module that turns the decoded dicts into structs
+ */
+
+typedef struct {
+    PyObject_HEAD
+    PyTypeObject *struct_type;
+    vectorcallfunc vectorcall;
+} ObjectHookObject;
+
+
+static PyTypeObject *ObjectHookType = NULL;
+
+
+static PyObject *
+struct_from_dict(ObjectHookObject *hook, PyObject *dict)
+{
+    PyObject *result;
+
+    result = new_empty_struct(hook->struct_type);
+    if (result == NULL)
+        return NULL;
+    if (PyDict_Update(result, dict) < 0) {
+        Py_DECREF(result);
+        return NULL;
+    }
+    return result;
+}
+
+
+static PyObject *
+ObjectHook_vectorcall(PyObject *self, PyObject *const *args, size_t nargsf,
+                     PyObject *kwnames)
+{
+    if (PyVectorcall_NARGS(nargsf) != 1
+            || (kwnames != NULL && PyTuple_GET_SIZE(kwnames) > 0)) {
+        PyErr_SetString(PyExc_TypeError,
+                        "object hook takes exactly one argument");
+        return NULL;
+    }
+    return struct_from_dict((ObjectHookObject *)self, args[0]);
+}
+
+
+static int
+ObjectHook_traverse(PyObject *self, visitproc visit, void *arg)
+{
+    Py_VISIT(((ObjectHookObject *)self)->struct_type);
+    Py_VISIT(Py_TYPE(self));
+    return 0;
+}
+
+
+static int
+ObjectHook_tp_clear(PyObject *self)
+{
+    Py_CLEAR(((ObjectHookObject *)self)->struct_type);
+    return 0;
+}
+
+
+static void
+ObjectHook_dealloc(PyObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    PyObject_GC_UnTrack(self);
+    ObjectHook_tp_clear(self);
+    type->tp_free(self);
+    Py_DECREF(type);
+}
+
+
+static PyObject *
+ObjectHook_repr(PyObject *self)
+{
+    return PyUnicode_FromFormat("<object_hook for %s>",
+                                ((ObjectHookObject *)self)->struct_type->tp_name);
+}
+
+
+static PyMemberDef ObjectHook_members[] = {
+    {"__vectorcalloffset__", T_PYSSIZET,
+        offsetof(ObjectHookObject, vectorcall), READONLY},
+    {"struct_type", T_OBJECT, offsetof(ObjectHookObject, struct_type), READONLY},
+    {NULL},
+};
+
+
+static PyType_Slot
+ObjectHookType_slots[] = {
+    {Py_tp_call, PyVectorcall_Call},
+    {Py_tp_traverse, ObjectHook_traverse},
+    {Py_tp_clear, ObjectHook_tp_clear},
+    {Py_tp_dealloc, ObjectHook_dealloc},
+    {Py_tp_repr, ObjectHook_repr},
+    {Py_tp_members, ObjectHook_members},
+    {0, NULL}
+};
+
+
+static PyType_Spec
+ObjectHookType_spec = {
+    .name = "tri_struct._ObjectHook",
+    .basicsize = sizeof(ObjectHookObject),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC
+        | Py_TPFLAGS_HAVE_VECTORCALL,
+    .slots = ObjectHookType_slots
+};
+
+
+PyDoc_STRVAR(object_hook_doc,
+"object_hook(struct_type) -> callable\n"
+"\n"
+"An `object_hook` for the json module that makes `struct_type` instances\n"
+"of the decoded objects, copied into a new instance.\n"
+);
+
+
+static PyObject *
+object_hook(PyObject *module, PyObject *struct_type)
+{
+    ObjectHookObject *hook;
+
+    if (!PyType_Check(struct_type)
+            || !PyType_IsSubtype((PyTypeObject *)struct_type, &PyDict_Type)) {
+        PyErr_SetString(PyExc_TypeError, "struct_type must be a dict subclass");
+        return NULL;
+    }
+
+    hook = PyObject_GC_New(ObjectHookObject, ObjectHookType);
+    if (hook == NULL)
+        return NULL;
+    Py_INCREF(struct_type);
+    hook->struct_type = (PyTypeObject *)struct_type;
+    hook->vectorcall = ObjectHook_vectorcall;
+    PyObject_GC_Track(hook);
+    return (PyObject *)hook;
+}
+
+
+/*
+    bulk construction from rows of values, like the rows of a database
+    cursor or a CSV reader: the keys are prepared once for all rows
+ */
+
+typedef struct {
+    PyObject_HEAD
+    PyTypeObject *struct_type;
+    PyObject *keys;         /* tuple, with the str keys interned */
+    PyObject *rows;         /* iterator */
+    Py_ssize_t index;       /* of the next row, for error messages */
+} RowIteratorObject;
+
+
+static PyTypeObject *RowIteratorType = NULL;
+
+
+/* A new `type` instance with `values[i]` at `keys[i]` */
+static PyObject *
+struct_from_values(PyTypeObject *type, PyObject *keys, PyObject **values)
+{
+    PyObject *result;
+    Py_ssize_t i, n = PyTuple_GET_SIZE(keys);
+
+    result = new_empty_struct(type);
+    if (result == NULL)
+        return NULL;
+    for (i = 0; i < n; i++) {
+        if (PyDict_SetItem(result, PyTuple_GET_ITEM(keys, i), values[i]) < 0) {
+            Py_DECREF(result);
+            return NULL;
+        }
+    }
+    return result;
+}
+
+
+static PyObject *
+struct_from_row(RowIteratorObject *it, PyObject *row)
+{
+    PyObject *values, *result;
+    Py_ssize_t n = PyTuple_GET_SIZE(it->keys);
+
+#ifdef Py_GIL_DISABLED
+    /* a snapshot, other threads may change a list while it is read */
+    values = PySequence_Tuple(row);
+#else
+    values = PySequence_Fast(row, "rows must be sequences of values");
+#endif
+    if (values == NULL)
+        return NULL;
+    if (PySequence_Fast_GET_SIZE(values) != n) {
+        PyErr_Format(PyExc_ValueError, "row %zd has %zd values, expected %zd",
+                     it->index, PySequence_Fast_GET_SIZE(values), n);
+        Py_DECREF(values);
+        return NULL;
+    }
+    result = struct_from_values(it->struct_type, it->keys,
+                                PySequence_Fast_ITEMS(values));
+    Py_DECREF(values);
+    return result;
+}
+
+
+static PyObject *
+RowIterator_next(PyObject *self)
+{
+    RowIteratorObject *it = (RowIteratorObject *)self;
+    PyObject *row, *result = NULL;
+
+    Py_BEGIN_CRITICAL_SECTION(self);
+    row = PyIter_Next(it->rows);
+    if (row != NULL) {
+        result = struct_from_row(it, row);
+        Py_DECREF(row);
+        it->index++;
+    }
+    Py_END_CRITICAL_SECTION();
+    return result;
+}
+
+
+static int
+RowIterator_traverse(PyObject *self, visitproc visit, void *arg)
+{
+    Py_VISIT(((RowIteratorObject *)self)->struct_type);
+    Py_VISIT(((RowIteratorObject *)self)->keys);
+    Py_VISIT(((RowIteratorObject *)self)->rows);
+    Py_VISIT(Py_TYPE(self));
+    return 0;
+}
+
+
+static int
+RowIterator_tp_clear(PyObject *self)
+{
+    Py_CLEAR(((RowIteratorObject *)self)->struct_type);
+    Py_CLEAR(((RowIteratorObject *)self)->keys);
+    Py_CLEAR(((RowIteratorObject *)self)->rows);
+    return 0;
+}
+
+
+static void
+RowIterator_dealloc(PyObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    PyObject_GC_UnTrack(self);
+    RowIterator_tp_clear(self);
+    type->tp_free(self);
+    Py_DECREF(type);
+}
+
+
+static PyType_Slot
+RowIteratorType_slots[] = {
+    {Py_tp_iter, PyObject_SelfIter},
+    {Py_tp_iternext, RowIterator_next},
+    {Py_tp_traverse, RowIterator_traverse},
+    {Py_tp_clear, RowIterator_tp_clear},
+    {Py_tp_dealloc, RowIterator_dealloc},
+    {0, NULL}
+};
+
+
+static PyType_Spec
+RowIteratorType_spec = {
+    .name = "tri_struct._RowIterator",
+    .basicsize = sizeof(RowIteratorObject),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,
+    .slots = RowIteratorType_slots
+};
+
+
+static PyObject *
+Struct_from_rows(PyObject *cls, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"keys", "rows", "lazy", NULL};
+    PyObject *keys_arg, *rows_arg, *seq, *keys, *rows, *key, *result;
+    RowIteratorObject *it;
+    Py_ssize_t i, n;
+    int lazy = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO|p:from_rows", kwlist,
+                                     &keys_arg, &rows_arg, &lazy))
+        return NULL;
+
+    /* a copy, the interned keys must not end up in the caller's tuple */
+    seq = PySequence_Tuple(keys_arg);
+    if (seq == NULL)
+        return NULL;
+    n = PyTuple_GET_SIZE(seq);
+    keys = PyTuple_New(n);
+    if (keys == NULL) {
+        Py_DECREF(seq);
+        return NULL;
+    }
+    for (i = 0; i < n; i++) {
+        key = PyTuple_GET_ITEM(seq, i);
+        Py_INCREF(key);
+        if (PyUnicode_CheckExact(key))
+            PyUnicode_InternInPlace(&key);
+        PyTuple_SET_ITEM(keys, i, key);
+    }
+    Py_DECREF(seq);
+
+    rows = PyObject_GetIter(rows_arg);
+    if (rows == NULL) {
+        Py_DECREF(keys);
+        return NULL;
+    }
+    it = PyObject_GC_New(RowIteratorObject, RowIteratorType);
+    if (it == NULL) {
+        Py_DECREF(keys);
+        Py_DECREF(rows);
+        return NULL;
+    }
+    Py_INCREF(cls);
+    it->struct_type = (PyTypeObject *)cls;
+    it->keys = keys;
+    it->rows = rows;
+    it->index = 0;
+    PyObject_GC_Track(it);
+
+    if (lazy)
+        return (PyObject *)it;
+    result = PySequence_List((PyObject *)it);
+    Py_DECREF(it);
+    return result;
+}
+
+
+/*
+    compiled accessors for nested keys, see tri_struct/_path.py
+ */
+
+typedef struct {
+    PyObject_HEAD
+    PyObject *keys;         /* tuple */
+    PyObject *dflt;
+    vectorcallfunc vectorcall;
+} PathObject;
+
+
+typedef struct {
+    PyObject_HEAD
+    PyObject *paths;        /* tuple of paths */
+    PyObject *names;        /* tuple, or None for tuple results */
+    PyTypeObject *struct_type;
+    vectorcallfunc vectorcall;
+} ProjectionObject;
+
+
+static PyTypeObject *PathType = NULL;
+static PyTypeObject *ProjectionType = NULL;
+
+
+/* The value at `keys` in `obj`: dicts are followed by item, without
+   `__missing__`, anything else by attribute. A new reference to `dflt`
+   if a level is missing.
+ */
+static PyObject *
+walk_path(PyObject *obj, PyObject *keys, PyObject *dflt)
+{
+    PyObject *key, *value;
+    Py_ssize_t i, n = PyTuple_GET_SIZE(keys);
+    int found;
+
+    Py_INCREF(obj);
+    for (i = 0; i < n; i++) {
+        key = PyTuple_GET_ITEM(keys, i);
+        if (PyDict_Check(obj))
+            found = PyDict_GetItemRef(obj, key, &value);
+        else if (PyUnicode_Check(key))
+            found = PyObject_GetOptionalAttr(obj, key, &value);
+        else
+            found = 0;
+        Py_DECREF(obj);
+        if (found < 0)
+            return NULL;
+        if (found == 0) {
+            Py_INCREF(dflt);
+            return dflt;
+        }
+        obj = value;
+    }
+    return obj;
+}
+
+
+static PyObject *
+project_one(ProjectionObject *projection, PyObject *obj)
+{
+    PathObject *path;
+    PyObject *values, *value, *result;
+    Py_ssize_t i, n = PyTuple_GET_SIZE(projection->paths);
+
+    values = PyTuple_New(n);
+    if (values == NULL)
+        return NULL;
+    for (i = 0; i < n; i++) {
+        path = (PathObject *)PyTuple_GET_ITEM(projection->paths, i);
+        value = walk_path(obj, path->keys, path->dflt);
+        if (value == NULL) {
+            Py_DECREF(values);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(values, i, value);
+    }
+    if (projection->names == Py_None)
+        return values;
+    result = struct_from_values(projection->struct_type, projection->names,
+                                &PyTuple_GET_ITEM(values, 0));
+    Py_DECREF(values);
+    return result;
+}
+
+
+static PyObject *
+Path_call(PathObject *path, PyObject *obj)
+{
+    return walk_path(obj, path->keys, path->dflt);
+}
+
+
+static PyObject *
+Projection_call(ProjectionObject *projection, PyObject *obj)
+{
+    return project_one(projection, obj);
+}
+
+
+static PyObject *
+accessor_vectorcall(PyObject *self, PyObject *const *args, size_t nargsf,
+                    PyObject *kwnames)
+{
+    if (PyVectorcall_NARGS(nargsf) != 1
+            || (kwnames != NULL && PyTuple_GET_SIZE(kwnames) > 0)) {
+        PyErr_Format(PyExc_TypeError, "%s takes exactly one argument",
+                     Py_TYPE(self) == PathType ? "path" : "projection");
+        return NULL;
+    }
+    if (Py_TYPE(self) == PathType)
+        return Path_call((PathObject *)self, args[0]);
+    return Projection_call((ProjectionObject *)self, args[0]);
+}
+
+
+PyDoc_STRVAR(accessor_map_doc,
+"map(iterable) -> list\n"
+"\n"
+"The result for every item of `iterable`, in one call.\n"
+);
+
+
+static PyObject *
+accessor_map(PyObject *self, PyObject *iterable)
+{
+    PyObject *iter, *item, *value, *result;
+
+    iter = PyObject_GetIter(iterable);
+    if (iter == NULL)
+        return NULL;
+    result = PyList_New(0);
+    if (result == NULL) {
+        Py_DECREF(iter);
+        return NULL;
+    }
+    while ((item = PyIter_Next(iter)) != NULL) {
+        if (Py_TYPE(self) == PathType)
+            value = Path_call((PathObject *)self, item);
+        else
+            value = Projection_call((ProjectionObject *)self, item);
+        Py_DECREF(item);
+        if (value == NULL || PyList_Append(result, value) < 0) {
+            Py_XDECREF(value);
+            goto fail;
+        }
+        Py_DECREF(value);
+    }
+    if (PyErr_Occurred())
+        goto fail;
+    Py_DECREF(iter);
+    return result;
+
+fail:
+    Py_DECREF(iter);
+    Py_DECREF(result);
+    return NULL;
+}
+
+
+static PyMethodDef accessor_methods[] = {
+    {"map", (PyCFunction)accessor_map, METH_O, accessor_map_doc},
+    {NULL, NULL},
+};
+
+
+static PyObject *
+Path_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"keys", "default", NULL};
+    PyObject *keys, *dflt = Py_None;
+    PathObject *path;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!|O:_Path", kwlist,
+                                     &PyTuple_Type, &keys, &dflt))
+        return NULL;
+    path = PyObject_GC_New(PathObject, type);
+    if (path == NULL)
+        return NULL;
+    Py_INCREF(keys);
+    path->keys = keys;
+    Py_INCREF(dflt);
+    path->dflt = dflt;
+    path->vectorcall = accessor_vectorcall;
+    PyObject_GC_Track(path);
+    return (PyObject *)path;
+}
+
+
+static int
+Path_traverse(PyObject *self, visitproc visit, void *arg)
+{
+    Py_VISIT(((PathObject *)self)->keys);
+    Py_VISIT(((PathObject *)self)->dflt);
+    Py_VISIT(Py_TYPE(self));
+    return 0;
+}
+
+
+static int
+Path_tp_clear(PyObject *self)
+{
+    Py_CLEAR(((PathObject *)self)->keys);
+    Py_CLEAR(((PathObject *)self)->dflt);
+    return 0;
+}
+
+
+static void
+Path_dealloc(PyObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    PyObject_GC_UnTrack(self);
+    Path_tp_clear(self);
+    type->tp_free(self);
+    Py_DECREF(type);
+}
+
+
+static PyObject *
+Path_repr(PyObject *self)
+{
+    return PyUnicode_FromFormat("path(%R, default=%R)",
+                                ((PathObject *)self)->keys,
+                                ((PathObject *)self)->dflt);
+}
+
+
+static PyMemberDef Path_members[] = {
+    {"__vectorcalloffset__", T_PYSSIZET,
+        offsetof(PathObject, vectorcall), READONLY},
+    {"keys", T_OBJECT, offsetof(PathObject, keys), READONLY},
+    {"default", T_OBJECT, offsetof(PathObject, dflt), READONLY},
+    {NULL},
+};
+
+
+static PyType_Slot
+PathType_slots[] = {
+    {Py_tp_new, Path_new},
+    {Py_tp_call, PyVectorcall_Call},
+    {Py_tp_traverse, Path_traverse},
+    {Py_tp_clear, Path_tp_clear},
+    {Py_tp_dealloc, Path_dealloc},
+    {Py_tp_repr, Path_repr},
+    {Py_tp_members, Path_members},
+    {Py_tp_methods, accessor_methods},
+    {0, NULL}
+};
+
+
+static PyType_Spec
+PathType_spec = {
+    .name = "tri_struct._Path",
+    .basicsize = sizeof(PathObject),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC
+        | Py_TPFLAGS_HAVE_VECTORCALL,
+    .slots = PathType_slots
+};
+
+
+static PyObject *
+Projection_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"paths", "names", "struct_type", NULL};
+    PyObject *paths, *names, *struct_type;
+    ProjectionObject *projection;
+    Py_ssize_t i;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!OO:_Projection", kwlist,
+                                     &PyTuple_Type, &paths, &names,
+                                     &struct_type))
+        return NULL;
+    for (i = 0; i < PyTuple_GET_SIZE(paths); i++) {
+        if (Py_TYPE(PyTuple_GET_ITEM(paths, i)) != PathType) {
+            PyErr_SetString(PyExc_TypeError, "paths must be a tuple of paths");
+            return NULL;
+        }
+    }
+    if (names != Py_None && (!PyTuple_Check(names)
+            || PyTuple_GET_SIZE(names) != PyTuple_GET_SIZE(paths))) {
+        PyErr_SetString(PyExc_TypeError,
+                        "names must be None or a tuple with a name per path");
+        return NULL;
+    }
+    if (!PyType_Check(struct_type)
+            || !PyType_IsSubtype((PyTypeObject *)struct_type, &PyDict_Type)) {
+        PyErr_SetString(PyExc_TypeError, "struct_type must be a dict subclass");
+        return NULL;
+    }
+
+    projection = PyObject_GC_New(ProjectionObject, type);
+    if (projection == NULL)
+        return NULL;
+    Py_INCREF(paths);
+    projection->paths = paths;
+    Py_INCREF(names);
+    projection->names = names;
+    Py_INCREF(struct_type);
+    projection->struct_type = (PyTypeObject *)struct_type;
+    projection->vectorcall = accessor_vectorcall;
+    PyObject_GC_Track(projection);
+    return (PyObject *)projection;
+}
+
+
+static int
+Projection_traverse(PyObject *self, visitproc visit, void *arg)
+{
+    Py_VISIT(((ProjectionObject *)self)->paths);
+    Py_VISIT(((ProjectionObject *)self)->names);
+    Py_VISIT(((ProjectionObject *)self)->struct_type);
+    Py_VISIT(Py_TYPE(self));
+    return 0;
+}
+
+
+static int
+Projection_tp_clear(PyObject *self)
+{
+    Py_CLEAR(((ProjectionObject *)self)->paths);
+    Py_CLEAR(((ProjectionObject *)self)->names);
+    Py_CLEAR(((ProjectionObject *)self)->struct_type);
+    return 0;
+}
+
+
+static void
+Projection_dealloc(PyObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    PyObject_GC_UnTrack(self);
+    Projection_tp_clear(self);
+    type->tp_free(self);
+    Py_DECREF(type);
+}
+
+
+static PyMemberDef Projection_members[] = {
+    {"__vectorcalloffset__", T_PYSSIZET,
+        offsetof(ProjectionObject, vectorcall), READONLY},
+    {"paths", T_OBJECT, offsetof(ProjectionObject, paths), READONLY},
+    {"names", T_OBJECT, offsetof(ProjectionObject, names), READONLY},
+    {"struct_type", T_OBJECT, offsetof(ProjectionObject, struct_type), READONLY},
+    {NULL},
+};
+
+
+static PyType_Slot
+ProjectionType_slots[] = {
+    {Py_tp_new, Projection_new},
+    {Py_tp_call, PyVectorcall_Call},
+    {Py_tp_traverse, Projection_traverse},
+    {Py_tp_clear, Projection_tp_clear},
+    {Py_tp_dealloc, Projection_dealloc},
+    {Py_tp_members, Projection_members},
+    {Py_tp_methods, accessor_methods},
+    {0, NULL}
+};
+
+
+static PyType_Spec
+ProjectionType_spec = {
+    .name = "tri_struct._Projection",
+    .basicsize = sizeof(ProjectionObject),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC
+        | Py_TPFLAGS_HAVE_VECTORCALL,
+    .slots = ProjectionType_slots
+};
+
+
+/*
+    compact pickling of many structs: the keys are written once per shape
+    and the values of all structs as one flat list
+ */
+
+#define RAW_ITEM 255
+
+
+/* Does this interpreter keep dicts without containers in them out of the
+   gc, like `dict()` does? Set when the module is loaded.
+ */
+static int untracks_dicts = 0;
+
+
+/* Instances of `type` hold nothing the gc has to know about besides what
+   the dict has
+ */
+static int
+has_dict_layout(PyTypeObject *type)
 {
-    return PyModuleDef_Init(&moduledef);
+    return is_plain_struct_type(type)
+        && type->tp_basicsize == PyDict_Type.tp_basicsize
+        && type->tp_itemsize == 0
+        && type->tp_dictoffset == 0
+        && type->tp_weaklistoffset == 0;
 }
-#else
-void
-init_cstruct(void)
+
+
+/* Does `item` have exactly the keys of `keys`, in that order? Compares by
+   identity, which is what same-shaped structs from one source share.
+ */
+static int
+has_same_keys(PyObject *item, PyObject *keys)
 {
-    PyObject *m = NULL;
+    Py_ssize_t pos = 0, i = 0;
+    PyObject *key, *value;
+
+    if (PyDict_GET_SIZE(item) != PyTuple_GET_SIZE(keys))
+        return 0;
+    while (PyDict_Next(item, &pos, &key, &value)) {
+        if (key != PyTuple_GET_ITEM(keys, i++))
+            return 0;
+    }
+    return 1;
+}
+
+
+/* The row of every struct that is packed, by address, borrowed from the
+   items. Cheaper than a dict of ids, as the `copy` memo is, which would
+   cost more than the packing itself.
+ */
+typedef struct {
+    PyObject *item;
+    Py_ssize_t row;
+} RowEntry;
+
+
+typedef struct {
+    RowEntry *entries;
+    size_t mask;
+} RowTable;
+
+
+static int
+RowTable_init(RowTable *table, Py_ssize_t n)
+{
+    size_t size = 8;
+
+    /* at most half full */
+    while (size < (size_t)n * 2)
+        size *= 2;
+    table->entries = PyMem_Calloc(size, sizeof(RowEntry));
+    if (table->entries == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    table->mask = size - 1;
+    return 0;
+}
+
+
+/* The entry of `item`, an empty one if it has none */
+static RowEntry *
+RowTable_lookup(RowTable *table, PyObject *item)
+{
+    /* objects are 16 byte aligned */
+    size_t i = ((size_t)item >> 4) & table->mask;
+
+    while (table->entries[i].item != NULL && table->entries[i].item != item)
+        i = (i + 1) & table->mask;
+    return &table->entries[i];
+}
+
+
+/* Append `value` to `values`. A struct that is a row of its own, one in
+   `rows`, is appended as None instead, with its position and its row in
+   `refs`, so that it is rebuilt only once.
+ */
+static int
+pack_value(PyObject *value, PyObject *values, RowTable *rows, PyObject *refs)
+{
+    RowEntry *entry;
+    PyObject *pos, *row;
+    int res;
+
+    if (!PyDict_Check(value)
+            || (entry = RowTable_lookup(rows, value))->item == NULL)
+        return PyList_Append(values, value);
+
+    pos = PyLong_FromSsize_t(PyList_GET_SIZE(values));
+    row = PyLong_FromSsize_t(entry->row);
+    res = (pos == NULL || row == NULL
+           || PyList_Append(refs, pos) < 0
+           || PyList_Append(refs, row) < 0
+           || PyList_Append(values, Py_None) < 0) ? -1 : 0;
+    Py_XDECREF(pos);
+    Py_XDECREF(row);
+    return res;
+}
+
+
+/* Append the values of `item` to `values` if its keys are `keys`, in
+   the same order. 1 if they were, 0 if not and -1 on errors.
+ */
+static int
+pack_values(PyObject *item, PyObject *keys, PyObject *values,
+            RowTable *rows, PyObject *refs)
+{
+    Py_ssize_t pos = 0;
+    PyObject *key, *value;
+    int res = 1;
+
+    /* the keys must not change between the check and the copy */
+    Py_BEGIN_CRITICAL_SECTION(item);
+    if (!has_same_keys(item, keys))
+        res = 0;
+    while (res > 0 && PyDict_Next(item, &pos, &key, &value)) {
+        if (pack_value(value, values, rows, refs) < 0)
+            res = -1;
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
+
+
+/* Index of the (type, keys) shape of `item` in `shapes`, added if new */
+static Py_ssize_t
+shape_of(PyObject *item, PyObject *shapes, PyObject *shape_index)
+{
+    PyObject *keys, *shape, *index;
+    Py_ssize_t i = -1;
+    int res;
+
+    keys = PyDict_Keys(item);
+    if (keys == NULL)
+        return -1;
+    shape = Py_BuildValue("(ON)", (PyObject *)Py_TYPE(item),
+                          PyList_AsTuple(keys));
+    Py_DECREF(keys);
+    if (shape == NULL)
+        return -1;
+
+    res = PyDict_GetItemRef(shape_index, shape, &index);
+    if (res > 0)
+        i = PyLong_AsSsize_t(index);
+    else if (res == 0) {
+        i = PyList_GET_SIZE(shapes);
+        index = PyLong_FromSsize_t(i);
+        if (index == NULL
+                || PyDict_SetItem(shape_index, shape, index) < 0
+                || PyList_Append(shapes, shape) < 0)
+            i = -1;
+    }
+    Py_XDECREF(index);
+    Py_DECREF(shape);
+    return i;
+}
+
+
+PyDoc_STRVAR(pack_structs_doc,
+"pack_structs(items) -> (shapes, row_shapes, values, refs)\n"
+"\n"
+"Split a sequence of structs into the distinct (type, keys) shapes, the\n"
+"shape of each item and one flat list of all values. Items that are not\n"
+"plain structs are kept as they are, as a single value. A struct that is\n"
+"an item and shows up again, as a later item or as a value, is stored as\n"
+"None there, and `refs` has the position in `values` and the row of the\n"
+"struct, one after the other. See `unpack_structs`.\n"
+);
+
+
+static PyObject *
+pack_structs(PyObject *module, PyObject *items)
+{
+    Py_ssize_t i, n, shape = -1, last_shape = -1;
+    PyObject *seq, *shapes = NULL, *shape_index = NULL, *values = NULL;
+    PyObject *row_shapes = NULL, *refs = NULL, *result = NULL;
+    PyObject *last_keys = NULL;
+    RowTable rows = {NULL, 0};
+    PyTypeObject *last_type = NULL;
+
+    /* a snapshot, in case another thread changes the list */
+    seq = PySequence_Tuple(items);
+    if (seq == NULL)
+        return NULL;
+    n = PyTuple_GET_SIZE(seq);
+
+    shapes = PyList_New(0);
+    shape_index = PyDict_New();
+    values = PyList_New(0);
+    row_shapes = PyList_New(n);
+    refs = PyList_New(0);
+    if (shapes == NULL || shape_index == NULL || values == NULL
+            || row_shapes == NULL || refs == NULL
+            || RowTable_init(&rows, n) < 0)
+        goto done;
+
+    /* the row of the first occurrence of every struct, which later
+       occurrences and values refer to */
+    for (i = 0; i < n; i++) {
+        PyObject *item;
+        RowEntry *entry;
+
+        item = PyTuple_GET_ITEM(seq, i);
+        if (!PyDict_Check(item) || !is_plain_struct_type(Py_TYPE(item)))
+            continue;
+        entry = RowTable_lookup(&rows, item);
+        if (entry->item == NULL) {
+            entry->item = item;
+            entry->row = i;
+        }
+    }
+
+    for (i = 0; i < n; i++) {
+        PyObject *item;
+        RowEntry *entry;
+        int res = 0;
+
+        item = PyTuple_GET_ITEM(seq, i);
+        if (!PyDict_Check(item)
+                || (entry = RowTable_lookup(&rows, item))->item == NULL
+                || entry->row != i) {
+            /* not a struct, or one that is packed already */
+            if (pack_value(item, values, &rows, refs) < 0)
+                goto done;
+            shape = -1;
+        }
+        else {
+            if (Py_TYPE(item) == last_type)
+                res = pack_values(item, last_keys, values, &rows, refs);
+            /* again if another thread changed the keys in between */
+            while (res == 0) {
+                shape = shape_of(item, shapes, shape_index);
+                if (shape < 0)
+                    goto done;
+                last_shape = shape;
+                last_type = Py_TYPE(item);
+                last_keys = PyTuple_GET_ITEM(PyList_GET_ITEM(shapes, shape), 1);
+                res = pack_values(item, last_keys, values, &rows, refs);
+            }
+            if (res < 0)
+                goto done;
+            shape = last_shape;
+        }
+        PyList_SET_ITEM(row_shapes, i, PyLong_FromSsize_t(shape));
+        if (PyList_GET_ITEM(row_shapes, i) == NULL)
+            goto done;
+    }
+
+    if (PyList_GET_SIZE(shapes) < RAW_ITEM) {
+        /* one byte per row */
+        PyObject *packed;
+        char *bytes;
+
+        packed = PyBytes_FromStringAndSize(NULL, n);
+        if (packed == NULL)
+            goto done;
+        bytes = PyBytes_AS_STRING(packed);
+        for (i = 0; i < n; i++) {
+            shape = PyLong_AsSsize_t(PyList_GET_ITEM(row_shapes, i));
+            bytes[i] = (char)(shape < 0 ? RAW_ITEM : shape);
+        }
+        Py_SETREF(row_shapes, packed);
+    }
+
+    result = PyTuple_Pack(4, shapes, row_shapes, values, refs);
+
+done:
+    PyMem_Free(rows.entries);
+    Py_DECREF(seq);
+    Py_XDECREF(shapes);
+    Py_XDECREF(shape_index);
+    Py_XDECREF(values);
+    Py_XDECREF(row_shapes);
+    Py_XDECREF(refs);
+    return result;
+}
+
+
+static int
+check_shapes(PyObject *shapes)
+{
+    Py_ssize_t i;
+    PyObject *shape;
+
+    for (i = 0; i < PyTuple_GET_SIZE(shapes); i++) {
+        shape = PyTuple_GET_ITEM(shapes, i);
+        if (!PyTuple_Check(shape) || PyTuple_GET_SIZE(shape) != 2
+                || !PyType_Check(PyTuple_GET_ITEM(shape, 0))
+                || !PyType_IsSubtype((PyTypeObject *)PyTuple_GET_ITEM(shape, 0),
+                                     &PyDict_Type)
+                || !PyTuple_Check(PyTuple_GET_ITEM(shape, 1)))
+            goto fail;
+    }
+    return 0;
+
+fail:
+    PyErr_SetString(PyExc_ValueError,
+                    "shapes must be a sequence of (dict subclass, keys tuple)");
+    return -1;
+}
+
+
+/* An empty struct for `shape`, updated from a dict that already has the
+   keys of the shape. Setting the values then doesn't resize, and updating
+   an empty dict from a dict clones its key table in one go.
+
+   Like `dict()`, structs of a dict layout start out untracked by the gc,
+   which then only sees the ones that get a container as a value: the dict
+   tracks itself when one is set.
+ */
+static PyObject *
+new_shaped_struct(PyObject *templates, Py_ssize_t shape, PyObject *type_and_keys)
+{
+    PyTypeObject *type;
+    PyObject *template, *keys, *item;
+    Py_ssize_t i;
+
+    template = PyList_GET_ITEM(templates, shape);
+    if (template == NULL) {
+        keys = PyTuple_GET_ITEM(type_and_keys, 1);
+        template = PyDict_New();
+        if (template == NULL)
+            return NULL;
+        for (i = 0; i < PyTuple_GET_SIZE(keys); i++) {
+            if (PyDict_SetItem(template, PyTuple_GET_ITEM(keys, i), Py_None) < 0) {
+                Py_DECREF(template);
+                return NULL;
+            }
+        }
+        PyList_SET_ITEM(templates, shape, template);
+    }
+
+    type = (PyTypeObject *)PyTuple_GET_ITEM(type_and_keys, 0);
+    item = new_empty_struct(type);
+    if (item == NULL)
+        return NULL;
+    if (untracks_dicts && has_dict_layout(type) && PyObject_GC_IsTracked(item))
+        PyObject_GC_UnTrack(item);
+    if (PyDict_Update(item, template) < 0)
+        Py_CLEAR(item);
+    return item;
+}
+
+
+#define BAD_PACKED_DATA "row_shapes and values don't match"
+
+
+/* The shape of row `i`, -1 for items that are kept as they are and -2 on
+   errors
+ */
+static Py_ssize_t
+row_shape(PyObject *row_shapes, Py_ssize_t n_shapes, Py_ssize_t i)
+{
+    Py_ssize_t shape;
+
+    if (PyBytes_Check(row_shapes)) {
+        shape = (unsigned char)PyBytes_AS_STRING(row_shapes)[i];
+        if (shape == RAW_ITEM)
+            shape = -1;
+    }
+    else {
+        shape = PyLong_AsSsize_t(PyTuple_GET_ITEM(row_shapes, i));
+        if (shape == -1 && PyErr_Occurred())
+            return -2;
+    }
+    if (shape >= n_shapes || shape < -1) {
+        PyErr_SetString(PyExc_ValueError, BAD_PACKED_DATA);
+        return -2;
+    }
+    return shape;
+}
+
+
+PyDoc_STRVAR(unpack_structs_doc,
+"unpack_structs(shapes, row_shapes, values, refs=()) -> list\n"
+"\n"
+"Rebuild the items packed by `pack_structs`.\n"
+);
+
+
+static PyObject *
+unpack_structs(PyObject *module, PyObject *args)
+{
+    Py_ssize_t i, j, n, n_shapes, shape, pos = 0, row;
+    PyObject *shapes_arg, *row_shapes_arg, *values_arg, *refs_arg = NULL;
+    PyObject *shapes = NULL, *row_shapes = NULL, *values = NULL, *refs = NULL;
+    PyObject *templates = NULL, *result = NULL, *type_and_keys, *keys, *item;
+
+    if (!PyArg_ParseTuple(args, "OOO!|O:unpack_structs", &shapes_arg,
+                          &row_shapes_arg, &PyList_Type, &values_arg,
+                          &refs_arg))
+        return NULL;
+    if (!PyList_Check(shapes_arg) && !PyTuple_Check(shapes_arg)) {
+        PyErr_SetString(PyExc_ValueError,
+                        "shapes must be a sequence of (dict subclass, keys tuple)");
+        return NULL;
+    }
+    if (!PyBytes_Check(row_shapes_arg) && !PyList_Check(row_shapes_arg)) {
+        PyErr_SetString(PyExc_ValueError, "row_shapes must be bytes or a list");
+        return NULL;
+    }
+
+    /* work on copies of the lists, in case another thread changes them */
+    if (PyList_Check(row_shapes_arg))
+        row_shapes = PyList_AsTuple(row_shapes_arg);
+    else {
+        row_shapes = row_shapes_arg;
+        Py_INCREF(row_shapes);
+    }
+    if (row_shapes == NULL)
+        goto fail;
+    shapes = PySequence_Tuple(shapes_arg);
+    if (shapes == NULL || check_shapes(shapes) < 0)
+        goto fail;
+    values = PyList_GetSlice(values_arg, 0, PY_SSIZE_T_MAX);
+    if (values == NULL)
+        goto fail;
+    refs = refs_arg == NULL ? PyTuple_New(0) : PySequence_Tuple(refs_arg);
+    if (refs == NULL)
+        goto fail;
+    if (PyTuple_GET_SIZE(refs) % 2)
+        goto bad_data;
+
+    n = PyBytes_Check(row_shapes) ? PyBytes_GET_SIZE(row_shapes)
+                                  : PyTuple_GET_SIZE(row_shapes);
+    n_shapes = PyTuple_GET_SIZE(shapes);
+    templates = PyList_New(n_shapes);
+    result = PyList_New(n);
+    if (templates == NULL || result == NULL)
+        goto fail;
+
+    if (PyTuple_GET_SIZE(refs) > 0) {
+        /* all structs first, values can refer to later rows */
+        for (i = 0; i < n; i++) {
+            shape = row_shape(row_shapes, n_shapes, i);
+            if (shape == -2)
+                goto fail;
+            if (shape == -1)
+                continue;
+            item = new_shaped_struct(templates, shape,
+                                     PyTuple_GET_ITEM(shapes, shape));
+            if (item == NULL)
+                goto fail;
+            PyList_SET_ITEM(result, i, item);
+        }
+    }
+    for (j = 0; j < PyTuple_GET_SIZE(refs); j += 2) {
+        pos = PyLong_AsSsize_t(PyTuple_GET_ITEM(refs, j));
+        if (pos == -1 && PyErr_Occurred())
+            goto fail;
+        row = PyLong_AsSsize_t(PyTuple_GET_ITEM(refs, j + 1));
+        if (row == -1 && PyErr_Occurred())
+            goto fail;
+        /* only structs that are rows of their own can be referred to */
+        if (pos < 0 || pos >= PyList_GET_SIZE(values) || row < 0 || row >= n
+                || PyList_GET_ITEM(result, row) == NULL)
+            goto bad_data;
+        item = PyList_GET_ITEM(result, row);
+        Py_INCREF(item);
+        PyList_SetItem(values, pos, item);
+    }
+
+    for (i = pos = 0; i < n; i++) {
+        shape = row_shape(row_shapes, n_shapes, i);
+        if (shape == -2)
+            goto fail;
+        if (shape == -1) {
+            if (pos >= PyList_GET_SIZE(values))
+                goto bad_data;
+            item = PyList_GET_ITEM(values, pos++);
+            Py_INCREF(item);
+            PyList_SET_ITEM(result, i, item);
+            continue;
+        }
+        type_and_keys = PyTuple_GET_ITEM(shapes, shape);
+        keys = PyTuple_GET_ITEM(type_and_keys, 1);
+        if (pos + PyTuple_GET_SIZE(keys) > PyList_GET_SIZE(values))
+            goto bad_data;
+        item = PyList_GET_ITEM(result, i);
+        if (item == NULL) {
+            item = new_shaped_struct(templates, shape, type_and_keys);
+            if (item == NULL)
+                goto fail;
+            PyList_SET_ITEM(result, i, item);
+        }
+        for (j = 0; j < PyTuple_GET_SIZE(keys); j++) {
+            if (PyDict_SetItem(item, PyTuple_GET_ITEM(keys, j),
+                               PyList_GET_ITEM(values, pos++)) < 0)
+                goto fail;
+        }
+    }
+    if (pos != PyList_GET_SIZE(values))
+        goto bad_data;
+    goto done;
+
+bad_data:
+    PyErr_SetString(PyExc_ValueError, BAD_PACKED_DATA);
+fail:
+    Py_CLEAR(result);
+done:
+    Py_XDECREF(row_shapes);
+    Py_XDECREF(shapes);
+    Py_XDECREF(values);
+    Py_XDECREF(refs);
+    Py_XDECREF(templates);
+    return result;
+}
+
+
+PyDoc_STRVAR(struct_hash_doc,
+"struct_hash(d) -> int\n"
+"\n"
+"The hash of frozen structs: `hash(frozenset(d.items()))`, computed in one\n"
+"pass over the dict without building the set or the item tuples.\n"
+);
+
+
+static PyObject *
+struct_hash_function(PyObject *module, PyObject *d)
+{
+    Py_hash_t hash;
+
+    if (!PyDict_Check(d)) {
+        PyErr_SetString(PyExc_TypeError, "struct_hash expected a dict");
+        return NULL;
+    }
+    hash = struct_hash(d);
+    if (hash == -1)
+        return NULL;
+    return PyLong_FromSsize_t(hash);
+}
+
+
+static PyMethodDef module_methods[] = {
+    {"merged", (PyCFunction)(void(*)(void))merged,
+        METH_VARARGS | METH_KEYWORDS, merged_doc},
+    {"deep_merged", (PyCFunction)(void(*)(void))deep_merged,
+        METH_VARARGS | METH_KEYWORDS, deep_merged_doc},
+    {"convert", (PyCFunction)(void(*)(void))convert_function,
+        METH_VARARGS | METH_KEYWORDS, convert_doc},
+    {"diff", (PyCFunction)diff_function, METH_VARARGS, diff_doc},
+    {"freeze", (PyCFunction)freeze_function, METH_VARARGS, freeze_doc},
+    {"object_hook", (PyCFunction)object_hook, METH_O, object_hook_doc},
+    {"pack_structs", (PyCFunction)pack_structs, METH_O, pack_structs_doc},
+    {"set_access_stats", (PyCFunction)set_access_stats, METH_VARARGS,
+        set_access_stats_doc},
+    {"struct_hash", (PyCFunction)struct_hash_function, METH_O,
+        struct_hash_doc},
+    {"thaw", (PyCFunction)thaw_function, METH_VARARGS, thaw_doc},
+    {"unpack_structs", (PyCFunction)unpack_structs, METH_VARARGS,
+        unpack_structs_doc},
+    {NULL, NULL},
+};
+
+
+static int
+basestruct_exec(PyObject *m)
+{
+    PyObject *o, *bases, *frozen, *defaultstruct;
+
+    empty_tuple = PyTuple_New(0);
+    if (empty_tuple == NULL)
+        goto fail;
+    str___missing__ = PyUnicode_InternFromString("__missing__");
+    str_hits = PyUnicode_InternFromString("hits");
+    str_misses = PyUnicode_InternFromString("misses");
+    str_missing = PyUnicode_InternFromString("missing");
+    str_shadowed = PyUnicode_InternFromString("shadowed");
+    str___name__ = PyUnicode_InternFromString("__name__");
+    str_empty = PyUnicode_InternFromString("");
+    str_open = PyUnicode_InternFromString("(");
+    str_close = PyUnicode_InternFromString(")");
+    str_equals = PyUnicode_InternFromString("=");
+    str_separator = PyUnicode_InternFromString(", ");
+    str__schema = PyUnicode_InternFromString("_schema");
+    str__hash = PyUnicode_InternFromString("_hash");
+    str___deepcopy__ = PyUnicode_InternFromString("__deepcopy__");
+    str___setstate__ = PyUnicode_InternFromString("__setstate__");
+    if (str_hits == NULL || str_misses == NULL || str_missing == NULL
+            || str_shadowed == NULL)
+        goto fail;
+    if (str___deepcopy__ == NULL || str___setstate__ == NULL || str__hash == NULL || str__schema == NULL || str___missing__ == NULL || str___name__ == NULL || str_empty == NULL
+            || str_open == NULL || str_close == NULL || str_equals == NULL
+            || str_separator == NULL)
+        goto fail;
+
+    o = PyDict_New();
+    if (o == NULL)
+        goto fail;
+    untracks_dicts = !PyObject_GC_IsTracked(o);
+    Py_DECREF(o);
+
+    /* some members must be initialized at runtime,
+       because they're not compile-time constants
+     */
+    StructType_slots[1].pfunc = &PyDict_Type;
+    StructType_slots[2].pfunc = PyDict_Type.tp_dealloc;
+    StructType_slots[3].pfunc = PyDict_Type.tp_hash;
+    StructType_slots[4].pfunc = PyDict_Type.tp_traverse;
+    StructType_slots[5].pfunc = PyDict_Type.tp_clear;
+    StructType_slots[6].pfunc = PyDict_Type.tp_richcompare;
+
+    o = PyType_FromSpec(&StructType_spec);
+    if (o == NULL)
+        goto fail;
+    /* emulate more closely "real" heap types */
+    ((PyTypeObject *)o)->tp_name = "Struct";
+    ((PyTypeObject *)o)->tp_vectorcall = Struct_vectorcall;
+
+    FrozenStructType_slots[4].pfunc = PyDict_Type.tp_traverse;
+    FrozenStructType_slots[5].pfunc = PyDict_Type.tp_clear;
+
+    /* a single base type is only accepted from 3.10 */
+    bases = PyTuple_Pack(1, o);
+    if (bases == NULL) {
+        Py_DECREF(o);
+        goto fail;
+    }
+    frozen = PyType_FromSpecWithBases(&FrozenStructType_spec, bases);
+    if (frozen == NULL) {
+        Py_DECREF(bases);
+        Py_DECREF(o);
+        goto fail;
+    }
+    ((PyTypeObject *)frozen)->tp_name = "FrozenStruct";
+    ((PyTypeObject *)frozen)->tp_vectorcall = Struct_vectorcall;
+    /* borrowed, the types are never freed */
+    Struct_deepcopy_descr = PyDict_GetItem(((PyTypeObject *)o)->tp_dict, str___deepcopy__);
+    FrozenStruct_deepcopy_descr = PyDict_GetItem(((PyTypeObject *)frozen)->tp_dict, str___deepcopy__);
+    FrozenStructType = (PyTypeObject *)frozen;
+    Py_INCREF(FrozenStructType);
+
+    defaultstruct = PyType_FromSpecWithBases(&DefaultStructType_spec, bases);
+    Py_DECREF(bases);
+    if (defaultstruct == NULL) {
+        Py_DECREF(o);
+        Py_DECREF(frozen);
+        goto fail;
+    }
+    ((PyTypeObject *)defaultstruct)->tp_name = "DefaultStruct";
+    DefaultStructType = (PyTypeObject *)defaultstruct;
+    Py_INCREF(DefaultStructType);
+
+    SchemaStructType = (PyTypeObject *)PyType_FromSpec(&SchemaStructType_spec);
+    if (SchemaStructType == NULL) {
+        Py_DECREF(o);
+        Py_DECREF(frozen);
+        Py_DECREF(defaultstruct);
+        goto fail;
+    }
+    Py_INCREF(SchemaStructType);
+
+    ObjectHookType = (PyTypeObject *)PyType_FromSpec(&ObjectHookType_spec);
+    if (ObjectHookType == NULL) {
+        Py_DECREF(o);
+        Py_DECREF(frozen);
+        Py_DECREF(defaultstruct);
+        goto fail;
+    }
+
+    RowIteratorType = (PyTypeObject *)PyType_FromSpec(&RowIteratorType_spec);
+    if (RowIteratorType == NULL) {
+        Py_DECREF(o);
+        Py_DECREF(frozen);
+        Py_DECREF(defaultstruct);
+        goto fail;
+    }
+
+    PathType = (PyTypeObject *)PyType_FromSpec(&PathType_spec);
+    ProjectionType = (PyTypeObject *)PyType_FromSpec(&ProjectionType_spec);
+    if (PathType == NULL || ProjectionType == NULL) {
+        Py_DECREF(o);
+        Py_DECREF(frozen);
+        Py_DECREF(defaultstruct);
+        goto fail;
+    }
+
+    PyModule_AddObject(m, "_Struct", o);
+    PyModule_AddObject(m, "_FrozenStruct", frozen);
+    PyModule_AddObject(m, "_DefaultStruct", defaultstruct);
+    PyModule_AddObject(m, "_SchemaStruct", (PyObject *)SchemaStructType);
+    Py_INCREF(PathType);
+    PyModule_AddObject(m, "_Path", (PyObject *)PathType);
+    Py_INCREF(ProjectionType);
+    PyModule_AddObject(m, "_Projection", (PyObject *)ProjectionType);
+
+    return 0;
+fail:
+    return -1;
+}
+
+
+static PyModuleDef_Slot basestruct_slots[] = {
+    {Py_mod_exec, basestruct_exec},
+#ifdef Py_mod_gil
+    /* shared state is only touched under critical sections */
+    {Py_mod_gil, Py_MOD_GIL_NOT_USED},
+#endif
+    {0, NULL},
+};
+
+
+static struct PyModuleDef moduledef = {
+    PyModuleDef_HEAD_INIT,
+    .m_name = "_cstruct",
+    .m_doc = "",
+    .m_methods = module_methods,
+    .m_slots = basestruct_slots,
+};
 
-    m = Py_InitModule("tri_struct._cstruct", NULL);
-    if (m == NULL)
-        return;
 
-    if (basestruct_exec(m) < 0)
-        Py_DECREF(m);
+PyMODINIT_FUNC
+PyInit__cstruct(void)
+{
+    return PyModuleDef_Init(&moduledef);
 }
-#endif // !PY_MAJOR_VERSION >= 3
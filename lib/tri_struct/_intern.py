@@ -0,0 +1,74 @@
+"""
+Canonical instances of equal frozen structs, see `InternTable`.
+"""
+import weakref
+
+
+class InternTable(object):
+    """
+    A table of canonical frozen structs. Interning an equal struct again gives
+    back the first instance, so equal values share memory and compare by
+    identity. The table only holds weak references: a canonical instance goes
+    away with its last user.
+
+    .. code-block:: python
+
+        >>> a = intern_table.intern(FrozenStruct(read=True, write=False))
+        >>> b = intern_table.intern(FrozenStruct(read=True, write=False))
+        >>> a is b
+        True
+
+    Entries are keyed on the type and the cached hash. If a different struct
+    with the same type and hash is already in the table, the new one is
+    returned as it is and counted as a collision.
+    """
+
+    def __init__(self):
+        self._table = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    def intern(self, s, struct_type=None):
+        """
+        The canonical instance equal to `s`. With `struct_type`, `s` is first
+        converted to that type unless it already is one.
+        """
+        if struct_type is not None and not isinstance(s, struct_type):
+            s = struct_type(s)
+        if not isinstance(s, dict) or type(s).__hash__ is None:
+            raise TypeError('only frozen structs can be interned, not %s' % type(s).__name__)
+
+        key = (type(s), hash(s))
+        canonical = self._table.get(key)
+        if canonical is None:
+            self._table[key] = s
+            self.misses += 1
+            return s
+        if canonical is s or dict.__eq__(canonical, s):
+            self.hits += 1
+            return canonical
+        self.collisions += 1
+        return s
+
+    def stats(self):
+        """
+        A dict with the number of `hits`, `misses` and `collisions` so far and
+        the current `size` of the table.
+        """
+        return dict(hits=self.hits, misses=self.misses, collisions=self.collisions, size=len(self))
+
+    def clear(self):
+        """
+        Forget all canonical instances and reset the statistics.
+        """
+        self._table.clear()
+        self.hits = self.misses = self.collisions = 0
+
+    def __len__(self):
+        return len(self._table)
+
+
+intern_table = InternTable()
+
+InternTable.__module__ = 'tri_struct'
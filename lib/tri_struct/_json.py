@@ -0,0 +1,84 @@
+"""
+Decode JSON straight into structs, see `loads_json` and `iter_json_lines`.
+"""
+import json
+
+from ._backend import Struct
+
+try:
+    from ._cstruct import object_hook
+except ImportError:  # pragma: no cover
+    object_hook = None
+
+
+def py_object_hook(struct_type):
+    """
+    Python version of the c `object_hook`: an `object_hook` for the json module
+    that makes `struct_type` instances of the decoded objects.
+    """
+    def hook(d):
+        result = struct_type()
+        dict.update(result, d)
+        return result
+
+    return hook
+
+
+if object_hook is None:  # pragma: no cover
+    object_hook = py_object_hook
+
+
+def _hook(struct_type, kwargs):
+    for name in ('object_hook', 'object_pairs_hook'):
+        if name in kwargs:
+            raise TypeError('%s can not be combined with struct_type, which sets the object hook' % name)
+    return object_hook(struct_type)
+
+
+def _decoder(struct_type, kwargs):
+    return json.JSONDecoder(object_hook=_hook(struct_type, kwargs), **kwargs)
+
+
+def loads_json(s, struct_type=Struct, **kwargs):
+    """
+    Like `json.loads`, but JSON objects become `struct_type` instances,
+    through an object hook that is written in c when the extension is
+    built.
+
+    .. code-block:: python
+
+        >>> loads_json('{"a": {"b": 1}}').a.b
+        1
+
+    Other keyword arguments are passed on to `json.JSONDecoder`, except
+    `object_hook` and `object_pairs_hook`, which raise TypeError.
+    """
+    if isinstance(s, (bytes, bytearray)):
+        return json.loads(s, object_hook=_hook(struct_type, kwargs), **kwargs)
+    return _decoder(struct_type, kwargs).decode(s)
+
+
+def iter_json_lines(source, struct_type=Struct, **kwargs):
+    """
+    Decode JSON-lines, one document per line, from a text or binary file
+    object, an `mmap` or anything else with a `readline` method. Blank lines
+    are skipped. Lines are read one at a time, so this works on files that
+    are much larger than memory.
+
+    .. code-block:: python
+
+        with open('events.jsonl', 'rb') as f:
+            for event in iter_json_lines(f):
+                ...
+
+    """
+    decode = _decoder(struct_type, kwargs).decode
+    readline = source.readline
+    while True:
+        line = readline()
+        if not line:
+            return
+        if not isinstance(line, str):
+            line = line.decode('utf-8')
+        if line.strip():
+            yield decode(line)
@@ -0,0 +1,307 @@
+"""
+A Struct with values that are computed when they are first read, see
+`LazyStruct`.
+"""
+from collections.abc import KeysView
+
+from ._backend import Struct
+
+_MISSING = object()
+
+# over all lazy structs, per key only for the first _MAX_COUNTED_KEYS keys,
+# so that structs with generated keys don't grow the counts without bound
+_MAX_COUNTED_KEYS = 1024
+_totals = dict(created=0, evaluated=0)
+_created = {}
+_evaluated = {}
+
+
+def _count_created(key):
+    _totals['created'] += 1
+    if key in _created or len(_created) < _MAX_COUNTED_KEYS:
+        _created[key] = _created.get(key, 0) + 1
+
+
+def _count_evaluated(key):
+    _totals['evaluated'] += 1
+    if key in _created:
+        _evaluated[key] = _evaluated.get(key, 0) + 1
+
+
+def _all_keys(self):
+    return list(dict.keys(self)) + list(_get_thunks(self))
+
+
+class _LazyKeys(KeysView):
+    """
+    The keys of a `LazyStruct`, with and without a value, like `dict.keys`.
+    """
+    __slots__ = ()
+
+    def __reversed__(self):
+        return reversed(_all_keys(self._mapping))
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, _all_keys(self._mapping))
+
+
+class _LazyMissing(KeyError, AttributeError):
+    """
+    `__missing__` is called for missing items as well as for missing
+    attributes, so a key without a value or a thunk is both.
+    """
+
+
+class LazyStruct(Struct):
+    """
+    A Struct whose values are given as thunks, callables without arguments,
+    that are called when the key is first read as an attribute or an item.
+    The result is stored in place of the thunk, so every thunk runs at most
+    once.
+
+    .. code-block:: python
+
+        >>> context = LazyStruct(user=lambda: fetch_user(user_id), menu=render_menu)
+        >>> context.user.name  # runs fetch_user, but not render_menu
+        'Alice'
+        >>> context
+        LazyStruct(menu=<lazy>, user=Struct(name='Alice'))
+
+    Values that aren't callable are stored as they are, so `merged` and
+    friends work on lazy structs too. To store a callable as a value,
+    assign it after construction.
+
+    Keys, `len`, `in` and iteration over the keys don't evaluate anything,
+    neither does `repr`. `items()` and `values()` evaluate all thunks first,
+    unless called with `evaluate=False`, and `force()` evaluates them
+    explicitly. Assigned values are stored as they are, and replace a thunk
+    that hasn't run yet.
+
+    Code that reads the dict directly, like `freeze`, only sees the values
+    that are computed already: call `force()` first. When threads read the
+    same key for the first time at once, the thunk can run more than once,
+    the first result is kept.
+    """
+    __slots__ = ('_thunks',)
+
+    def __init__(self, *args, **kwargs):
+        thunks = {}
+        for key, value in dict(*args, **kwargs).items():
+            if callable(value):
+                thunks[key] = value
+                _count_created(key)
+            else:
+                dict.__setitem__(self, key, value)
+        _set_thunks(self, thunks)
+
+    def __missing__(self, key):
+        thunks = _get_thunks(self)
+        thunk = thunks.get(key)
+        if thunk is None:
+            # another thread may have evaluated it since the lookup
+            value = dict.get(self, key, _MISSING)
+            if value is _MISSING:
+                raise _LazyMissing(key)
+            return value
+        value = dict.setdefault(self, key, thunk())
+        thunks.pop(key, None)
+        _count_evaluated(key)
+        return value
+
+    def force(self, *keys):
+        """
+        Evaluate the thunks of `keys`, or all thunks that haven't run yet.
+        """
+        for key in keys or list(_get_thunks(self)):
+            if not dict.__contains__(self, key):
+                self.__missing__(key)
+
+    def pending(self):
+        """
+        The keys whose thunks haven't run yet.
+        """
+        return list(_get_thunks(self))
+
+    def get(self, key, default=None):
+        value = dict.get(self, key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if key in _get_thunks(self):
+            return self.__missing__(key)
+        return default
+
+    def __setitem__(self, key, value):
+        _get_thunks(self).pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    __setattr__ = __setitem__
+
+    def __delitem__(self, key):
+        if _get_thunks(self).pop(key, _MISSING) is _MISSING:
+            dict.__delitem__(self, key)
+
+    def __delattr__(self, key):
+        try:
+            del self[key]
+        except KeyError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, key))
+
+    def __len__(self):
+        return dict.__len__(self) + len(_get_thunks(self))
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in _get_thunks(self)
+
+    def __iter__(self):
+        # a copy, reading the values while iterating moves keys around
+        return iter(_all_keys(self))
+
+    def __reversed__(self):
+        return reversed(_all_keys(self))
+
+    def keys(self):
+        """
+        A view of all keys, the ones with a value first, without evaluating
+        anything.
+        """
+        return _LazyKeys(self)
+
+    def values(self, evaluate=True):
+        """
+        Like `dict.values`, after evaluating all thunks. With
+        `evaluate=False`, only the values that are computed already.
+        """
+        if evaluate:
+            self.force()
+        return dict.values(self)
+
+    def items(self, evaluate=True):
+        """
+        Like `dict.items`, after evaluating all thunks. With
+        `evaluate=False`, only the keys that have a value already.
+        """
+        if evaluate:
+            self.force()
+        return dict.items(self)
+
+    def pop(self, key, default=_MISSING):
+        if key in _get_thunks(self):
+            self.force(key)
+        if default is _MISSING:
+            return dict.pop(self, key)
+        return dict.pop(self, key, default)
+
+    def popitem(self):
+        thunks = _get_thunks(self)
+        if not dict.__len__(self) and thunks:
+            self.force(next(reversed(list(thunks))))
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        if key in _get_thunks(self):
+            return self.__missing__(key)
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        _get_thunks(self).clear()
+        dict.clear(self)
+
+    def __eq__(self, other):
+        self.force()
+        if isinstance(other, LazyStruct):
+            other.force()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        pieces = {
+            key: repr(value) if value is not self else '%s(...)' % type(self).__name__
+            for key, value in dict.items(self)
+        }
+        pieces.update((key, '<lazy>') for key in _get_thunks(self))
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%s' % item for item in sorted(pieces.items())))
+
+    __str__ = __repr__
+
+    def copy(self):
+        """
+        A copy with the same values and the same thunks. A thunk that is
+        still pending in both runs once for each of them.
+        """
+        result = type(self).__new__(type(self))
+        thunks = dict(_get_thunks(self))
+        for key in thunks:
+            _count_created(key)
+        _set_thunks(result, thunks)
+        dict.update(result, dict.items(self))
+        return result
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        # the values are copied, the thunks are shared
+        from copy import deepcopy
+        result = self.copy()
+        memo[id(self)] = result
+        for k, v in dict.items(self):
+            dict.__setitem__(result, k, deepcopy(v, memo))
+        return result
+
+    def __reduce__(self):
+        # thunks can't be pickled, their values can
+        return type(self), (), None, None, iter(self.items())
+
+    @staticmethod
+    def thunk_counts():
+        """
+        How many thunks were given to lazy structs and how many of them
+        ran, in total and per key, since the last `reset_thunk_counts`. Keys
+        that are mostly created and rarely evaluated are the ones that
+        laziness saves work on. Only the first 1024 keys are counted one by
+        one, all of them are in the totals.
+
+        .. code-block:: python
+
+            >>> LazyStruct.thunk_counts()
+            Struct(created=2, evaluated=1, keys={'menu': Struct(created=1, evaluated=0), 'user': Struct(created=1, evaluated=1)})
+
+        """
+        keys = {
+            key: Struct(created=created, evaluated=_evaluated.get(key, 0))
+            for key, created in list(_created.items())
+        }
+        return Struct(
+            created=_totals['created'],
+            evaluated=_totals['evaluated'],
+            keys=keys,
+        )
+
+    @staticmethod
+    def reset_thunk_counts():
+        """
+        Set the counts of `thunk_counts` back to zero.
+        """
+        _totals.update(created=0, evaluated=0)
+        _created.clear()
+        _evaluated.clear()
+
+
+_get_thunks = LazyStruct.__dict__['_thunks'].__get__
+# not `object.__setattr__`, which the c Struct doesn't allow
+_set_thunks = LazyStruct.__dict__['_thunks'].__set__
+
+LazyStruct.__module__ = 'tri_struct'
@@ -0,0 +1,138 @@
+"""
+Compiled accessors for values deep in nested structs, see `path` and
+`project`.
+"""
+import functools
+import sys
+from collections.abc import Mapping
+
+from ._backend import Struct
+
+try:
+    from ._cstruct import _Path, _Projection
+except ImportError:  # pragma: no cover
+    _Path = _Projection = None
+
+
+_MISSING = object()
+
+
+class PyPath(object):
+    """
+    Python version of the c path type: the value at `keys` in nested data,
+    or `default` if a level is missing.
+    """
+    __slots__ = ('keys', 'default')
+
+    def __init__(self, keys, default=None):
+        self.keys = keys
+        self.default = default
+
+    def __call__(self, obj):
+        for key in self.keys:
+            if isinstance(obj, dict):
+                obj = dict.get(obj, key, _MISSING)
+            elif type(key) is str:
+                obj = getattr(obj, key, _MISSING)
+            else:
+                return self.default
+            if obj is _MISSING:
+                return self.default
+        return obj
+
+    def map(self, iterable):
+        return [self(obj) for obj in iterable]
+
+    def __repr__(self):
+        return 'path(%r, default=%r)' % (self.keys, self.default)
+
+
+class PyProjection(object):
+    """
+    Python version of the c projection type: the values of several paths,
+    as a tuple, or as a `struct_type` with `names` as the keys.
+    """
+    __slots__ = ('paths', 'names', 'struct_type')
+
+    def __init__(self, paths, names, struct_type):
+        self.paths = paths
+        self.names = names
+        self.struct_type = struct_type
+
+    def __call__(self, obj):
+        values = tuple(path(obj) for path in self.paths)
+        if self.names is None:
+            return values
+        result = self.struct_type()
+        dict.update(result, zip(self.names, values))
+        return result
+
+    def map(self, iterable):
+        return [self(obj) for obj in iterable]
+
+
+if _Path is None:  # pragma: no cover
+    _Path, _Projection = PyPath, PyProjection
+
+
+def _keys(spec):
+    if isinstance(spec, str):
+        return tuple(sys.intern(key) for key in spec.split('.'))
+    return tuple(spec)
+
+
+# bounded, specs and defaults can be made anew for every call. Typed, as
+# 1 == True.
+@functools.lru_cache(maxsize=1024, typed=True)
+def _cached_path(spec, default):
+    return _Path(_keys(spec), default)
+
+
+def path(spec, default=None):
+    """
+    A compiled accessor for the value at a dotted path in nested structs,
+    for `row.customer.address.city` without the try/except around it.
+
+    .. code-block:: python
+
+        >>> city = path('customer.address.city')
+        >>> city(Struct(customer=Struct(address=Struct(city='Paris'))))
+        'Paris'
+        >>> city(Struct(customer=None)) is None
+        True
+        >>> city.map(rows)
+        ['Paris', ...]
+
+    Dicts are followed by key, without calling `__missing__`, and any other
+    object by attribute. If a level is missing, the accessor returns
+    `default`. `spec` can also be a sequence of keys, for keys that aren't
+    strings or that contain dots. The accessors used last are cached, so
+    `path` can be called where the accessor is used.
+    """
+    try:
+        return _cached_path(spec, default)
+    except TypeError:
+        # unhashable, like a list of keys or a default of []
+        return _Path(_keys(spec), default)
+
+
+def project(paths, default=None, struct_type=Struct):
+    """
+    A compiled accessor for the values at several paths at once. For a
+    sequence of paths it returns tuples, for a mapping from names to paths
+    new `struct_type` instances with those names as keys.
+
+    .. code-block:: python
+
+        >>> project(['id', 'customer.name'])(order)
+        (17, 'Alice')
+        >>> project(dict(id='id', customer='customer.name')).map(orders)
+        [Struct(customer='Alice', id=17), ...]
+
+    The paths are the same as for `path`, with `default` for all of them.
+    """
+    if isinstance(paths, Mapping):
+        names, specs = tuple(paths), paths.values()
+    else:
+        names, specs = None, paths
+    return _Projection(tuple(path(spec, default) for spec in specs), names, struct_type)
@@ -0,0 +1,327 @@
+"""
+An immutable Struct with cheap updates, see `PersistentStruct`.
+
+The keys are kept in a hash array mapped trie, like the one behind
+`contextvars`: every node holds up to 32 entries, picked by five bits of the
+key hash at a time. An update copies the nodes on the path to the key, at
+most seven small tuples, and shares everything else with the original.
+"""
+from collections.abc import Mapping
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_MASK = 0xFFFFFFFF
+
+# marks a sub node in place of a key in `_BitmapNode.array`
+_NODE = object()
+_MISSING = object()
+
+
+def _hash(key):
+    return hash(key) & _HASH_MASK
+
+
+def _bit(h, shift):
+    return 1 << ((h >> shift) & _MASK)
+
+
+def _index(bitmap, bit):
+    return bin(bitmap & (bit - 1)).count('1')
+
+
+class _BitmapNode(object):
+    """
+    Up to 32 entries, as a flat tuple of `key, value` pairs. Keys that share
+    the same five hash bits at this level are moved to a sub node, stored as
+    `_NODE, node`.
+    """
+    __slots__ = ('bitmap', 'array')
+
+    def __init__(self, bitmap, array):
+        self.bitmap = bitmap
+        self.array = array
+
+
+class _CollisionNode(object):
+    """
+    Keys with the same full hash, as a flat tuple of `key, value` pairs.
+    """
+    __slots__ = ('hash', 'array')
+
+    def __init__(self, h, array):
+        self.hash = h
+        self.array = array
+
+
+_EMPTY = _BitmapNode(0, ())
+
+
+def _replaced(array, i, value):
+    return array[:i] + (value,) + array[i + 1:]
+
+
+def _get(node, h, key):
+    shift = 0
+    while True:
+        array = node.array
+        if type(node) is _CollisionNode:
+            for i in range(0, len(array), 2):
+                if array[i] is key or array[i] == key:
+                    return array[i + 1]
+            return _MISSING
+        bit = _bit(h, shift)
+        if not node.bitmap & bit:
+            return _MISSING
+        i = 2 * _index(node.bitmap, bit)
+        k = array[i]
+        if k is _NODE:
+            node = array[i + 1]
+            shift += _BITS
+        elif k is key or k == key:
+            return array[i + 1]
+        else:
+            return _MISSING
+
+
+def _pair_node(shift, h1, k1, v1, h2, k2, v2):
+    if h1 == h2:
+        return _CollisionNode(h1, (k1, v1, k2, v2))
+    b1 = _bit(h1, shift)
+    b2 = _bit(h2, shift)
+    if b1 == b2:
+        return _BitmapNode(b1, (_NODE, _pair_node(shift + _BITS, h1, k1, v1, h2, k2, v2)))
+    if b1 < b2:
+        return _BitmapNode(b1 | b2, (k1, v1, k2, v2))
+    return _BitmapNode(b1 | b2, (k2, v2, k1, v1))
+
+
+def _assoc(node, shift, h, key, value):
+    """
+    `node` with `key` set to `value`, and whether the key is new. Returns
+    `node` itself if nothing changed.
+    """
+    array = node.array
+    if type(node) is _CollisionNode:
+        if h != node.hash:
+            # make room for the new key next to the collisions
+            return _assoc(_BitmapNode(_bit(node.hash, shift), (_NODE, node)), shift, h, key, value)
+        for i in range(0, len(array), 2):
+            if array[i] is key or array[i] == key:
+                if array[i + 1] is value:
+                    return node, False
+                return _CollisionNode(h, _replaced(array, i + 1, value)), False
+        return _CollisionNode(h, array + (key, value)), True
+
+    bit = _bit(h, shift)
+    i = 2 * _index(node.bitmap, bit)
+    if not node.bitmap & bit:
+        return _BitmapNode(node.bitmap | bit, array[:i] + (key, value) + array[i:]), True
+
+    k, v = array[i], array[i + 1]
+    if k is _NODE:
+        sub, added = _assoc(v, shift + _BITS, h, key, value)
+        if sub is v:
+            return node, False
+        return _BitmapNode(node.bitmap, _replaced(array, i + 1, sub)), added
+    if k is key or k == key:
+        if v is value:
+            return node, False
+        return _BitmapNode(node.bitmap, _replaced(array, i + 1, value)), False
+
+    sub = _pair_node(shift + _BITS, _hash(k), k, v, h, key, value)
+    return _BitmapNode(node.bitmap, array[:i] + (_NODE, sub) + array[i + 2:]), True
+
+
+def _without(node, shift, h, key):
+    """
+    `node` without `key`, or None if that leaves it empty. Raises KeyError
+    if `key` isn't there.
+    """
+    array = node.array
+    if type(node) is _CollisionNode:
+        for i in range(0, len(array), 2):
+            if array[i] is key or array[i] == key:
+                rest = array[:i] + array[i + 2:]
+                if len(rest) == 2:
+                    # a single key is kept inline in the parent
+                    return _BitmapNode(_bit(h, shift), rest)
+                return _CollisionNode(h, rest)
+        raise KeyError(key)
+
+    bit = _bit(h, shift)
+    if not node.bitmap & bit:
+        raise KeyError(key)
+    i = 2 * _index(node.bitmap, bit)
+    k, v = array[i], array[i + 1]
+    if k is _NODE:
+        sub = _without(v, shift + _BITS, h, key)
+        if sub is not None:
+            if type(sub) is _BitmapNode and len(sub.array) == 2 and sub.array[0] is not _NODE:
+                # pull a lone key up into this node
+                return _BitmapNode(node.bitmap, array[:i] + sub.array + array[i + 2:])
+            return _BitmapNode(node.bitmap, _replaced(array, i + 1, sub))
+    elif not (k is key or k == key):
+        raise KeyError(key)
+
+    if node.bitmap == bit:
+        return None
+    return _BitmapNode(node.bitmap ^ bit, array[:i] + array[i + 2:])
+
+
+def _iter_items(node):
+    array = node.array
+    for i in range(0, len(array), 2):
+        if array[i] is _NODE:
+            for item in _iter_items(array[i + 1]):
+                yield item
+        else:
+            yield array[i], array[i + 1]
+
+
+def _cached_hash(s):
+    try:
+        return object.__getattribute__(s, '_hash')
+    except AttributeError:
+        return None
+
+
+class PersistentStruct(Mapping):
+    """
+    An immutable Struct for large structs that change a few keys at a time.
+    `evolve` makes an updated copy in O(log n) that shares almost all of its
+    memory with the original, where `merged(frozen_struct, key=value)` copies
+    every key.
+
+    .. code-block:: python
+
+        >>> config = PersistentStruct(host='localhost', port=80)
+        >>> config.evolve(port=8080)
+        PersistentStruct(host='localhost', port=8080)
+        >>> config.port
+        80
+
+    Keys are read as items or attributes, although keys that have the name of
+    a method, like `items`, are only reachable as items. It hashes and
+    compares like a `FrozenStruct` with the same contents.
+    """
+
+    __slots__ = ('_root', '_size', '_hash')
+
+    def __init__(self, *args, **kwargs):
+        root, size = _EMPTY, 0
+        for key, value in dict(*args, **kwargs).items():
+            root, added = _assoc(root, 0, _hash(key), key, value)
+            size += added
+        object.__setattr__(self, '_root', root)
+        object.__setattr__(self, '_size', size)
+
+    @classmethod
+    def _make(cls, root, size):
+        result = object.__new__(cls)
+        object.__setattr__(result, '_root', root)
+        object.__setattr__(result, '_size', size)
+        return result
+
+    def evolve(self, *args, **changes):
+        """
+        A copy with the keys from the arguments set, which take the same
+        arguments as `dict.update`.
+        """
+        root, size = self._root, self._size
+        for key, value in dict(*args, **changes).items():
+            root, added = _assoc(root, 0, _hash(key), key, value)
+            size += added
+        if root is self._root:
+            return self
+        return self._make(root, size)
+
+    def without(self, *keys):
+        """
+        A copy without `keys`. Raises KeyError for keys that aren't there.
+        """
+        root, size = self._root, self._size
+        for key in keys:
+            root = _without(root, 0, _hash(key), key) or _EMPTY
+            size -= 1
+        if root is self._root:
+            return self
+        return self._make(root, size)
+
+    def __getitem__(self, key):
+        value = _get(self._root, _hash(key), key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = _get(self._root, _hash(key), key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        return _get(self._root, _hash(key), key) is not _MISSING
+
+    def __getattr__(self, item):
+        value = _get(object.__getattribute__(self, '_root'), _hash(item), item)
+        if value is _MISSING:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, item))
+        return value
+
+    def __setattr__(self, key, value):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__,))
+
+    def __delattr__(self, key):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__,))
+
+    def __iter__(self):
+        for key, _ in _iter_items(self._root):
+            yield key
+
+    def __len__(self):
+        return self._size
+
+    def items(self):
+        return list(_iter_items(self._root))
+
+    def __hash__(self):
+        try:
+            return object.__getattribute__(self, '_hash')
+        except AttributeError:
+            _hash = hash(frozenset(_iter_items(self._root)))
+            object.__setattr__(self, '_hash', _hash)
+            return _hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        if len(other) != self._size:
+            return False
+        if isinstance(other, PersistentStruct):
+            # equal structs have equal hashes
+            self_hash, other_hash = _cached_hash(self), _cached_hash(other)
+            if self_hash is not None and other_hash is not None and self_hash != other_hash:
+                return False
+        for key, value in _iter_items(self._root):
+            other_value = other.get(key, _MISSING)
+            if other_value is _MISSING or not (other_value is value or other_value == value):
+                return False
+        return True
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % item for item in sorted(self.items())))
+
+    __str__ = __repr__
+
+    def __reduce__(self):
+        return type(self), (dict(_iter_items(self._root)),)
+
+    def __copy__(self):
+        return self
+
+
+PersistentStruct.__module__ = 'tri_struct'
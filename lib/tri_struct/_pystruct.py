@@ -1,3 +1,16 @@
+import sys
+
+from ._intern import intern_table
+
+try:
+    from ._cstruct import struct_hash as _struct_hash
+except ImportError:  # pragma: no cover
+    _struct_hash = None
+
+_dict_get = dict.get
+_MISSING = object()
+
+
 class Struct(dict):
     """
     Struct is a dict that can be accessed like an object. It also has a predictable repr so it can be used in tests for example.
@@ -37,18 +50,25 @@ class Struct(dict):
     __str__ = __repr__
 
     def __getattribute__(self, item):
-        if not dict.__contains__(self, item):
-            try:
-                return object.__getattribute__(self, item)
-            except AttributeError as e:
-                try:
-                    missing_ = object.__getattribute__(self, '__missing__')
-                except AttributeError:
-                    pass
-                else:
-                    return missing_.__get__(self)(item)
-                raise e
-        return dict.__getitem__(self, item)
+        value = _dict_get(self, item, _MISSING)
+        if value is not _MISSING:
+            return value
+        try:
+            return object.__getattribute__(self, item)
+        except AttributeError:
+            # cheap check first, only bind `__missing__` if there is one
+            if getattr(type(self), '__missing__', None) is None:
+                raise
+        return object.__getattribute__(self, '__missing__')(item)
+
+    def get_attr(self, name, default=None):
+        """
+        Like `getattr(self, name, default)`, but faster for keys.
+        """
+        value = _dict_get(self, name, _MISSING)
+        if value is not _MISSING:
+            return value
+        return getattr(self, name, default)
 
     def __setattr__(self, key, value):
         self[key] = value
@@ -62,5 +82,200 @@ class Struct(dict):
     def copy(self):
         return type(self)(self)
 
+    @classmethod
+    def schema(cls, *keys, **kwargs):
+        """
+        A compact type for many structs with the same keys. The key table is
+        shared by all instances and the values are kept in an array, so an
+        instance takes about as much memory as a tuple. Keys outside the
+        schema can still be set, they are kept in an overflow dict.
+
+        .. code-block:: python
+
+            >>> Row = Struct.schema('id', 'name')
+            >>> Row(1, name='foo')
+            Struct(id=1, name='foo')
+
+        """
+        from ._schema import schema_type
+        return schema_type(*keys, **kwargs)
+
+    @classmethod
+    def from_rows(cls, keys, rows, lazy=False):
+        """
+        A struct of this type for every row of values in `rows`, with the
+        keys from `keys` in order. Like `[cls(zip(keys, row)) for row in
+        rows]`, but the keys are interned once. A row with more or fewer
+        values than there are keys raises ValueError. With `lazy`, an
+        iterator that builds the structs one at a time is returned instead,
+        for result sets that don't fit in memory.
+
+        .. code-block:: python
+
+            >>> Struct.from_rows(('id', 'name'), [(1, 'a'), (2, 'b')])
+            [Struct(id=1, name='a'), Struct(id=2, name='b')]
+
+        """
+        keys = tuple(sys.intern(key) if type(key) is str else key for key in keys)
+        structs = _structs_from_rows(cls, keys, iter(rows))
+        return structs if lazy else list(structs)
+
+
+def _structs_from_rows(struct_type, keys, rows):
+    for index, row in enumerate(rows):
+        if not isinstance(row, (tuple, list)):
+            row = tuple(row)
+        if len(row) != len(keys):
+            raise ValueError('row %d has %d values, expected %d' % (index, len(row), len(keys)))
+        result = struct_type()
+        dict.update(result, zip(keys, row))
+        yield result
+
+
+def py_struct_hash(d):
+    """
+    The hash of frozen structs. It doesn't depend on the order of the keys,
+    and the keys don't have to be comparable.
+    """
+    return hash(frozenset(d.items()))
+
+
+if _struct_hash is None:  # pragma: no cover
+    _struct_hash = py_struct_hash
+
+
+def _cached_hash(frozen):
+    try:
+        return dict.__getattribute__(frozen, '_hash')
+    except AttributeError:
+        return None
+
+
+def _set_cached_hash(frozen, _hash):
+    try:
+        dict.__setattr__(frozen, '_hash', _hash)
+    except TypeError:
+        # the c Struct has a `__setattr__` of its own, which the generic one
+        # refuses to skip: store through the `_hash` slot directly
+        type(frozen)._hash.__set__(frozen, _hash)
+
+
+class Frozen(object):
+    """
+    Mixin to create an immutable class.
+    """
+
+    __slots__ = ()
+
+    def __hash__(self):
+        _hash = _cached_hash(self)
+        if _hash is None:
+            _hash = _struct_hash(self)
+            _set_cached_hash(self, _hash)
+        return _hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, Frozen):
+            # equal structs have equal hashes
+            self_hash, other_hash = _cached_hash(self), _cached_hash(other)
+            if self_hash is not None and other_hash is not None and self_hash != other_hash:
+                return False
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __setitem__(self, *_, **__):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+
+    def __setattr__(self, key, value):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__,))
+
+    def setdefault(self, *_, **__):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+
+    def update(self, *_, **__):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+
+    def clear(self, *_, **__):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+
+    def pop(self, *_, **__):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+
+    def popitem(self, *_, **__):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+
+    def __ior__(self, *_, **__):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+
+    def __delitem__(self, *_, **__):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__, ))
+
+    def __delattr__(self, *_, **__):
+        raise TypeError("'%s' object attributes are read-only" % (type(self).__name__,))
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+    def __setstate__(self, state):
+        dict.update(self, state)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @classmethod
+    def intern(cls, s):
+        """
+        The canonical instance of the frozen struct equal to `s`, from
+        `intern_table`. `s` is converted to `cls` first if it is some other
+        mapping.
+        """
+        return intern_table.intern(s, cls)
+
+
+Frozen.__module__ = 'tri_struct'
+
+
+class FrozenStruct(Frozen, Struct):
+    __slots__ = ('_hash', '__weakref__')
+
+
+class DefaultStruct(Struct):
+    __slots__ = ('_default_factory',)
+
+    def __init__(self, default_factory=None, *args, **kwargs):
+        if default_factory is None:
+            default_factory = DefaultStruct
+        object.__setattr__(self, '_default_factory', default_factory)
+        super(DefaultStruct, self).__init__(*args, **kwargs)
+
+    def __missing__(self, key):
+        default_factory = object.__getattribute__(self, '_default_factory')
+        self[key] = new = default_factory()
+        return new
+
+    def copy(self):
+        result = type(self).__new__(type(self))
+        object.__setattr__(result, '_default_factory', object.__getattribute__(self, '_default_factory'))
+        dict.update(result, self)
+        return result
+
+    def __reduce__(self):
+        return type(self), (object.__getattribute__(self, '_default_factory'),), None, None, iter(dict.items(self))
 
-Struct.__module__ = "tri_struct"
+    def __deepcopy__(self, memo):
+        # without this, copy.deepcopy would find `__deepcopy__` through `__missing__`
+        from copy import deepcopy
+        result = type(self).__new__(type(self))
+        object.__setattr__(result, '_default_factory', object.__getattribute__(self, '_default_factory'))
+        memo[id(self)] = result
+        for k, v in dict.items(self):
+            dict.__setitem__(result, deepcopy(k, memo), deepcopy(v, memo))
+        return result
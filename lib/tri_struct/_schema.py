@@ -0,0 +1,83 @@
+"""
+Compact Struct types for many records with the same keys, see `Struct.schema`.
+"""
+import sys
+import weakref
+from collections.abc import MutableMapping
+
+from ._pystruct import Struct
+
+try:
+    from ._cstruct import _SchemaStruct
+except ImportError:  # pragma: no cover
+    _SchemaStruct = None
+
+
+# a type stays cached for as long as it or one of its instances is in use
+_schema_types = weakref.WeakValueDictionary()
+
+
+class PySchemaStruct(Struct):
+    """
+    Fallback for schema types without the c extension: a plain `Struct`
+    that takes the schema keys as positional arguments.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values, **kwargs):
+        keys = type(self)._schema_keys
+        if len(values) > len(keys):
+            raise TypeError('%s() takes at most %d positional arguments (%d given)' % (type(self).__name__, len(keys), len(values)))
+        for key in keys[:len(values)]:
+            if key in kwargs:
+                raise TypeError("%s() got multiple values for argument '%s'" % (type(self).__name__, key))
+        super(PySchemaStruct, self).__init__(zip(keys, values), **kwargs)
+
+    def copy(self):
+        result = type(self)()
+        dict.update(result, self)
+        return result
+
+
+def _rebuild(name, keys):
+    return schema_type(*keys, name=name)()
+
+
+def _reduce(self):
+    cls = type(self)
+    return _rebuild, (cls.__name__, cls._schema_keys), None, None, iter(list(self.items()))
+
+
+def schema_type(*keys, **kwargs):
+    """
+    The type behind `Struct.schema`. Types are cached while they are in
+    use, the same keys and name give the same type.
+    """
+    name = kwargs.pop('name', 'Struct')
+    if kwargs:
+        raise TypeError('schema() got unexpected keyword arguments: %s' % ', '.join(sorted(kwargs)))
+
+    cache_key = (name, keys)
+    try:
+        return _schema_types[cache_key]
+    except KeyError:
+        pass
+
+    for key in keys:
+        if not isinstance(key, str):
+            raise TypeError('schema keys must be strings, not %r' % (key,))
+    if len(set(keys)) != len(keys):
+        raise ValueError('duplicate keys in schema: %r' % (keys,))
+
+    namespace = dict(
+        __slots__=(),
+        __module__='tri_struct',
+        __reduce__=_reduce,
+        _schema_keys=keys,
+    )
+    if _SchemaStruct is not None:
+        namespace['_schema'] = {sys.intern(key): i for i, key in enumerate(keys)}
+        bases = (_SchemaStruct, MutableMapping)
+    else:  # pragma: no cover
+        bases = (PySchemaStruct,)
+    return _schema_types.setdefault(cache_key, type(name, bases, namespace))
@@ -0,0 +1,141 @@
+"""
+Opt-in counters of how struct attributes are read, see `AccessStats`.
+"""
+import os
+
+from ._pystruct import Struct, _dict_get, _MISSING
+
+try:
+    from ._cstruct import set_access_stats as _set_access_stats
+except ImportError:  # pragma: no cover
+    _set_access_stats = None
+
+
+EVENTS = ('hits', 'misses', 'missing', 'shadowed')
+
+_plain_getattribute = Struct.__getattribute__
+_plain_get_attr = Struct.get_attr
+
+_counts = {}
+_per_key = False
+
+
+def _count(self, event, name):
+    key = (type(self), event)
+    _counts[key] = _counts.get(key, 0) + 1
+    if _per_key:
+        key = (type(self), event, name)
+        _counts[key] = _counts.get(key, 0) + 1
+
+
+def _count_hit(self, name):
+    _count(self, 'hits', name)
+    if any(name in vars(cls) for cls in type(self).__mro__):
+        _count(self, 'shadowed', name)
+
+
+def _counting_getattribute(self, item):
+    value = _dict_get(self, item, _MISSING)
+    if value is not _MISSING:
+        _count_hit(self, item)
+        return value
+    _count(self, 'misses', item)
+    try:
+        return object.__getattribute__(self, item)
+    except AttributeError:
+        if getattr(type(self), '__missing__', None) is None:
+            raise
+    _count(self, 'missing', item)
+    return object.__getattribute__(self, '__missing__')(item)
+
+
+def _counting_get_attr(self, name, default=None):
+    value = _dict_get(self, name, _MISSING)
+    if value is not _MISSING:
+        _count_hit(self, name)
+        return value
+    return getattr(self, name, default)
+
+
+class AccessStats(object):
+    """
+    Counts of attribute reads on structs, per struct type and optionally per
+    key, to find the code that takes the slow paths. Counting is off until
+    `enable` is called, or the `TRI_STRUCT_STATS` environment variable is set
+    to `1` (or to `keys` to also count per key), and costs next to nothing
+    while off.
+
+    .. code-block:: python
+
+        >>> access_stats.enable()
+        >>> s = Struct(a=1, copy=2)
+        >>> s.a, s.copy, s.get_attr('b')
+        (1, 2, None)
+        >>> access_stats.snapshot()[Struct]
+        {'hits': 2, 'misses': 2, 'missing': 0, 'shadowed': 1}
+
+    The events are:
+
+    * `hits`: the attribute was a key
+    * `misses`: it wasn't, and the regular attribute lookup was used, for
+      methods (like `get_attr` above) as well as for attributes that don't
+      exist
+    * `missing`: misses answered by `__missing__`, like the new values of a
+      `DefaultStruct`
+    * `shadowed`: hits on a key with the name of a method or other class
+      attribute, like `copy` or `keys`
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.per_key = False
+
+    def enable(self, per_key=False):
+        """
+        Start counting, per key too with `per_key`.
+        """
+        global _per_key
+        _per_key = per_key
+        self.enabled, self.per_key = True, per_key
+        Struct.__getattribute__ = _counting_getattribute
+        Struct.get_attr = _counting_get_attr
+        if _set_access_stats is not None:
+            _set_access_stats(_counts, per_key)
+
+    def disable(self):
+        """
+        Stop counting. The counts so far are kept.
+        """
+        self.enabled = False
+        Struct.__getattribute__ = _plain_getattribute
+        Struct.get_attr = _plain_get_attr
+        if _set_access_stats is not None:
+            _set_access_stats(None)
+
+    def snapshot(self):
+        """
+        The counts so far, as a dict from struct type to a dict with a count
+        for each event. When counting per key, that dict also has `keys`, a
+        dict from key to the counts for that key.
+        """
+        result = {}
+        for key, count in _counts.copy().items():
+            counts = result.setdefault(key[0], dict.fromkeys(EVENTS, 0))
+            if len(key) == 3:
+                counts = counts.setdefault('keys', {}).setdefault(key[2], dict.fromkeys(EVENTS, 0))
+            counts[key[1]] = count
+        return result
+
+    def reset(self):
+        """
+        Set all counts back to zero.
+        """
+        _counts.clear()
+
+
+access_stats = AccessStats()
+
+AccessStats.__module__ = 'tri_struct'
+
+if os.environ.get('TRI_STRUCT_STATS', '') not in ('', '0'):  # pragma: no cover
+    access_stats.enable(per_key=os.environ['TRI_STRUCT_STATS'] == 'keys')
@@ -2,10 +2,118 @@
 
 void set_attribute_error(PyObject *, PyObject *);
 void set_key_error(PyObject *);
-PyObject * PyDict_GetItemWithError(PyObject *, PyObject *);
-PyObject * str_from_string(const char *);
-PyObject * str_format(PyObject *, PyObject *);
-PyObject * str_join(PyObject *, PyObject *);
-PyObject * format_with_type(PyTypeObject *, PyObject *);
-void str_concat(PyObject **, PyObject *);
-void str_concat_and_del(PyObject **, PyObject *);
+void set_read_only_error(PyObject *);
+
+
+/*
+    The strong reference and critical section APIs of Python 3.13, which
+    the free-threaded build needs, for older versions
+ */
+
+#if PY_VERSION_HEX < 0x030D0000
+static inline int
+PyDict_GetItemRef(PyObject *mp, PyObject *key, PyObject **result)
+{
+    *result = PyDict_GetItemWithError(mp, key);
+    if (*result != NULL) {
+        Py_INCREF(*result);
+        return 1;
+    }
+    return PyErr_Occurred() ? -1 : 0;
+}
+
+
+static inline PyObject *
+PyList_GetItemRef(PyObject *list, Py_ssize_t i)
+{
+    PyObject *item = PyList_GetItem(list, i);
+
+    Py_XINCREF(item);
+    return item;
+}
+
+
+static inline int
+PyDict_SetDefaultRef(PyObject *d, PyObject *key, PyObject *default_value,
+                     PyObject **result)
+{
+    PyObject *value = PyDict_SetDefault(d, key, default_value);
+
+    if (value == NULL) {
+        *result = NULL;
+        return -1;
+    }
+    Py_INCREF(value);
+    *result = value;
+    return value != default_value;
+}
+
+
+static inline int
+PyObject_GetOptionalAttr(PyObject *obj, PyObject *name, PyObject **result)
+{
+    *result = PyObject_GetAttr(obj, name);
+    if (*result != NULL)
+        return 1;
+    if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+        return -1;
+    PyErr_Clear();
+    return 0;
+}
+#endif
+
+
+#if PY_VERSION_HEX < 0x030C0000
+/* the dict of a type, as a new reference. Before 3.12 `tp_dict` is
+   always set
+ */
+static inline PyObject *
+PyType_GetDict(PyTypeObject *type)
+{
+    Py_INCREF(type->tp_dict);
+    return type->tp_dict;
+}
+#endif
+
+
+#ifndef Py_BEGIN_CRITICAL_SECTION
+#define Py_BEGIN_CRITICAL_SECTION(op) {
+#define Py_END_CRITICAL_SECTION() }
+#define Py_BEGIN_CRITICAL_SECTION2(a, b) {
+#define Py_END_CRITICAL_SECTION2() }
+#endif
+
+
+/* Relaxed atomic loads and stores, for fields that threads fill in lazily
+   and without a lock, like the cached hash of a frozen struct. With the
+   gil they are plain reads and writes.
+ */
+#ifdef Py_GIL_DISABLED
+#define FT_ATOMIC_LOAD_SSIZE_RELAXED(value) \
+    _Py_atomic_load_ssize_relaxed(&(value))
+#define FT_ATOMIC_STORE_SSIZE_RELAXED(value, new_value) \
+    _Py_atomic_store_ssize_relaxed(&(value), new_value)
+#else
+#define FT_ATOMIC_LOAD_SSIZE_RELAXED(value) (value)
+#define FT_ATOMIC_STORE_SSIZE_RELAXED(value, new_value) ((value) = (new_value))
+#endif
+
+
+/* `PyDict_Next` with new references, safe to call while other threads
+   change the dict. Loops that run Python code between the items should
+   use this, since they can't keep the dict locked for the whole loop.
+ */
+static inline int
+dict_next_ref(PyObject *d, Py_ssize_t *pos, PyObject **key, PyObject **value)
+{
+    int res;
+
+    Py_BEGIN_CRITICAL_SECTION(d);
+    res = PyDict_Next(d, pos, key, value);
+    if (res) {
+        Py_INCREF(*key);
+        Py_INCREF(*value);
+    }
+    Py_END_CRITICAL_SECTION();
+    return res;
+}
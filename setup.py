@@ -56,7 +56,6 @@ class ve_build_ext(build_ext):
 if platform.python_implementation() == 'CPython':
     ext_modules = [
         Extension("tri_struct._cstruct", ["lib/tri_struct/_cstruct.c",
-                                          "lib/tri_struct/_typespec.c",
                                           "lib/tri_struct/_utils.c"])
     ]
 else:
@@ -122,6 +121,7 @@ setup(
     package_dir={'': 'lib'},
     include_package_data=False,
     install_requires=read_reqs('requirements.txt'),
+    extras_require={'numpy': ['numpy']},
     license="BSD",
     zip_safe=False,
     keywords='tri.struct',
@@ -130,11 +130,15 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
+        'Programming Language :: Python :: 3.13',
+        'Programming Language :: Python :: Free Threading :: 2 - Beta',
     ],
+    python_requires='>=3.9',
     test_suite='tests',
     cmdclass={'build_ext': ve_build_ext,
               'tag': Tag,
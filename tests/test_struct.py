@@ -1,17 +1,63 @@
+import array
+import collections.abc
+import copy
+import gc
+import io
+import mmap
+import os
 import pickle
+import subprocess
+import sys
 import platform
+import threading
 
 import pytest
 
-from tri_struct import Struct as PyStruct
+import tri_struct
 from tri_struct import (
+    PyStruct,
+    PyFrozenStruct,
+    PyDefaultStruct,
     FastStruct,
+    FastFrozenStruct,
+    FastDefaultStruct,
     Frozen,
     FrozenStruct,
     merged,
+    py_merged,
+    deep_merged,
+    py_deep_merged,
+    py_struct_hash,
     DefaultStruct,
     to_default_struct,
+    to_struct,
+    to_frozen_struct,
+    freeze,
+    thaw,
+    py_freeze,
+    py_thaw,
+    StructArray,
+    loads_json,
+    iter_json_lines,
+    StructList,
+    InternTable,
+    intern_table,
+    PersistentStruct,
+    access_stats,
+    path,
+    project,
+    LazyStruct,
+    diff,
+    py_diff,
 )
+from tri_struct import _convert, _py_convert, _freeze, _thaw, _diff
+from tri_struct._json import object_hook, py_object_hook
+from tri_struct import _batch, _path
+
+
+def type_id(cls):
+    # the python and c types have the same names
+    return ('Py' if cls in (PyStruct, PyFrozenStruct, PyDefaultStruct) else 'Fast') + cls.__name__
 
 
 @pytest.fixture(scope="module",
@@ -23,6 +69,16 @@ def Struct(request):
     return request.param
 
 
+@pytest.fixture(params=[merged, py_merged], ids=["merged", "py_merged"])
+def merge(request):
+    return request.param
+
+
+@pytest.fixture(params=[deep_merged, py_deep_merged], ids=["deep_merged", "py_deep_merged"])
+def deep_merge(request):
+    return request.param
+
+
 def test_pybasestruct(Struct):
     s = Struct(a=1)
     assert s['a'] == 1
@@ -39,6 +95,35 @@ def test_constructor(Struct):
     assert s == Struct((k, v) for k, v in zip('abc', (1, 2, 3)))
 
 
+@pytest.mark.parametrize('struct_type', list(filter(None, [PyStruct, FastStruct, PyFrozenStruct, FastFrozenStruct])), ids=type_id)
+def test_constructor_arguments(struct_type):
+    many = {'key_%d' % i: i for i in range(20)}
+    assert struct_type() == {}
+    assert struct_type(a=1, b=2) == dict(a=1, b=2)
+    assert list(struct_type(b=1, a=2)) == ['b', 'a']
+    assert struct_type(dict(a=1, b=2), b=3, c=4) == dict(a=1, b=3, c=4)
+    assert struct_type([('a', 1)], a=2) == dict(a=2)
+    assert struct_type(**many) == many
+    assert list(struct_type(key_0=0, key_1=1, key_2=2, key_3=3, key_4=4, key_5=5, key_6=6)) == ['key_%d' % i for i in range(7)]
+    assert struct_type({'x': 1}, **many) == dict(many, x=1)
+    with pytest.raises(TypeError):
+        struct_type({}, {})
+    with pytest.raises(TypeError):
+        struct_type(1)
+    with pytest.raises(ValueError):
+        struct_type(['ab', 'cde'])
+
+
+def test_constructor_subclass_init(Struct):
+    class MyStruct(Struct):
+        def __init__(self, *args, **kwargs):
+            super(MyStruct, self).__init__(*args, **kwargs)
+            self.initialized = True
+
+    assert MyStruct(a=1) == dict(a=1, initialized=True)
+    assert type(MyStruct(a=1)) is MyStruct
+
+
 def test_get_item(Struct):
     s = Struct(a=1, b=2, c=3)
     assert 1 == s['a']
@@ -144,9 +229,6 @@ def test_shadow_methods(Struct):
 
 
 def test_hash(Struct):
-    if Struct is FastStruct:
-        pytest.skip('Does not work for FastStruct')
-
     s = Struct(x=17)
     with pytest.raises(TypeError) as e:
         hash(s)
@@ -196,6 +278,34 @@ def test_recursive_repr(Struct):
     assert repr(s) == f'{Struct.__name__}(a={Struct.__name__}(...), b={Struct.__name__}(...))'
 
 
+def test_repr_key_types(Struct):
+    assert repr(Struct({1: 'a', 2: None})) == f"{Struct.__name__}(1='a', 2=None)"
+    assert repr(Struct()) == f'{Struct.__name__}()'
+    assert repr(Struct(a=Struct(b=[1, Struct()]))) == f'{Struct.__name__}(a={Struct.__name__}(b=[1, {Struct.__name__}()]))'
+
+
+@pytest.mark.skipif(FastFrozenStruct is None, reason="CStruct not available")
+def test_fast_frozen_struct_repr_cache():
+    f = FastFrozenStruct(b=1, a='x', c=FastFrozenStruct(d=1.5, e=None))
+    r = repr(f)
+    assert r == "FrozenStruct(a='x', b=1, c=FrozenStruct(d=1.5, e=None))"
+    assert repr(f) is r
+    assert str(f) is r
+
+    # values that can change are not cached
+    v = [1]
+    f = FastFrozenStruct(v=v)
+    assert repr(f) == 'FrozenStruct(v=[1])'
+    v.append(2)
+    assert repr(f) == 'FrozenStruct(v=[1, 2])'
+
+    s = FastStruct(x=1)
+    f = FastFrozenStruct(s=s)
+    assert repr(f) == 'FrozenStruct(s=Struct(x=1))'
+    s.x = 2
+    assert repr(f) == 'FrozenStruct(s=Struct(x=2))'
+
+
 def test_missing_method(Struct):
     class MyStruct(Struct):
         def __missing__(self, key):
@@ -220,6 +330,104 @@ def test_attribute_exception(Struct):
     assert e.value.__context__ is None
 
 
+def test_get_attr(Struct):
+    s = Struct(a=1, get=2)
+    assert s.get_attr('a') == 1
+    assert s.get_attr('get') == 2
+    assert s.get_attr('missing') is None
+    assert s.get_attr('missing', 17) == 17
+    assert s.get_attr('copy').__name__ == 'copy'
+    assert getattr(s, 'missing', 17) == 17
+    assert not hasattr(s, 'missing')
+
+
+def test_get_attr_instance_dict(Struct):
+    class MyStruct(Struct):
+        pass
+
+    s = MyStruct()
+    s.__dict__['attr'] = 17
+    assert s.attr == 17
+    assert s.get_attr('attr') == 17
+    assert s.get_attr('missing', 42) == 42
+    with pytest.raises(AttributeError) as e:
+        s.missing
+    assert str(e.value) == "'MyStruct' object has no attribute 'missing'"
+
+
+def test_get_attr_missing(Struct):
+    class MyStruct(Struct):
+        __slots__ = ()
+
+        def __missing__(self, key):
+            return 'missing %s' % key
+
+    s = MyStruct(a=1)
+    assert s.get_attr('a') == 1
+    assert s.get_attr('b', 17) == 'missing b'
+    assert s.b == 'missing b'
+    assert s['b'] == 'missing b'
+
+
+def test_missing_descriptors(Struct):
+    class StaticMissing(Struct):
+        __slots__ = ()
+
+        @staticmethod
+        def __missing__(key):
+            return 'static %s' % key
+
+    class CallableMissing(Struct):
+        __slots__ = ()
+
+        class __missing__(object):
+            def __init__(self, key):
+                self.key = key
+
+    assert StaticMissing().foo == 'static foo'
+    assert CallableMissing().foo.key == 'foo'
+
+
+def test_missing_follows_class_changes(Struct):
+    class Base(Struct):
+        pass
+
+    class Sub(Base):
+        pass
+
+    s = Sub()
+    for _ in range(2):
+        assert not hasattr(s, 'foo')
+        assert s.get_attr('foo', 17) == 17
+    Base.foo = 'class'
+    assert s.foo == 'class'
+    Base.__missing__ = lambda self, key: 'missing %s' % key
+    assert s.bar == 'missing bar'
+    del Base.__missing__, Base.foo
+    assert not hasattr(s, 'foo') and not hasattr(s, 'bar')
+
+    class Meta(type):
+        def __missing__(cls, key):
+            raise AssertionError('looked up on the metatype')
+        foo = 'meta'
+
+    class WithMeta(Struct, metaclass=Meta):
+        pass
+
+    assert not hasattr(WithMeta(), 'foo')
+    assert WithMeta(foo=1).foo == 1
+
+
+def test_get_attr_default_struct():
+    d = DefaultStruct()
+    assert type(d.get_attr('x')) is DefaultStruct
+    assert 'x' in d
+    if FastDefaultStruct is not None:
+        d = FastDefaultStruct()
+        assert type(d.get_attr('x')) is FastDefaultStruct
+        assert 'x' in d
+
+
 # because of class name & module renaming, pickling the different
 # implementations won't, unless you also switch the tri_struct.Struct
 # implementation to match
@@ -288,31 +496,94 @@ def test_pickle_frozen_struct():
     assert type(s) == type(pickle.loads(pickle.dumps(s, pickle.HIGHEST_PROTOCOL)))
 
 
-def test_merged(Struct):
-    assert Struct(x=1, y=2) == merged(Struct(x=1), Struct(y=2))
-    assert Struct(x=1, y=2) == merged(Struct(x=1), FrozenStruct(y=2))
-    assert FrozenStruct(x=1, y=2) == merged(FrozenStruct(x=1), Struct(y=2))
-    assert {} == merged()
-    assert Struct(x=1, y=2) == merged(Struct(x=1), y=2)
+def test_merged(Struct, merge):
+    assert Struct(x=1, y=2) == merge(Struct(x=1), Struct(y=2))
+    assert Struct(x=1, y=2) == merge(Struct(x=1), FrozenStruct(y=2))
+    assert FrozenStruct(x=1, y=2) == merge(FrozenStruct(x=1), Struct(y=2))
+    assert {} == merge()
+    assert Struct(x=1, y=2) == merge(Struct(x=1), y=2)
 
 
-def test_merged_with_kwarg_constructor(Struct):
+def test_merged_with_kwarg_constructor(Struct, merge):
     class MyStruct(Struct):
         def __init__(self, **kwargs):
             super(MyStruct, self).__init__(**kwargs)
 
     s = MyStruct(foo='foo')
-    assert MyStruct(foo='foo', bar='bar') == merged(s, dict(bar='bar'))
+    assert MyStruct(foo='foo', bar='bar') == merge(s, dict(bar='bar'))
 
 
-def test_merge_to_other_type(Struct):
+def test_merge_to_other_type(Struct, merge):
     s1 = Struct(x=1)
     s2 = dict(y=2)
-    m = merged(FrozenStruct(), s1, s2)
+    m = merge(FrozenStruct(), s1, s2)
     assert FrozenStruct(x=1, y=2) == m
     assert isinstance(m, FrozenStruct)
 
 
+def test_merged_type_of_first_argument(Struct, merge):
+    m = merge(Struct(x=1), [('y', 2)], dict(z=3), z=4)
+    assert Struct(x=1, y=2, z=4) == m
+    assert type(m) is Struct
+
+    m = merge(DefaultStruct(x=1), dict(y=2))
+    assert DefaultStruct(x=1, y=2) == m
+    assert type(m.z) is DefaultStruct
+
+    s = Struct(x=1)
+    assert merge(s) is not s
+
+
+def test_deep_merged(Struct, deep_merge):
+    base = Struct(
+        a=Struct(x=1, y=Struct(z=1)),
+        b=Struct(untouched=Struct(deep=1)),
+        c=1,
+    )
+    override = dict(a=dict(y=dict(w=2)), c=Struct(q=1))
+
+    m = deep_merge(base, override, d=3)
+    assert m == Struct(
+        a=Struct(x=1, y=Struct(z=1, w=2)),
+        b=Struct(untouched=Struct(deep=1)),
+        c=Struct(q=1),
+        d=3,
+    )
+    assert type(m) is Struct
+    assert type(m.a) is Struct
+    assert type(m.a.y) is Struct
+
+    # subtrees from only one input are shared
+    assert m.b is base.b
+    assert m.c is override['c']
+
+    # inputs are left untouched
+    assert base == Struct(a=Struct(x=1, y=Struct(z=1)), b=Struct(untouched=Struct(deep=1)), c=1)
+    assert override == dict(a=dict(y=dict(w=2)), c=Struct(q=1))
+
+
+def test_deep_merged_many_levels(Struct, deep_merge):
+    levels = [Struct(shared=Struct(level=i, **{'key_%d' % i: i})) for i in range(10)]
+    m = deep_merge(*levels)
+    assert m.shared.level == 9
+    assert sorted(m.shared.keys()) == sorted(['level'] + ['key_%d' % i for i in range(10)])
+    assert all(level.shared.level == i for i, level in enumerate(levels))
+
+
+def test_deep_merged_replaces_non_dicts(Struct, deep_merge):
+    assert deep_merge(Struct(a=1), Struct(a=Struct(b=1))) == Struct(a=Struct(b=1))
+    assert deep_merge(Struct(a=Struct(b=1)), Struct(a=None)) == Struct(a=None)
+    assert deep_merge(Struct(a=[1]), Struct(a=[2])) == Struct(a=[2])
+    assert deep_merge() == Struct()
+
+
+def test_deep_merged_frozen(deep_merge):
+    m = deep_merge(FrozenStruct(a=FrozenStruct(x=1)), dict(a=dict(y=2)))
+    assert m == FrozenStruct(a=FrozenStruct(x=1, y=2))
+    assert type(m.a) is FrozenStruct
+    assert hash(m) == hash(FrozenStruct(a=FrozenStruct(x=1, y=2)))
+
+
 def test_default_struct():
     d = DefaultStruct()
     assert type(d.a) is DefaultStruct
@@ -331,6 +602,70 @@ def test_default_struct_with_list():
     assert dict(a=[17]) == d
 
 
+@pytest.mark.skipif(FastDefaultStruct is None, reason="CStruct not available")
+def test_fast_default_struct():
+    d = FastDefaultStruct()
+    assert type(d.a) is FastDefaultStruct
+    assert d._default_factory is FastDefaultStruct
+
+    d.a.b.c = 17
+    d.a.d.e = 42
+    d.x
+    d['y']
+    assert {'a': {'b': {'c': 17},
+                  'd': {'e': 42}},
+            'x': {},
+            'y': {}} == d
+
+    # methods are not shadowed by auto-vivification
+    assert d.keys() is not None
+    assert 'keys' not in d
+
+
+@pytest.mark.skipif(FastDefaultStruct is None, reason="CStruct not available")
+def test_fast_default_struct_factory():
+    d = FastDefaultStruct(list, a=[1])
+    d.a.append(2)
+    d.b.append(17)
+    d['c'].append(42)
+    assert dict(a=[1, 2], b=[17], c=[42]) == d
+
+    d = FastDefaultStruct(default_factory=int, x=1)
+    assert d.y == 0
+    assert dict(x=1, y=0) == d
+
+    with pytest.raises(TypeError):
+        FastDefaultStruct(17)
+
+
+@pytest.mark.skipif(FastDefaultStruct is None, reason="CStruct not available")
+def test_fast_default_struct_copy_and_pickle():
+    import copy
+
+    d = FastDefaultStruct(list, a=[1])
+    for c in [d.copy(), copy.copy(d), pickle.loads(pickle.dumps(d, pickle.HIGHEST_PROTOCOL))]:
+        assert type(c) is FastDefaultStruct
+        assert c == d
+        assert c.b == []
+
+    d = FastDefaultStruct()
+    d.a.b = 1
+    c = pickle.loads(pickle.dumps(d))
+    assert c == d
+    assert type(c.x) is FastDefaultStruct
+
+
+@pytest.mark.skipif(FastDefaultStruct is None, reason="CStruct not available")
+def test_fast_default_struct_subclass_missing():
+    class MyDefaultStruct(FastDefaultStruct):
+        def __missing__(self, key):
+            return 'missing %s' % key
+
+    d = MyDefaultStruct()
+    assert d.foo == 'missing foo'
+    assert d['bar'] == 'missing bar'
+
+
 def test_to_default_struct():
     d = to_default_struct({
         'a': {'b': {'c': 17},
@@ -343,6 +678,83 @@ def test_to_default_struct():
             'x': {'y': 'z'}} == d
 
 
+@pytest.fixture(params=[_convert, _py_convert], ids=["convert", "py_convert"])
+def convert(request):
+    return request.param
+
+
+def test_convert(convert):
+    data = {'a': {'b': [{'c': 1}, 2, [{'d': 3}]]}, 'e': 'f'}
+
+    s = convert(data, DefaultStruct, list)
+    assert s == data
+    assert type(s) is DefaultStruct
+    assert type(s.a) is DefaultStruct
+    assert type(s.a.b) is list
+    assert type(s.a.b[0]) is DefaultStruct
+    assert type(s.a.b[2][0]) is DefaultStruct
+    s.x.y = 'z'
+    assert s.x == dict(y='z')
+
+    f = convert(data, FrozenStruct, tuple)
+    assert f == FrozenStruct(a=FrozenStruct(b=(FrozenStruct(c=1), 2, (FrozenStruct(d=3),))), e='f')
+    assert type(f.a.b[0]) is FrozenStruct
+    assert isinstance(hash(f), int)
+
+    assert convert(17, FrozenStruct, tuple) == 17
+
+
+def test_convert_keeps_converted(convert):
+    inner = DefaultStruct(list)
+    s = convert({'a': inner}, DefaultStruct, list)
+    assert s.a is inner
+
+
+def test_convert_memo(convert):
+    shared = {'x': 1}
+    data = {'a': shared, 'b': shared, 'c': [shared]}
+
+    s = convert(data, PyStruct, list)
+    assert s.a == s.b
+    assert s.a is not s.b
+
+    s = convert(data, PyStruct, list, {})
+    assert s.a is s.b
+    assert s.c[0] is s.a
+
+    cyclic = {'x': 1}
+    cyclic['self'] = cyclic
+    cyclic_list = [cyclic]
+    cyclic_list.append(cyclic_list)
+    s = convert({'d': cyclic, 'l': cyclic_list}, PyStruct, list, {})
+    assert s.d.self is s.d
+    assert s.l[0] is s.d
+    assert s.l[1] is s.l
+
+
+@pytest.mark.skipif(FastStruct is None, reason="CStruct not available")
+def test_convert_deep():
+    data = leaf = {}
+    for _ in range(100000):
+        leaf['a'] = {}
+        leaf = leaf['a']
+    leaf['x'] = [1]
+
+    s = to_struct(data)
+    for _ in range(100000):
+        s = s['a']
+        assert type(s) is tri_struct.Struct
+    assert s == dict(x=[1])
+
+
+def test_to_struct_and_frozen():
+    s = to_struct({'a': {'b': 1}})
+    assert type(s.a) is tri_struct.Struct
+    f = to_frozen_struct({'a': {'b': [1, 2]}})
+    assert f == FrozenStruct(a=FrozenStruct(b=(1, 2)))
+    assert hash(f) == hash(FrozenStruct(a=FrozenStruct(b=(1, 2))))
+
+
 def test_repr_with_value_exception(Struct):
     class MyException(Exception):
         pass
@@ -356,7 +768,9 @@ def test_repr_with_value_exception(Struct):
 
 
 def test_module_attribute(Struct):
-    assert Struct.__module__ == 'tri_struct'
+    # pickles find the type by these
+    assert getattr(sys.modules[Struct.__module__], Struct.__qualname__) is Struct
+    assert tri_struct.Struct.__module__ == 'tri_struct'
 
 
 def test_frozen_struct_cache_actually_caches():
@@ -365,3 +779,1204 @@ def test_frozen_struct_cache_actually_caches():
     dict.__setitem__(f, 'a', 2)
     assert hash(f) == old_hash
     assert f._hash == old_hash
+
+
+@pytest.mark.skipif(FastFrozenStruct is None, reason="CStruct not available")
+def test_fast_frozen_struct():
+    f1 = FastFrozenStruct(x=17)
+    f2 = FastFrozenStruct(x=17)
+    assert f1 == f2
+    assert hash(f1) == hash(f2)
+    assert hash(f1) == hash(FrozenStruct(x=17))
+
+    assert f2 in {f1}
+    assert f1 not in {FastFrozenStruct(x=42)}
+    assert f1 not in {FastFrozenStruct(y=17)}
+
+    assert FastStruct(x=17) == f1
+    assert isinstance(f1, FastStruct)
+    assert f1.x == 17
+    assert repr(f1) == 'FrozenStruct(x=17)'
+
+
+@pytest.mark.skipif(FastFrozenStruct is None, reason="CStruct not available")
+def test_modify_fast_frozen_struct():
+    f = FastFrozenStruct(x=17)
+    for mutate in [
+        lambda: setattr(f, 'x', 42),
+        lambda: f.__setitem__('x', 42),
+        lambda: f.update(dict(x=42)),
+        lambda: f.setdefault('foo', 11),
+        lambda: f.clear(),
+        lambda: f.pop('x'),
+        lambda: f.popitem(),
+        lambda: delattr(f, 'x'),
+        lambda: f.__delitem__('x'),
+    ]:
+        with pytest.raises(TypeError) as e:
+            mutate()
+        assert "'FrozenStruct' object attributes are read-only" == str(e.value)
+
+    with pytest.raises(TypeError):
+        f |= dict(x=42)
+
+    assert f == dict(x=17)
+
+
+@pytest.mark.skipif(FastFrozenStruct is None, reason="CStruct not available")
+def test_fast_frozen_struct_pickle_and_copy():
+    import copy
+
+    s = FastFrozenStruct(x=17, y=FastStruct(z=1))
+    assert s == pickle.loads(pickle.dumps(s, pickle.HIGHEST_PROTOCOL))
+    assert type(s) == type(pickle.loads(pickle.dumps(s, pickle.HIGHEST_PROTOCOL)))
+    assert copy.copy(s) is s
+
+
+if FastFrozenStruct is not None:
+    class MyFrozenStruct(FastFrozenStruct):
+        __slots__ = ('extra', )
+
+
+@pytest.mark.skipif(FastFrozenStruct is None, reason="CStruct not available")
+def test_fast_frozen_struct_subclass():
+    f = MyFrozenStruct(a=1)
+    assert hash(f) == hash(FastFrozenStruct(a=1))
+    with pytest.raises(TypeError) as e:
+        f.a = 2
+    assert "'MyFrozenStruct' object attributes are read-only" == str(e.value)
+    assert type(pickle.loads(pickle.dumps(f))) is MyFrozenStruct
+
+
+@pytest.mark.skipif(FastFrozenStruct is None, reason="CStruct not available")
+def test_fast_frozen_struct_cache_actually_caches():
+    f = FastFrozenStruct(a=1, b=2)
+    old_hash = hash(f)
+    dict.__setitem__(f, 'a', 2)
+    assert hash(f) == old_hash
+
+
+def test_schema(Struct):
+    Row = Struct.schema('id', 'name')
+    assert Row is Struct.schema('id', 'name')
+
+    r = Row(1, name='foo')
+    assert r.id == 1
+    assert r['name'] == 'foo'
+    assert list(r) == ['id', 'name']
+    assert len(r) == 2
+    assert 'id' in r
+    assert r == Struct(id=1, name='foo')
+    assert Struct(id=1, name='foo') == r
+    assert r != Struct(id=1, name='bar')
+    assert r == Row(1, 'foo')
+    assert r != Row(1)
+    assert repr(r) == "Struct(id=1, name='foo')"
+    assert dict(r) == dict(id=1, name='foo')
+
+    r.id = 2
+    r['name'] = 'bar'
+    assert r == dict(id=2, name='bar')
+
+
+def test_schema_missing_keys_and_overflow(Struct):
+    Row = Struct.schema('id', 'name')
+    r = Row(name='foo')
+    assert len(r) == 1
+    assert 'id' not in r
+    with pytest.raises(AttributeError):
+        r.id
+    with pytest.raises(KeyError):
+        r['id']
+    assert r.get('id') is None
+    assert r.get_attr('id', 17) == 17
+
+    r.extra = 1
+    r[2] = 'two'
+    assert r == {'name': 'foo', 'extra': 1, 2: 'two'}
+    assert list(r) == ['name', 'extra', 2]
+    del r.extra
+    del r[2]
+    del r.name
+    assert r == Struct()
+    with pytest.raises(AttributeError):
+        del r.name
+    with pytest.raises(KeyError):
+        del r['extra']
+
+
+def test_schema_constructor_errors(Struct):
+    Row = Struct.schema('id', 'name')
+    with pytest.raises(TypeError):
+        Row(1, 2, 3)
+    with pytest.raises(TypeError):
+        Row(1, id=2)
+    with pytest.raises(TypeError):
+        Struct.schema('id', 1)
+    with pytest.raises(ValueError):
+        Struct.schema('id', 'id')
+
+
+def test_schema_copy_and_pickle(Struct):
+    Row = Struct.schema('id', 'name', name='Row')
+    r = Row(1, name='foo', extra=[])
+    assert repr(r) == "Row(extra=[], id=1, name='foo')"
+
+    c = r.copy()
+    assert c == r
+    assert type(c) is Row
+    assert c.extra is r.extra
+
+    r.me = r
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        p = pickle.loads(pickle.dumps(r, protocol))
+        assert type(p) is Row
+        assert p.me is p
+        assert p.extra == [] and p.id == 1
+
+
+def test_schema_mutable_mapping(Struct):
+    Row = Struct.schema('id', 'name')
+    r = Row(1)
+    r.update(name='foo', extra=2)
+    assert r.pop('extra') == 2
+    assert r.setdefault('id', 3) == 1
+    assert list(r.items()) == [('id', 1), ('name', 'foo')]
+    assert list(r.values()) == [1, 'foo']
+    r.clear()
+    assert len(r) == 0
+    with pytest.raises(TypeError):
+        hash(r)
+
+
+def test_schema_types_are_released(Struct):
+    from tri_struct._schema import _schema_types
+    Row = Struct.schema('unused_%d' % id(Struct))
+    cache_key = (Row.__name__, Row._schema_keys)
+    assert _schema_types[cache_key] is Row
+    del Row
+    gc.collect()
+    assert cache_key not in _schema_types
+
+
+def test_schema_deep_nesting(Struct):
+    Node = Struct.schema('child')
+    node = None
+    for _ in range(200000):
+        node = Node(node)
+    del node
+
+
+def test_from_rows(Struct):
+    rows = [(1, 'a'), [2, 'b'], iter((3, 'c'))]
+    result = Struct.from_rows(('id', 'name'), rows)
+    assert result == [dict(id=1, name='a'), dict(id=2, name='b'), dict(id=3, name='c')]
+    assert all(type(s) is Struct for s in result)
+
+    keys = [''.join(['na', 'me']), 17]
+    s, = Struct.from_rows(keys, [('a', 'b')])
+    assert [k is sys.intern('name') for k in s] == [True, False]
+    assert type(keys[0]) is str and keys[0] is not sys.intern('name')
+
+    wide = ['key_%d' % i for i in range(20)]
+    assert Struct.from_rows(wide, [range(20)]) == [Struct(zip(wide, range(20)))]
+    assert Struct.from_rows(wide, []) == []
+
+    with pytest.raises(ValueError) as e:
+        Struct.from_rows(('a', 'b'), [(1, 2), (1,)])
+    assert str(e.value) == 'row 1 has 1 values, expected 2'
+    with pytest.raises(TypeError):
+        Struct.from_rows(('a',), 17)
+
+
+def test_from_rows_lazy(Struct):
+    consumed = []
+
+    def rows():
+        for i in range(3):
+            consumed.append(i)
+            yield (i, i * i)
+
+    structs = Struct.from_rows(('n', 'square'), rows(), lazy=True)
+    assert iter(structs) is structs
+    assert consumed == []
+    assert next(structs) == dict(n=0, square=0)
+    assert consumed == [0]
+    assert list(structs) == [dict(n=1, square=1), dict(n=2, square=4)]
+
+    class Row(Struct):
+        __slots__ = ()
+
+        @property
+        def double(self):
+            return self.n * 2
+
+    assert [row.double for row in Row.from_rows(('n',), [(1,), (2,)], lazy=True)] == [2, 4]
+
+
+@pytest.mark.parametrize('struct_type', [PyFrozenStruct, PyDefaultStruct] + list(filter(None, [FastFrozenStruct, FastDefaultStruct])), ids=type_id)
+def test_from_rows_struct_types(struct_type):
+    s, = struct_type.from_rows(('a',), [(1,)])
+    assert type(s) is struct_type
+    assert s == dict(a=1)
+    if struct_type.__hash__ is not None:
+        assert hash(s) == hash(struct_type(a=1))
+    else:
+        assert s.missing == struct_type()
+
+
+@pytest.mark.skipif(FastStruct is None, reason="CStruct not available")
+def test_schema_is_compact():
+    Row = FastStruct.schema(*['key_%d' % i for i in range(12)])
+    values = tuple(range(12))
+    assert sys.getsizeof(Row(*values)) <= sys.getsizeof(values) + 16
+    assert sys.getsizeof(Row(*values)) < sys.getsizeof(FastStruct(zip(Row._schema_keys, values))) / 2
+
+
+def test_struct_array():
+    rows = [PyStruct(name='a', price=1.5, count=1), PyStruct(name='b', price=3.0, count=2)]
+    a = StructArray.from_structs(rows)
+    assert len(a) == 2
+    assert a.keys() == ['name', 'price', 'count']
+    assert a.price == array.array('d', [1.5, 3.0])
+    assert a.count == array.array('q', [1, 2])
+    assert a.name == ['a', 'b']
+    assert a['name'] is a.name
+    assert a.to_structs() == rows
+    assert StructArray(name=['a'], price=[1.5], count=[1]).to_structs() == rows[:1]
+    assert repr(a[1:]) == "StructArray(Struct(count=2, name='b', price=3.0))"
+    with pytest.raises(ValueError):
+        StructArray(a=[1, 2], b=[1])
+    with pytest.raises(TypeError):
+        a.price = []
+
+
+def test_struct_array_row_view():
+    a = StructArray(name=['a', 'b'], price=[1.5, 3.0])
+    row = a[-1]
+    assert row == PyStruct(name='b', price=3.0)
+    assert row.name == 'b'
+    assert row['price'] == 3.0
+    assert list(row) == ['name', 'price']
+    assert repr(row) == "Struct(name='b', price=3.0)"
+    with pytest.raises(AttributeError):
+        row.missing
+    with pytest.raises(IndexError):
+        a[2]
+
+    row.price = 4.0
+    assert a.price[1] == 4.0
+    with pytest.raises(AttributeError):
+        row.missing = 1
+
+
+def test_struct_array_filter_and_pickle():
+    a = StructArray(name=['a', 'b', 'c'], price=[1.5, 3.0, 4.5], backend='list')
+    assert a.price == [1.5, 3.0, 4.5]
+    assert a.filter(lambda row: row.price > 2).name == ['b', 'c']
+    assert a.filter([True, False, True]).price == [1.5, 4.5]
+    with pytest.raises(ValueError):
+        a.filter([True])
+    assert pickle.loads(pickle.dumps(a)) == a
+
+
+def test_struct_array_numpy():
+    numpy = pytest.importorskip('numpy')
+    a = StructArray(name=['a', 'b', 'c'], price=[1.5, 3.0, 4.5], backend='numpy')
+    assert isinstance(a.price, numpy.ndarray)
+    cheap = a.filter(a.price < 4)
+    assert cheap.name.tolist() == ['a', 'b']
+    assert cheap.to_structs() == [PyStruct(name='a', price=1.5), PyStruct(name='b', price=3.0)]
+
+
+@pytest.fixture(params=filter(None, [object_hook, py_object_hook]), ids=["object_hook", "py_object_hook"])
+def json_hook(request, monkeypatch):
+    monkeypatch.setattr('tri_struct._json.object_hook', request.param)
+    return request.param
+
+
+@pytest.mark.parametrize('struct_type', [PyStruct, PyFrozenStruct, PyDefaultStruct] + list(filter(None, [FastStruct, FastFrozenStruct, FastDefaultStruct])), ids=type_id)
+def test_loads_json(json_hook, struct_type):
+    s = loads_json('{"a": {"b": [1, {"c": null}]}, "d": "e"}', struct_type=struct_type)
+    assert type(s) is struct_type
+    assert type(s.a) is struct_type
+    assert type(s.a.b[1]) is struct_type
+    assert s == dict(a=dict(b=[1, dict(c=None)]), d='e')
+    assert loads_json(b'{"a": 1}', struct_type=struct_type) == dict(a=1)
+    assert loads_json('[1.5, {"x": 2}]', struct_type=struct_type, parse_float=str) == ['1.5', dict(x=2)]
+
+
+def test_loads_json_object_hook(json_hook):
+    class MyStruct(PyStruct):
+        __slots__ = ()
+
+    hook = json_hook(MyStruct)
+    d = dict(a=1)
+    s = hook(d)
+    assert type(s) is MyStruct
+    assert s == d
+    assert type(d) is dict
+    assert type(loads_json('{"a": {}}', struct_type=MyStruct).a) is MyStruct
+
+    if FastDefaultStruct is not None:
+        assert loads_json('{"a": 1}', struct_type=FastDefaultStruct).b == FastDefaultStruct()
+
+    with pytest.raises(TypeError, match='object_hook'):
+        loads_json('{}', object_hook=dict)
+    with pytest.raises(TypeError, match='object_pairs_hook'):
+        loads_json(b'{}', object_pairs_hook=dict)
+    with pytest.raises(TypeError, match='object_hook'):
+        list(iter_json_lines(io.StringIO('{}'), object_hook=dict))
+
+
+def test_iter_json_lines(json_hook, tmp_path):
+    path = tmp_path / 'events.jsonl'
+    path.write_bytes(b'{"a": 1}\n\n{"a": {"b": 2}}\n[{"c": 3}]')
+
+    expected = [PyStruct(a=1), PyStruct(a=PyStruct(b=2)), [PyStruct(c=3)]]
+    with open(path, 'rb') as f:
+        assert list(iter_json_lines(f)) == expected
+    with open(path) as f:
+        assert list(iter_json_lines(f, struct_type=FrozenStruct)) == expected
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        assert list(iter_json_lines(m)) == expected
+    with pytest.raises(TypeError):
+        loads_json('{}', struct_type=list)
+
+
+@pytest.fixture(params=["c", "py"])
+def packing(request, monkeypatch):
+    if request.param == "c":
+        if FastStruct is None:
+            pytest.skip("CStruct not available")
+        return _batch.pack_structs, _batch.unpack_structs
+    monkeypatch.setattr(_batch, 'pack_structs', _batch.py_pack_structs)
+    monkeypatch.setattr(_batch, 'unpack_structs', _batch.py_unpack_structs)
+    return _batch.py_pack_structs, _batch.py_unpack_structs
+
+
+def test_pack_structs(packing):
+    pack, unpack = packing
+    items = [PyStruct(a=1, b=2), PyStruct(a=3, b=4), PyStruct(b=5, a=6), FrozenStruct(a=7), dict(a=8), DefaultStruct(a=9), None]
+    shapes, row_shapes, values, refs = pack(items)
+    assert shapes == [(PyStruct, ('a', 'b')), (PyStruct, ('b', 'a')), (FrozenStruct, ('a',)), (dict, ('a',))]
+    assert row_shapes == bytes([0, 0, 1, 2, 3, 255, 255])
+    assert values == [1, 2, 3, 4, 5, 6, 7, 8, items[5], None]
+    assert refs == []
+
+    result = unpack(shapes, row_shapes, values, refs)
+    assert result == items
+    assert [type(x) for x in result] == [type(x) for x in items]
+    assert list(result[2]) == ['b', 'a']
+    assert unpack(shapes, [0, -1], [1, 2, 'raw']) == [PyStruct(a=1, b=2), 'raw']
+    assert pack([DefaultStruct(a=1)])[:2] == ([], bytes([255]))
+
+
+def test_pack_structs_many_shapes(packing):
+    pack, unpack = packing
+    items = [PyStruct({'key_%d' % i: i}) for i in range(300)] + [17]
+    shapes, row_shapes, values, refs = pack(items)
+    assert row_shapes[-2:] == [299, -1]
+    assert unpack(shapes, row_shapes, values, refs) == items
+
+
+def test_pack_structs_identity(packing):
+    pack, unpack = packing
+    a = PyStruct(name='a')
+    b = PyStruct(name='b', parent=a, other=None)
+    c = PyStruct(name='c')
+    c.me = c
+    items = [a, b, a, c, b.copy(), [b]]
+    packed = pack(items)
+    assert packed[1] == bytes([0, 1, 255, 2, 1, 255])
+    assert packed[2] == ['a', 'b', None, None, None, 'c', None, 'b', None, None, items[5]]
+    assert packed[3] == [2, 0, 4, 0, 6, 3, 8, 0]
+
+    result = unpack(*packed)
+    assert [type(x) for x in result] == [type(x) for x in items]
+    a, b, a2, c, b2 = result[:5]
+    assert (a, b, c.name) == (items[0], items[1], 'c')
+    assert a2 is a
+    assert b.parent is a
+    assert b2.parent is a and b2 is not b
+    assert c.me is c
+    # structs with containers in them can be in cycles
+    assert gc.is_tracked(b) and gc.is_tracked(c)
+    # too deep down to refer to the row
+    assert result[5] == [b] and result[5][0] is not b
+
+
+@pytest.mark.skipif(FastStruct is None, reason="CStruct not available")
+def test_unpack_structs_bad_data():
+    with pytest.raises(ValueError):
+        _batch.unpack_structs([(PyStruct, ('a',))], b'\x00', [])
+    with pytest.raises(ValueError):
+        _batch.unpack_structs([(PyStruct, ('a',))], b'\x01', [1])
+    with pytest.raises(ValueError):
+        _batch.unpack_structs([(list, ('a',))], b'\x00', [1])
+    with pytest.raises(ValueError):
+        _batch.unpack_structs([], b'\xff', [1, 2])
+    with pytest.raises(ValueError):
+        _batch.unpack_structs([(PyStruct, ('a',))], b'\x00\xff', [1, 2], [1])
+    with pytest.raises(ValueError):
+        _batch.unpack_structs([(PyStruct, ('a',))], b'\x00\xff', [1, 2], [2, 0])
+    with pytest.raises(ValueError):
+        # only structs that are rows of their own can be referred to
+        _batch.unpack_structs([(PyStruct, ('a',))], b'\x00\xff', [1, 2], [0, 1])
+
+
+def test_struct_list_pickle(packing):
+    rows = StructList(FrozenStruct(id=i, name=str(i), nested=PyStruct(x=i)) for i in range(10))
+    rows.append(dict(other=True))
+    rows.extend(filter(None, [FastStruct and FastStruct(id=10), FastFrozenStruct and FastFrozenStruct(id=11)]))
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        result = pickle.loads(pickle.dumps(rows, protocol))
+        assert type(result) is StructList
+        assert result == rows
+        assert [type(x) for x in result] == [type(x) for x in rows]
+    assert len(pickle.dumps(rows)) < len(pickle.dumps(list(rows)))
+
+
+def test_struct_list_pickle_identity(packing):
+    a = PyStruct(name='a')
+    b = PyStruct(name='b', parent=a)
+    c = PyStruct(name='c')
+    c.me = c
+    result = pickle.loads(pickle.dumps(StructList([a, b, a, c])))
+    assert result[:3] == [a, b, a]
+    assert result[0] is result[2]
+    assert result[1].parent is result[0]
+    assert result[3].me is result[3]
+
+
+def test_frozen_struct_reduce():
+    f = FrozenStruct(a=1)
+    assert f.__reduce__() == (FrozenStruct, (dict(a=1),))
+    if FastFrozenStruct is not None:
+        f = FastFrozenStruct(a=1)
+        assert f.__reduce__() == (FastFrozenStruct, (dict(a=1),))
+        assert type(f.__reduce__()[1][0]) is dict
+
+
+@pytest.mark.parametrize('frozen_type', list(filter(None, [PyFrozenStruct, FastFrozenStruct])), ids=type_id)
+def test_frozen_hash_is_order_independent(frozen_type):
+    items = [('a', 1), (2, 'b'), (None, (1, 2))]
+    f = frozen_type(items)
+    assert hash(f) == hash(frozenset(items))
+    assert hash(f) == py_struct_hash(dict(items))
+    assert hash(f) == hash(frozen_type(reversed(items)))
+    assert hash(frozen_type()) == hash(frozenset())
+    with pytest.raises(TypeError):
+        hash(frozen_type(a=[]))
+
+
+class CountingEq(object):
+    calls = 0
+
+    def __eq__(self, other):
+        CountingEq.calls += 1
+        return True
+
+    def __hash__(self):
+        return id(self)
+
+
+@pytest.mark.parametrize('frozen_type', list(filter(None, [PyFrozenStruct, FastFrozenStruct])), ids=type_id)
+def test_frozen_equality_short_circuits(frozen_type):
+    f1 = frozen_type(a=CountingEq())
+    f2 = frozen_type(a=CountingEq())
+    CountingEq.calls = 0
+    assert f1 == f1
+    assert not (f1 != f1)
+    assert CountingEq.calls == 0
+
+    assert f1 == f2
+    assert CountingEq.calls == 1
+
+    hash(f1), hash(f2)
+    assert f1 != f2
+    assert not (f1 == f2)
+    assert CountingEq.calls == 1
+    assert f1 == dict(f2)
+
+
+@pytest.mark.parametrize('frozen_type', list(filter(None, [PyFrozenStruct, FastFrozenStruct])), ids=type_id)
+def test_intern(frozen_type):
+    intern_table.clear()
+    a = frozen_type.intern(dict(read=True, write=False))
+    b = frozen_type.intern(PyStruct(read=True, write=False))
+    c = frozen_type.intern(frozen_type(read=True, write=True))
+    assert type(a) is frozen_type
+    assert a is b
+    assert a is not c
+    assert intern_table.stats() == dict(hits=1, misses=2, collisions=0, size=2)
+
+    del a, b, c
+    gc.collect()
+    assert len(intern_table) == 0
+
+    intern_table.clear()
+    assert intern_table.stats() == dict(hits=0, misses=0, collisions=0, size=0)
+
+
+def test_intern_table():
+    class AlwaysCollides(FrozenStruct):
+        __slots__ = ()
+
+        def __hash__(self):
+            return 1
+
+    table = InternTable()
+    a = table.intern(AlwaysCollides(a=1))
+    b = table.intern(AlwaysCollides(a=2))
+    assert table.intern(AlwaysCollides(a=1)) is a
+    assert table.intern(b) is b
+    assert table.stats() == dict(hits=1, misses=1, collisions=2, size=1)
+    assert table.intern(dict(a=1), FrozenStruct) == FrozenStruct(a=1)
+
+    with pytest.raises(TypeError):
+        table.intern(PyStruct(a=1))
+    with pytest.raises(TypeError):
+        table.intern(FrozenStruct(a=[]))
+
+
+def test_persistent_struct():
+    p = PersistentStruct(a=1, b=2)
+    assert p.a == 1
+    assert p['b'] == 2
+    assert p.get('c') is None
+    assert 'a' in p and 'c' not in p
+    assert len(p) == 2
+    assert sorted(p) == ['a', 'b']
+    assert repr(p) == str(p) == 'PersistentStruct(a=1, b=2)'
+    with pytest.raises(AttributeError):
+        p.c
+    with pytest.raises(KeyError):
+        p['c']
+    with pytest.raises(TypeError):
+        p.a = 3
+    with pytest.raises(TypeError):
+        del p.a
+
+    q = p.evolve(b=3, c=4)
+    assert q == dict(a=1, b=3, c=4)
+    assert p == dict(a=1, b=2)
+    assert p.evolve(a=1) is p
+    assert q.without('b', 'c') == dict(a=1)
+    assert p.without() is p
+    with pytest.raises(KeyError):
+        p.without('c')
+
+    assert hash(p) == hash(FrozenStruct(a=1, b=2))
+    assert p == FrozenStruct(a=1, b=2)
+    assert p != q
+    assert pickle.loads(pickle.dumps(q)) == q
+
+
+def test_persistent_struct_shares_structure():
+    p = PersistentStruct(('key_%d' % i, i) for i in range(5000))
+    q = p.evolve(key_17=-1)
+    assert p.key_17 == 17 and q.key_17 == -1
+    assert q == dict(p, key_17=-1)
+    shared = {id(node) for node in p._root.array}
+    assert sum(id(node) not in shared for node in q._root.array) <= 1
+
+
+def test_persistent_struct_hash_collisions():
+    class Key(str):
+        def __hash__(self):
+            return 7
+
+    keys = [Key('k%d' % i) for i in range(5)]
+    p = PersistentStruct()
+    for i, key in enumerate(keys):
+        p = p.evolve({key: i})
+    p = p.evolve(other=1)
+    assert len(p) == 6
+    assert [p[key] for key in keys] == list(range(5))
+    for key in keys:
+        p = p.without(key)
+    assert p == dict(other=1)
+
+
+@pytest.mark.parametrize('freeze_function', [_freeze, py_freeze], ids=['freeze', 'py_freeze'])
+@pytest.mark.parametrize('frozen_type', list(filter(None, [PyFrozenStruct, FastFrozenStruct])), ids=type_id)
+def test_freeze(freeze_function, frozen_type):
+    cached = frozen_type(x=1)
+    hash(cached)
+    unchanged = frozen_type(y=(1, 2))
+    shared = [1]
+    data = PyStruct(a=[1, dict(b={2})], c=cached, d=unchanged, e=frozen_type(f=[3]), g=(cached,), h=(shared, shared))
+
+    frozen = freeze_function(data, frozen_type)
+    assert frozen == dict(a=(1, dict(b=frozenset({2}))), c=cached, d=unchanged, e=dict(f=(3,)), g=(cached,), h=((1,), (1,)))
+    assert type(frozen) is type(frozen.a[1]) is type(frozen.e) is frozen_type
+    assert frozen.c is cached
+    assert frozen.d is unchanged
+    assert frozen.g is data.g
+    assert frozen.h[0] is frozen.h[1]
+    assert hash(frozen) == hash(freeze_function(data, frozen_type))
+    assert freeze_function(frozen, frozen_type) is frozen
+    assert freeze_function([{1}, frozenset([2]), 'x'], frozen_type) == ({1}, {2}, 'x')
+
+    cyclic = [1]
+    cyclic.append(dict(a=cyclic))
+    with pytest.raises(ValueError):
+        freeze_function(cyclic, frozen_type)
+    with pytest.raises(TypeError):
+        freeze_function(dict(a=bytearray()), frozen_type)
+
+
+def test_freeze_hashes_bottom_up():
+    frozen = freeze(dict(a=dict(b=dict(c=[1]))))
+    assert frozen.a.b._hash == hash(FrozenStruct(c=(1,)))
+    assert frozen._hash == hash(frozen)
+    assert type(freeze(dict(a=1))) is FrozenStruct
+
+
+@pytest.mark.parametrize('thaw_function', [_thaw, py_thaw], ids=['thaw', 'py_thaw'])
+def test_thaw(thaw_function):
+    frozen = freeze(dict(a=[1, dict(b={2})], c=(3,)))
+    thawed = thaw_function(frozen, PyStruct)
+    assert thawed == dict(a=[1, dict(b={2})], c=[3])
+    assert type(thawed) is type(thawed.a[1]) is PyStruct
+    assert type(thawed.a[1].b) is set
+    assert thaw_function(thawed, PyStruct) is not thawed
+
+    cyclic = []
+    cyclic.append(cyclic)
+    thawed = thaw_function((cyclic,), PyStruct)
+    assert thawed[0][0] is thawed[0]
+    assert type(thaw(dict(a=1))) is tri_struct.Struct
+
+
+@pytest.mark.parametrize('struct_type', list(filter(None, [PyStruct, FastStruct])), ids=type_id)
+def test_deepcopy(struct_type):
+    shared = [1]
+    frozen = FrozenStruct(a=1)
+    s = struct_type(a=struct_type(b=[shared, dict(c=shared)]), f=frozen, t=(1, [2]), p=PyStruct(x=[3]))
+    s.cycle = s
+    c = copy.deepcopy(s)
+    assert type(c) is type(c.a) is struct_type
+    assert c.cycle is c
+    assert c.a.b[0] is c.a.b[1]['c'] is not shared
+    assert c.f is frozen
+    assert c.t == (1, [2]) and c.t[1] is not s.t[1]
+    assert type(c.p) is PyStruct and c.p.x is not s.p.x
+    del c.cycle, s.cycle
+    assert c == s
+
+
+@pytest.mark.parametrize('frozen_type', list(filter(None, [PyFrozenStruct, FastFrozenStruct])), ids=type_id)
+def test_deepcopy_frozen(frozen_type):
+    f = frozen_type(a=1)
+    assert copy.deepcopy(f) is f
+
+
+@pytest.mark.skipif(FastStruct is None, reason='needs the c extension')
+def test_deepcopy_subclasses():
+    class WithDict(FastStruct):
+        pass
+
+    w = WithDict(a=[1])
+    w.__dict__['extra'] = [2]
+    c = copy.deepcopy(w)
+    assert type(c) is WithDict
+    assert c == w and c.a is not w.a
+    assert c.__dict__ == dict(extra=[2]) and c.__dict__['extra'] is not w.__dict__['extra']
+
+    class WithSlots(FastStruct):
+        __slots__ = ('extra',)
+
+    w = WithSlots(a=[1])
+    w.self = w
+    c = copy.deepcopy(w)
+    assert type(c) is WithSlots
+    assert c.a == [1] and c.a is not w.a
+    assert c.self is c
+
+    class WithSetState(WithSlots):
+        __slots__ = ()
+
+        def __setstate__(self, state):
+            self.state = state
+
+    w = WithSetState(a=1)
+    WithSlots.extra.__set__(w, [2])
+    c = copy.deepcopy(w)
+    assert type(c) is WithSetState
+    assert c == dict(a=1, state=(None, dict(extra=[2])))
+    assert c.state[1]['extra'] is not WithSlots.extra.__get__(w)
+
+
+@pytest.mark.parametrize('default_type', list(filter(None, [PyDefaultStruct, FastDefaultStruct])), ids=type_id)
+def test_deepcopy_default_struct(default_type):
+    d = default_type(list, a=[1])
+    c = copy.deepcopy(PyStruct(d=d)).d
+    assert type(c) is default_type
+    assert c.a == [1] and c.a is not d.a
+    assert c.missing == []
+    assert 'missing' not in d
+
+
+def run_in_threads(target, count=4):
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def run(i):
+        barrier.wait()
+        try:
+            target(i)
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_concurrent_mutation_and_repr(Struct):
+    s = Struct(a=1)
+
+    def work(i):
+        for n in range(2000):
+            if i % 2:
+                setattr(s, 'k%d' % (n % 10), n)
+                s.pop('k%d' % ((n + 5) % 10), None)
+            else:
+                assert 'a=1' in repr(s)
+                assert s.a == 1
+
+    run_in_threads(work)
+
+
+@pytest.mark.parametrize('default_type', list(filter(None, [PyDefaultStruct, FastDefaultStruct])), ids=type_id)
+def test_concurrent_default_struct(default_type):
+    d = default_type(list)
+    seen = [[] for _ in range(4)]
+
+    def work(i):
+        for n in range(1000):
+            seen[i].append(d['k%d' % (n % 50)])
+
+    run_in_threads(work)
+    assert len(d) == 50
+    for values in seen:
+        assert all(v is d['k%d' % (n % 50)] for n, v in enumerate(values))
+
+
+def test_concurrent_schema_struct(Struct):
+    Row = Struct.schema('a', 'b')
+    r = Row(1, 2)
+
+    def work(i):
+        for n in range(2000):
+            if i % 2:
+                r.b = n
+                r.extra = n
+                del r.extra
+            else:
+                assert set(r) <= {'a', 'b', 'extra'}
+                repr(r)
+                assert r.a == 1
+
+    run_in_threads(work)
+    assert dict(r) == dict(a=1, b=1999)
+
+
+def test_concurrent_pack_structs(packing):
+    pack, unpack = packing
+    rows = [PyStruct(a=i, b=i) for i in range(100)]
+
+    def work(i):
+        for n in range(200):
+            if i == 0:
+                rows[n % 100].c = n
+                del rows[n % 100].c
+            else:
+                for row in unpack(*pack(rows)):
+                    assert row.a == row.b
+
+    run_in_threads(work)
+
+
+@pytest.fixture
+def counting():
+    access_stats.reset()
+    yield access_stats
+    access_stats.disable()
+    access_stats.reset()
+
+
+def test_access_stats(Struct, counting):
+    s = Struct(a=1, copy=2)
+    s.a
+    assert counting.snapshot() == {}
+
+    counting.enable()
+    assert s.a == 1
+    assert s.copy == 2
+    assert s.get_attr('b') is None
+    with pytest.raises(AttributeError):
+        s.b
+    assert counting.snapshot() == {Struct: dict(hits=2, misses=3, missing=0, shadowed=1)}
+
+    counting.disable()
+    s.a
+    assert counting.snapshot()[Struct]['hits'] == 2
+    counting.reset()
+    assert counting.snapshot() == {}
+
+
+@pytest.mark.parametrize('default_type', list(filter(None, [PyDefaultStruct, FastDefaultStruct])), ids=type_id)
+def test_access_stats_per_key(default_type, counting):
+    counting.enable(per_key=True)
+    d = default_type(list)
+    d.x.append(1)
+    d.x.append(2)
+    assert counting.snapshot() == {
+        default_type: dict(hits=1, misses=1, missing=1, shadowed=0, keys=dict(
+            x=dict(hits=1, misses=1, missing=1, shadowed=0),
+        )),
+    }
+
+
+def test_default_backend():
+    if FastStruct is None:
+        assert (tri_struct.Struct, tri_struct.FrozenStruct, tri_struct.DefaultStruct) == (PyStruct, PyFrozenStruct, PyDefaultStruct)
+    else:
+        assert (tri_struct.Struct, tri_struct.FrozenStruct, tri_struct.DefaultStruct) == (FastStruct, FastFrozenStruct, FastDefaultStruct)
+    assert [t.__name__ for t in (tri_struct.Struct, tri_struct.FrozenStruct, tri_struct.DefaultStruct)] == ['Struct', 'FrozenStruct', 'DefaultStruct']
+
+
+def test_pure_backend_from_environment():
+    code = 'import tri_struct; print(tri_struct.Struct is tri_struct.PyStruct, tri_struct.FastStruct, tri_struct.Struct.__module__)'
+    output = subprocess.check_output([sys.executable, '-c', code], env=dict(os.environ, TRI_STRUCT_PURE='1'))
+    assert output.split() == [b'True', b'None', b'tri_struct']
+
+
+@pytest.mark.parametrize('protocol', range(pickle.HIGHEST_PROTOCOL + 1))
+def test_pickle_protocols(Struct, protocol):
+    s = Struct(a=1, b=Struct(c=2))
+    result = pickle.loads(pickle.dumps(s, protocol))
+    assert result == s
+    assert type(result) is type(result.b) is Struct
+
+
+@pytest.mark.parametrize('frozen_type', list(filter(None, [PyFrozenStruct, FastFrozenStruct])), ids=type_id)
+def test_frozen_struct_parity(frozen_type):
+    f = frozen_type(a=1)
+    with pytest.raises(AttributeError):
+        f._hash
+    assert hash(f) == f._hash
+    for mutate in [lambda: f.pop('a'), lambda: f.popitem(), lambda: f.__ior__(dict(b=2))]:
+        with pytest.raises(TypeError):
+            mutate()
+    assert f == dict(a=1)
+
+
+@pytest.mark.parametrize('default_type', list(filter(None, [PyDefaultStruct, FastDefaultStruct])), ids=type_id)
+def test_default_struct_parity(default_type):
+    d = default_type(list, a=1)
+    for result in [d.copy(), pickle.loads(pickle.dumps(d))]:
+        assert result == d
+        assert type(result) is default_type
+        result.b.append(1)
+        assert result == dict(a=1, b=[1])
+    assert d == dict(a=1)
+    # items named like a method are created like any other
+    assert d['copy'] == []
+
+
+@pytest.fixture(params=["c", "py"])
+def accessors(request, monkeypatch):
+    # the cached accessors are of the type of the parameter
+    _path._cached_path.cache_clear()
+    request.addfinalizer(_path._cached_path.cache_clear)
+    if request.param == "c":
+        if FastStruct is None:
+            pytest.skip("CStruct not available")
+        return _path._Path
+    monkeypatch.setattr(_path, '_Path', _path.PyPath)
+    monkeypatch.setattr(_path, '_Projection', _path.PyProjection)
+    return _path.PyPath
+
+
+class Address(object):
+    def __init__(self, city):
+        self.city = city
+
+
+def test_path(accessors, Struct):
+    city = path('customer.address.city')
+    assert type(city) is accessors
+    assert city.keys == ('customer', 'address', 'city')
+    assert repr(city) == "path(('customer', 'address', 'city'), default=None)"
+    assert path('customer.address.city') is city
+    assert path('customer.address.city', default=True) is not path('customer.address.city', default=1)
+    # specs and defaults made per call don't pile up in the cache
+    for _ in range(2000):
+        path(('customer', 'address', 'city'), default=object())
+    info = _path._cached_path.cache_info()
+    assert info.currsize == info.maxsize < 2000
+
+    rows = [
+        Struct(customer=Struct(address=Struct(city='Paris'))),
+        dict(customer=dict(address=Address('Oslo'))),
+        Struct(customer=Struct(address=Address(None))),
+        Struct(customer=None),
+        Struct(customer=Struct()),
+        Struct(),
+        17,
+    ]
+    assert city(rows[0]) == 'Paris'
+    assert city.map(rows) == ['Paris', 'Oslo', None, None, None, None, None]
+    assert city.map(iter(rows[:2])) == ['Paris', 'Oslo']
+    assert path('customer.address.city', default='?').map(rows) == ['Paris', 'Oslo', None, '?', '?', '?', '?']
+
+    d = DefaultStruct(a=1)
+    assert path('b.c')(d) is None
+    assert d == dict(a=1)
+
+    assert path(['a.b', 1])(Struct({'a.b': {1: 'x'}})) == 'x'
+    assert path([1])(Address('x')) is None
+    assert path('')(Struct({'': 2})) == 2
+    assert path([], default=[])(17) == 17
+    with pytest.raises(TypeError):
+        path([[]])(Struct())
+    with pytest.raises(TypeError):
+        city()
+
+
+def test_project(accessors, Struct):
+    order = Struct(id=17, customer=Struct(name='Alice', address=Struct(city='Paris')))
+    other = Struct(id=18)
+    columns = project(['id', 'customer.name', 'customer.address.city'])
+    assert columns(order) == (17, 'Alice', 'Paris')
+    assert columns.map([order, other]) == [(17, 'Alice', 'Paris'), (18, None, None)]
+    assert project([])(order) == ()
+
+    named = project(dict(id='id', customer='customer.name'), default='-', struct_type=Struct)
+    assert named.map([order, other]) == [dict(id=17, customer='Alice'), dict(id=18, customer='-')]
+    assert all(type(s) is Struct for s in named.map([order, other]))
+    wide = project({'key_%d' % i: 'id' for i in range(10)})
+    assert wide(order) == {'key_%d' % i: 17 for i in range(10)}
+    assert type(wide(order)) is tri_struct.Struct
+
+
+@pytest.fixture
+def thunk_counts():
+    LazyStruct.reset_thunk_counts()
+    yield LazyStruct.thunk_counts
+    LazyStruct.reset_thunk_counts()
+
+
+def test_lazy_struct(thunk_counts):
+    calls = []
+
+    def thunk(value):
+        def compute():
+            calls.append(value)
+            return value
+        return compute
+
+    s = LazyStruct(a=thunk(1), b=thunk(2), items=thunk(3), c=4)
+    assert isinstance(s, tri_struct.Struct)
+    assert repr(s) == str(s) == 'LazyStruct(a=<lazy>, b=<lazy>, c=4, items=<lazy>)'
+    assert len(s) == 4
+    assert 'a' in s and 'd' not in s
+    assert sorted(s) == sorted(s.keys()) == ['a', 'b', 'c', 'items']
+    assert s.pending() == ['a', 'b', 'items']
+    assert list(s.items(evaluate=False)) == [('c', 4)]
+    # a pending key doesn't shadow the method, like a missing one
+    assert callable(s.items)
+    assert calls == []
+
+    assert s.a == 1
+    assert s.a == 1
+    assert s['b'] == 2
+    assert s.get('items') == 3
+    assert s.items == 3
+    assert calls == [1, 2, 3]
+    assert s.pending() == []
+    assert repr(s) == 'LazyStruct(a=1, b=2, c=4, items=3)'
+
+    assert not hasattr(s, 'd')
+    assert s.get('d') is None
+    assert s.get_attr('d', 5) == 5
+    with pytest.raises(AttributeError):
+        s.d
+    with pytest.raises(KeyError):
+        s['d']
+    assert thunk_counts() == dict(
+        created=3, evaluated=3,
+        keys=dict(a=dict(created=1, evaluated=1), b=dict(created=1, evaluated=1), items=dict(created=1, evaluated=1)),
+    )
+
+
+def test_lazy_struct_evaluation_control(thunk_counts):
+    calls = []
+    s = LazyStruct(a=lambda: calls.append('a') or 1, b=lambda: calls.append('b') or 2)
+    for key in s:
+        assert key in s
+    assert calls == []
+    s.force('b')
+    assert calls == ['b']
+    assert list(s.values(evaluate=False)) == [2]
+    assert sorted(s.values()) == [1, 2]
+    assert calls == ['b', 'a']
+    s.force()
+    assert calls == ['b', 'a']
+    assert thunk_counts().evaluated == 2
+
+    s = LazyStruct(a=lambda: 1, b=lambda: 2, c=lambda: 3)
+    s.b = 20
+    s.update(c=30)
+    assert s.pending() == ['a']
+    assert s == dict(a=1, b=20, c=30)
+    del s.a
+    with pytest.raises(AttributeError):
+        del s.a
+    assert s.pending() == [] and len(s) == 2
+    assert thunk_counts() == dict(
+        created=5, evaluated=3,
+        keys=dict(a=dict(created=2, evaluated=2), b=dict(created=2, evaluated=1), c=dict(created=1, evaluated=0)),
+    )
+
+    s = LazyStruct(a=lambda: 1, b=lambda: 2)
+    assert s.pop('a') == 1
+    assert s.setdefault('b') == 2
+    assert s.pop('c', None) is None
+    assert s.popitem() == ('b', 2)
+    s = LazyStruct(a=lambda: 1)
+    s.clear()
+    assert len(s) == 0 and s.pending() == []
+
+    failures = []
+
+    def flaky():
+        if not failures:
+            failures.append(1)
+            raise ValueError()
+        return 'ok'
+    s = LazyStruct(a=flaky)
+    with pytest.raises(ValueError):
+        s.a
+    assert s.a == 'ok'
+
+
+def test_lazy_struct_keys_view():
+    s = LazyStruct(a=lambda: 1, b=2)
+    keys = s.keys()
+    assert isinstance(keys, collections.abc.KeysView)
+    assert len(keys) == 2 and 'a' in keys and 'c' not in keys
+    assert keys == {'a', 'b'} and keys & {'a', 'c'} == {'a'}
+    assert list(keys) == ['b', 'a'] and list(reversed(keys)) == ['a', 'b']
+    assert repr(keys) == "_LazyKeys(['b', 'a'])"
+    s.c = lambda: 3
+    assert sorted(keys) == ['a', 'b', 'c']
+    assert s.pending() == ['a']
+
+
+def test_lazy_struct_thunk_counts_are_bounded(thunk_counts):
+    for i in range(2000):
+        LazyStruct({'key_%d' % i: lambda: 1}).force()
+    counts = thunk_counts()
+    assert counts.created == counts.evaluated == 2000
+    assert len(counts['keys']) == 1024
+    assert counts['keys']['key_0'] == dict(created=1, evaluated=1)
+    assert 'key_1999' not in counts['keys']
+
+
+def test_lazy_struct_copies():
+    calls = []
+    s = LazyStruct(a=lambda: calls.append('a') or [1], b=lambda: [2])
+    s.b
+    c = copy.copy(s)
+    assert type(c) is LazyStruct
+    assert c.pending() == ['a']
+    assert c.b is s.b
+    d = copy.deepcopy(s)
+    assert d.pending() == ['a']
+    assert d.b == [2] and d.b is not s.b
+    assert calls == []
+
+    assert merged(s, dict(c=3)) == dict(a=[1], b=[2], c=3)
+    assert tri_struct.Struct(s) == dict(a=[1], b=[2])
+    assert dict(c) == dict(a=[1], b=[2])
+    assert c == s and not c != s
+
+    p = pickle.loads(pickle.dumps(LazyStruct(a=lambda: 1)))
+    assert type(p) is LazyStruct
+    assert p == dict(a=1) and p.pending() == []
+
+
+@pytest.mark.parametrize('diff_function', [_diff, py_diff], ids=['diff', 'py_diff'])
+def test_diff(diff_function, Struct):
+    shared = Struct(x=[1], y=Struct(z=1))
+    a = Struct(same=shared, a=Struct(b=Struct(c=1, d=2), e=1), removed=1, changed=[1], to_leaf=Struct(f=1), plain=dict(g=1))
+    b = Struct(same=shared, a=Struct(b=Struct(c=1, d=3), e=1, added=Struct()), changed=[2], to_leaf=1, plain=Struct(g=1), added=1)
+    assert diff_function(a, b) == (
+        [('a', 'added'), ('added',)],
+        [('removed',)],
+        [('a', 'b', 'd'), ('changed',), ('to_leaf',)],
+    )
+    assert diff_function(b, a) == (
+        [('removed',)],
+        [('a', 'added'), ('added',)],
+        [('a', 'b', 'd'), ('changed',), ('to_leaf',)],
+    )
+    assert diff_function(a, a) == ([], [], [])
+    assert diff_function(a, tri_struct.thaw(a)) == ([], [], [])
+    assert diff_function({}, {1: {2: 3}}) == ([(1,)], [], [])
+    assert diff_function({1: {2: 3}}, {1: {2: 4}}) == ([], [], [(1, 2)])
+
+    nan = float('nan')
+    assert diff_function(dict(a=nan), dict(a=nan)) == ([], [], [])
+    assert diff_function(dict(a=nan), dict(a=float('nan'))) == ([], [], [('a',)])
+
+    cyclic_a, cyclic_b = Struct(x=1), Struct(x=2)
+    cyclic_a.self, cyclic_b.self = cyclic_a, cyclic_b
+    assert diff_function(cyclic_a, cyclic_b) == ([], [], [('x',)])
+
+    with pytest.raises(TypeError):
+        diff_function(a, [])
+
+
+@pytest.mark.parametrize('diff_function', [_diff, py_diff], ids=['diff', 'py_diff'])
+@pytest.mark.parametrize('frozen_type', list(filter(None, [PyFrozenStruct, FastFrozenStruct])), ids=type_id)
+def test_diff_frozen(diff_function, frozen_type):
+    counting = CountingEq()
+    a = freeze(dict(a=dict(x=counting), b=dict(x=-1)), frozen_type)
+    b = freeze(dict(a=dict(x=CountingEq()), b=dict(x=-2)), frozen_type)
+    # -1 and -2 hash the same, so equal hashes still need a comparison
+    assert hash(a.b) == hash(b.b)
+    CountingEq.calls = 0
+    assert diff_function(a, b) == ([], [], [('b', 'x')])
+    assert CountingEq.calls == 1
+
+    # different cached hashes: looked into without comparing first
+    c = freeze(dict(a=dict(x=counting, y=1)), frozen_type)
+    d = freeze(dict(a=dict(x=counting, y=2)), frozen_type)
+    CountingEq.calls = 0
+    assert diff_function(c, d) == ([], [], [('a', 'y')])
+    assert CountingEq.calls == 0
+
+
+def test_diff_result():
+    a = tri_struct.Struct(a=tri_struct.Struct(x=1, y=2), b=1)
+    b = tri_struct.Struct(a=tri_struct.Struct(x=1, y=3), c=1)
+    result = diff(a, b)
+    assert type(result) is tri_struct.Struct
+    assert result == dict(added=[('c',)], removed=[('b',)], changed=[('a', 'y')])
+    assert path(result.changed[0])(b) == 3
+
+
+@pytest.mark.skipif(FastStruct is None, reason='needs the c extension')
+def test_c_docstrings():
+    for cls in [FastStruct, FastFrozenStruct, FastDefaultStruct]:
+        assert '\\n' not in cls.__doc__
+        assert cls.__doc__.splitlines()[0].startswith(cls.__name__ + '(')